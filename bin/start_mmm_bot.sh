@@ -14,10 +14,10 @@ cd "$(dirname "$0")"
 # cd to the root
 cd ..
 
-poetry run alembic upgrade head > /dev/null 2>&1
+poetry run python -m mm_bot.model.schema
 
 while true
 do
-    REGISTER_TIMEOUT=true poetry run python mmm_bot.py
+    REGISTER_TIMEOUT=${REGISTER_TIMEOUT:-true} poetry run python mmm_bot.py
     echo "[xxxxxxxxxxxxx] Exit from mmm_bot.py, with exit code", $?
 done
@@ -16,6 +16,6 @@ cd "$(dirname "$0")"
 cd ..
 
 # always ensure db schema is up to date
-poetry run alembic upgrade head > /dev/null 2>&1
+poetry run python -m mm_bot.model.schema
 
 poetry run python -u server.py
@@ -11,6 +11,9 @@ import os
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 from mm_bot.config import config as internal_config
 import mm_bot.model.order
+import mm_bot.model.pnl
+import mm_bot.model.archive
+import mm_bot.model.outbox
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -65,6 +68,17 @@ def run_migrations_online():
     and associate a connection with the context.
 
     """
+    # the tests of the migrations pass their own connection
+    connection = config.attributes.get('connection', None)
+    if connection is not None:
+        context.configure(
+            connection=connection, target_metadata=target_metadata
+        )
+
+        with context.begin_transaction():
+            context.run_migrations()
+        return
+
     connectable = engine_from_config(
         config.get_section(config.config_ini_section),
         prefix="sqlalchemy.",
@@ -0,0 +1,52 @@
+"""unique order identifiers
+
+Revision ID: 33e169ae0963
+Revises: 4858f8eb42b6
+Create Date: 2026-10-19 09:12:41.308152+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '33e169ae0963'
+down_revision = '4858f8eb42b6'
+branch_labels = None
+depends_on = None
+
+
+# the last updated row of every identifier, it carries the status the watcher wrote last
+KEPT = """
+    SELECT id FROM (
+        SELECT id, ROW_NUMBER() OVER (
+            PARTITION BY {identifier} ORDER BY updated_at IS NULL, updated_at DESC, id DESC
+        ) AS position
+        FROM {table}
+    ) AS ranked WHERE position = 1
+"""
+KEPT_MAKER_ORDERS = KEPT.format(identifier='exchange, tx_hash, tx_output_index', table='maker_orders')
+KEPT_TAKER_ORDERS = KEPT.format(identifier='exchange, order_id', table='taker_orders')
+
+
+def upgrade():
+    # the taker orders of the duplicated maker orders are moved to the kept one
+    op.execute(f"""
+        UPDATE taker_orders SET maker_order_id = (
+            SELECT kept.id FROM maker_orders AS duplicate
+            JOIN maker_orders AS kept ON kept.exchange = duplicate.exchange
+                AND kept.tx_hash = duplicate.tx_hash
+                AND kept.tx_output_index = duplicate.tx_output_index
+            WHERE duplicate.id = taker_orders.maker_order_id AND kept.id IN ({KEPT_MAKER_ORDERS})
+        )
+        WHERE maker_order_id IN (SELECT id FROM maker_orders WHERE id NOT IN ({KEPT_MAKER_ORDERS}))
+    """)
+    op.execute(f"DELETE FROM maker_orders WHERE id NOT IN ({KEPT_MAKER_ORDERS})")
+    op.execute(f"DELETE FROM taker_orders WHERE id NOT IN ({KEPT_TAKER_ORDERS})")
+
+    op.create_index('maker_orders_identifier', 'maker_orders', ['exchange', 'tx_hash', 'tx_output_index'], unique=True)
+    op.create_index('taker_orders_identifier', 'taker_orders', ['exchange', 'order_id'], unique=True)
+
+def downgrade():
+    op.drop_index('taker_orders_identifier', 'taker_orders')
+    op.drop_index('maker_orders_identifier', 'maker_orders')
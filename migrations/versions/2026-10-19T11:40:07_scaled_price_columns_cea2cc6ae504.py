@@ -0,0 +1,102 @@
+"""scaled price columns
+
+Revision ID: cea2cc6ae504
+Revises: 33e169ae0963
+Create Date: 2026-10-19 11:40:07.553260+00:00
+
+"""
+from decimal import Decimal
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+from mm_bot.model import fixed_point
+
+
+# revision identifiers, used by Alembic.
+revision = 'cea2cc6ae504'
+down_revision = '33e169ae0963'
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH = 1000
+
+
+def _maker_price_quantity(order_type, order_body):
+    sends_unit = Decimal(order_body['sendsUnit'])
+    receives_unit = Decimal(order_body['receivesUnit'])
+    if order_type == 'buy':
+        return sends_unit / receives_unit, receives_unit
+    else:
+        return receives_unit / sends_unit, sends_unit
+
+
+def _taker_price_quantity(order_type, order_body):
+    return Decimal(order_body['price']), Decimal(order_body['quantity'])
+
+
+def _backfill(table_name, price_quantity):
+    """
+    The same values as Order.scaled_values, frozen here as the model may change
+    """
+    connection = op.get_bind()
+    table = sa.table(
+        table_name,
+        sa.column('id', sa.Integer), sa.column('order_type', sa.String), sa.column('order_body', sa.Text),
+        sa.column('price', sa.BigInteger), sa.column('quantity', sa.BigInteger), sa.column('notional', sa.BigInteger),
+    )
+    update = table.update().where(table.c.id == sa.bindparam('_id')).values(
+        price=sa.bindparam('_price'), quantity=sa.bindparam('_quantity'), notional=sa.bindparam('_notional')
+    )
+
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select([table.c.id, table.c.order_type, table.c.order_body])
+            .where(table.c.id > last_id).order_by(table.c.id).limit(BACKFILL_BATCH)
+        ).fetchall()
+        if not rows:
+            break
+
+        values = []
+        for row_id, order_type, order_body in rows:
+            try:
+                # postgresql drivers return the json columns parsed
+                if isinstance(order_body, str):
+                    order_body = json.loads(order_body)
+                price, quantity = price_quantity(order_type, order_body)
+                values.append({
+                    '_id': row_id,
+                    '_price': fixed_point.to_scaled(price, fixed_point.PRICE_COLUMN_DECIMALS),
+                    '_quantity': fixed_point.to_scaled(quantity, fixed_point.AMOUNT_COLUMN_DECIMALS),
+                    '_notional': fixed_point.to_scaled(price * quantity, fixed_point.AMOUNT_COLUMN_DECIMALS),
+                })
+            except (KeyError, TypeError, ValueError, ArithmeticError):
+                continue
+        if values:
+            connection.execute(update, values)
+        last_id = rows[-1][0]
+
+
+def upgrade():
+    for table_name in ('maker_orders', 'taker_orders'):
+        op.add_column(table_name, sa.Column('price', sa.BigInteger(), nullable=True))
+        op.add_column(table_name, sa.Column('quantity', sa.BigInteger(), nullable=True))
+        op.add_column(table_name, sa.Column('notional', sa.BigInteger(), nullable=True))
+
+    _backfill('maker_orders', _maker_price_quantity)
+    _backfill('taker_orders', _taker_price_quantity)
+
+    op.create_index('maker_orders_price', 'maker_orders', ['price'])
+    op.create_index('taker_orders_price', 'taker_orders', ['price'])
+
+def downgrade():
+    op.drop_index('taker_orders_price', 'taker_orders')
+    op.drop_index('maker_orders_price', 'maker_orders')
+    for table_name in ('maker_orders', 'taker_orders'):
+        # sqlite drops columns by recreating the table
+        with op.batch_alter_table(table_name) as batch_op:
+            batch_op.drop_column('notional')
+            batch_op.drop_column('quantity')
+            batch_op.drop_column('price')
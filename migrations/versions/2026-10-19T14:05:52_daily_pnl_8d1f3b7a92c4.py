@@ -0,0 +1,61 @@
+"""daily pnl
+
+Revision ID: 8d1f3b7a92c4
+Revises: cea2cc6ae504
+Create Date: 2026-10-19 14:05:52.184907+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d1f3b7a92c4'
+down_revision = 'cea2cc6ae504'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'daily_pnl',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('currency', sa.VARCHAR(length=255), nullable=False),
+        sa.Column('filled', sa.Integer(), nullable=False),
+        sa.Column('volume', sa.BigInteger(), nullable=False),
+        sa.Column('profit', sa.BigInteger(), nullable=False),
+        sa.Column('settled', sa.Integer(), nullable=False),
+        sa.Column('settled_volume', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('day', 'currency')
+    )
+
+    # the filled orders in a range of get_filled_orders_in_range
+    op.create_index('taker_orders_filled', 'taker_orders', ['status', 'created_at'])
+
+    # utcnow, without created_at and updated_at
+    now = "(CURRENT_TIMESTAMP AT TIME ZONE 'UTC')" if op.get_bind().dialect.name == 'postgresql' else 'CURRENT_TIMESTAMP'
+    # the same sums as mm_bot.model.pnl.rollup_values, from the scaled columns,
+    # on the day of mm_bot.model.pnl.day_of
+    op.execute(f"""
+        INSERT INTO daily_pnl (day, currency, filled, volume, profit, settled, settled_volume)
+        SELECT date(COALESCE(taker.created_at, taker.updated_at, {now})), taker.currency, COUNT(*), COALESCE(SUM(taker.notional), 0),
+            COALESCE(SUM(CASE WHEN maker.order_type = 'buy' THEN taker.notional - maker.notional
+                ELSE maker.notional - taker.notional END), 0), 0, 0
+        FROM taker_orders AS taker
+        LEFT JOIN maker_orders AS maker ON maker.id = taker.maker_order_id
+        WHERE taker.status = 'filled'
+        GROUP BY date(COALESCE(taker.created_at, taker.updated_at, {now})), taker.currency
+    """)
+    op.execute(f"""
+        INSERT INTO daily_pnl (day, currency, filled, volume, profit, settled, settled_volume)
+        SELECT date(COALESCE(created_at, updated_at, {now})), currency, 0, 0, 0, COUNT(*), COALESCE(SUM(notional), 0)
+        FROM maker_orders
+        WHERE status = 'settled'
+        GROUP BY date(COALESCE(created_at, updated_at, {now})), currency
+        ON CONFLICT (day, currency) DO UPDATE SET
+            settled = excluded.settled, settled_volume = excluded.settled_volume
+    """)
+
+def downgrade():
+    op.drop_index('taker_orders_filled', 'taker_orders')
+    op.drop_table('daily_pnl')
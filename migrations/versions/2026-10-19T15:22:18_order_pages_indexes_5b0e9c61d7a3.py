@@ -0,0 +1,24 @@
+"""order pages indexes
+
+Revision ID: 5b0e9c61d7a3
+Revises: 8d1f3b7a92c4
+Create Date: 2026-10-19 15:22:18.640371+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b0e9c61d7a3'
+down_revision = '8d1f3b7a92c4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the pages of a currency by id descending, taker_orders_maker_order_id of the join exists since create_tables
+    op.create_index('maker_orders_currency', 'maker_orders', ['currency', 'id'])
+
+def downgrade():
+    op.drop_index('maker_orders_currency', 'maker_orders')
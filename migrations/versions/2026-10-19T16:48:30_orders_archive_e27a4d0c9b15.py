@@ -0,0 +1,63 @@
+"""orders archive
+
+Revision ID: e27a4d0c9b15
+Revises: 5b0e9c61d7a3
+Create Date: 2026-10-19 16:48:30.912644+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e27a4d0c9b15'
+down_revision = '5b0e9c61d7a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'maker_orders_archive',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('exchange', sa.String(), nullable=True),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('order_type', sa.String(), nullable=True),
+        sa.Column('currency', sa.VARCHAR(length=255), nullable=False),
+        sa.Column('order_body', sa.JSON(), nullable=True),
+        sa.Column('tx_hash', sa.String(), nullable=True),
+        sa.Column('tx_output_index', sa.Integer(), nullable=True),
+        sa.Column('block_height', sa.String(), nullable=True),
+        sa.Column('taker_order_body', sa.JSON(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('price', sa.BigInteger(), nullable=True),
+        sa.Column('quantity', sa.BigInteger(), nullable=True),
+        sa.Column('notional', sa.BigInteger(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('maker_orders_archive_currency', 'maker_orders_archive', ['currency', 'id'])
+
+    op.create_table(
+        'taker_orders_archive',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('exchange', sa.String(), nullable=True),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('order_type', sa.String(), nullable=True),
+        sa.Column('currency', sa.VARCHAR(length=255), nullable=False),
+        sa.Column('order_body', sa.JSON(), nullable=True),
+        sa.Column('order_id', sa.String(), nullable=True),
+        sa.Column('maker_order_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('price', sa.BigInteger(), nullable=True),
+        sa.Column('quantity', sa.BigInteger(), nullable=True),
+        sa.Column('notional', sa.BigInteger(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('taker_orders_archive_filled', 'taker_orders_archive', ['status', 'created_at'])
+    op.create_index('taker_orders_archive_maker_order_id', 'taker_orders_archive', ['maker_order_id'])
+
+def downgrade():
+    op.drop_table('taker_orders_archive')
+    op.drop_table('maker_orders_archive')
@@ -0,0 +1,40 @@
+"""taker orders settlement
+
+Revision ID: a93c5f12e6d8
+Revises: e27a4d0c9b15
+Create Date: 2026-10-19 18:03:44.275103+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a93c5f12e6d8'
+down_revision = 'e27a4d0c9b15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table_name in ('taker_orders', 'taker_orders_archive'):
+        op.add_column(table_name, sa.Column('settlement', sa.String(), nullable=True))
+
+    # the fills already processed by the order fill watcher, the others are left to it
+    for maker_orders, taker_orders in (('maker_orders', 'taker_orders'), ('maker_orders_archive', 'taker_orders_archive')):
+        op.execute(f"""
+            UPDATE {taker_orders} SET settlement = (
+                SELECT {maker_orders}.status FROM {maker_orders} WHERE {maker_orders}.id = {taker_orders}.maker_order_id
+            )
+            WHERE status = 'filled' AND maker_order_id IN (
+                SELECT id FROM {maker_orders} WHERE status IN ('settled', 'expired')
+            )
+        """)
+
+    op.create_index('taker_orders_settlement', 'taker_orders', ['status', 'settlement'])
+
+def downgrade():
+    op.drop_index('taker_orders_settlement', 'taker_orders')
+    for table_name in ('taker_orders_archive', 'taker_orders'):
+        with op.batch_alter_table(table_name) as batch_op:
+            batch_op.drop_column('settlement')
@@ -0,0 +1,41 @@
+"""outbox
+
+Revision ID: c4d81e5f0a27
+Revises: a93c5f12e6d8
+Create Date: 2026-10-19 19:31:05.614820+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4d81e5f0a27'
+down_revision = 'a93c5f12e6d8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'outbox',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('key', sa.VARCHAR(length=255), nullable=False),
+        sa.Column('payload', sa.JSON(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('outbox_key', 'outbox', ['key'], unique=True)
+    op.create_index('outbox_due', 'outbox', ['status', 'next_attempt_at'])
+
+def downgrade():
+    op.drop_index('outbox_due', 'outbox')
+    op.drop_index('outbox_key', 'outbox')
+    op.drop_table('outbox')
@@ -0,0 +1,44 @@
+"""monotonic order ids
+
+Revision ID: f1a6d2b8c390
+Revises: c4d81e5f0a27
+Create Date: 2026-10-19 20:14:26.503318+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1a6d2b8c390'
+down_revision = 'c4d81e5f0a27'
+branch_labels = None
+depends_on = None
+
+ORDER_TABLES = ('maker_orders', 'taker_orders')
+
+
+def upgrade():
+    # the ids of postgresql come from a sequence, sqlite hands out max(id) + 1 without AUTOINCREMENT
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    for table_name in ORDER_TABLES:
+        with op.batch_alter_table(table_name, recreate='always', table_kwargs={'sqlite_autoincrement': True}):
+            pass
+
+        # the next id is above the archived ones too
+        op.execute(f"DELETE FROM sqlite_sequence WHERE name = '{table_name}'")
+        op.execute(f"""
+            INSERT INTO sqlite_sequence (name, seq) SELECT '{table_name}', COALESCE(MAX(id), 0) FROM (
+                SELECT id FROM {table_name} UNION ALL SELECT id FROM {table_name}_archive
+            ) AS ids
+        """)
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    for table_name in ORDER_TABLES:
+        with op.batch_alter_table(table_name, recreate='always', table_kwargs={'sqlite_autoincrement': False}):
+            pass
@@ -13,13 +13,45 @@ else:
     config_yaml = default_config_yaml
 
 # TODO do not have a default yaml file - just add ConfigYamlEnv if user provides it
+# swapped in place by swap_config_file, see mm_bot.config.reloader
+yaml_env = everett.ext.yamlfile.ConfigYamlEnv([config_yaml])
 manager = everett.manager.ConfigManager([
     everett.manager.ConfigOSEnv(),
-    everett.ext.yamlfile.ConfigYamlEnv([config_yaml]),
+    yaml_env,
     everett.manager.ConfigDictEnv({
         # db file is relative to the working dir, relative path is the path 'raw' after the three initial slashses
         'MMBC_DATABASE_URL': 'sqlite+pysqlite:///db/database.sqlite',
+        'MMBC_DATABASE_SQLITE_READERS': 4, # read only connections per process
+        'MMBC_DATABASE_SQLITE_JOURNAL_MODE': 'WAL',
+        'MMBC_DATABASE_SQLITE_SYNCHRONOUS': 'NORMAL',
+        'MMBC_DATABASE_SQLITE_MMAP_SIZE': 268435456, # in bytes
+        'MMBC_DATABASE_SQLITE_CACHE_SIZE': -16384, # in KiB when negative, in pages otherwise
+        'MMBC_DATABASE_SQLITE_BUSY_TIMEOUT': 5000, # in ms
+        'MMBC_DATABASE_POSTGRES_MIN_SIZE': 1, # pooled connections per process
+        'MMBC_DATABASE_POSTGRES_MAX_SIZE': 4,
+        'MMBC_ARCHIVE_RETENTION_DAYS': 30, # orders done with for longer are archived, 0 to keep them
+        'MMBC_ARCHIVE_BATCH_SIZE': 200, # maker orders per transaction
+        'MMBC_ARCHIVE_INTERVAL': 600, # in seconds
+        'MMBC_OUTBOX_CONCURRENCY': 4, # transfers and unlocks running at once
+        'MMBC_OUTBOX_MAX_ATTEMPTS': 5,
+        'MMBC_OUTBOX_BACKOFF': 5, # in seconds, doubled after every failed attempt
+        'MMBC_OUTBOX_DELAY': 1, # in seconds
+        'MMBC_WATCHER_MIN_DELAY': 0.5, # in seconds, between the polls while orders are open
+        'MMBC_WATCHER_MAX_DELAY': 30, # in seconds, between the polls when idle
+        'MMBC_WATCHER_BACKOFF': 2, # the delay is multiplied by it after every idle poll
+        'MMBC_WATCHER_BINANCE_BUDGET': 60, # polls per minute
+        'MMBC_WATCHER_BORDERLESS_BUDGET': 30,
+        'MMBC_ORDER_STORE_FLUSH_INTERVAL': 1, # in seconds, between the writes of the changed orders
+        'MMBC_ORDER_STORE_BATCH_SIZE': 500, # changed orders written before the interval
+        'MMBC_JOURNAL_DIR': 'db/journal', # empty to start without the journal
+        'MMBC_JOURNAL_FSYNC_INTERVAL': 0.2, # in seconds, between the writes of the events
+        'MMBC_JOURNAL_SNAPSHOT_EVENTS': 10000, # events compacted into a snapshot
+        'MMBC_JOURNAL_MAX_BOOK_AGE': 60, # in seconds, older books of the journal are not quoted on
+        'MMBC_WATCHER_UNLOCK_SWEEP_INTERVAL': 3600, # in seconds, the unlocks are scheduled by block, the sweep catches the rest
+        'MMBC_SERVER_ORDERS_PAGE_SIZE': 100, # maker orders per page of /api/orders
+        'MMBC_CONFIG_POLL_INTERVAL': 1, # in seconds, between the checks of the config file where inotify is not available
         'MMBC_SLEEP': 1,
+        'MMBC_FIRST_BOOKS_TIMEOUT': 10, # in seconds, the first tick waits for the books of both exchanges
         'MMBC_DRY_RUN': 'true',
         'MMBC_MIN_PROFITABILITY_RATE': '0.001',
         'MMBC_MAX_QTY_PER_ORDER': '0.007',
@@ -35,9 +67,29 @@ manager = everett.manager.ConfigManager([
         'MMBC_EXCHANGE_BORDERLESS_MAX_NRG_ACCEPT_DAILY': 30000,
         'MMBC_EXCHANGE_BORDERLESS_DEPOSIT_LENGTH': 100,
         'MMBC_EXCHANGE_BORDERLESS_SETTLEMENT_WINDOW_LENGTH': 150,
+        'MMBC_EXCHANGE_BORDERLESS_INCREMENTAL_MATCHED_ORDERS': 'true', # fetch only the matches since the last seen
+        'MMBC_EXCHANGE_BORDERLESS_MATCHED_ORDERS_REORG_DEPTH': 6, # blocks fetched again
         'MMBC_EXCHANGE_DESTINATION_MINER_SCOOKIE': 'testCookie123',
         })
     ])
 config = manager.with_namespace('mmbc')
 
+
+def read_config_file():
+    """
+    The config with the config file read again and the new file, to be
+    validated before swap_config_file
+    """
+    new_yaml_env = everett.ext.yamlfile.ConfigYamlEnv([config_yaml])
+    envs = [new_yaml_env if env is yaml_env else env for env in manager.envs]
+    return everett.manager.ConfigManager(envs).with_namespace('mmbc'), new_yaml_env
+
+
+def swap_config_file(new_yaml_env) -> None:
+    """
+    config reads the values of new_yaml_env from now on
+    """
+    yaml_env.cfg = new_yaml_env.cfg
+    yaml_env.path = new_yaml_env.path
+
 __all__ = ['config']
@@ -0,0 +1,200 @@
+"""
+Reload of the config file without a restart
+
+The web ui (server.py save_config) replaces the config file of the strategy.
+The file is watched with inotify, or by polling its mtime every
+MMBC_CONFIG_POLL_INTERVAL seconds where inotify is not available. A change is
+validated with the validator on a config read aside, an invalid file is
+logged and the running config is kept. A valid one is swapped in:
+
+- the settings (see mm_bot.config.settings) of the strategy, the exchanges
+  and the watchers are replaced at once between two ticks
+- an exchange whose credentials changed gets them, the others are untouched
+
+The orders, the books and the loops of the exchanges go on. A change of the
+strategy or of the currency pair still restarts the bot.
+"""
+import asyncio
+import ctypes
+import ctypes.util
+import dataclasses
+import logging
+import os
+import struct
+from typing import Callable, Optional, Tuple
+
+import aiopubsub
+
+from mm_bot import helpers
+from mm_bot.config import config, config_yaml, read_config_file, swap_config_file, validator
+from mm_bot.config.settings import Settings
+
+# the keys the web ui writes and the settings
+WATCHED_PARAMS = list(dict(
+    validator.REQUIRED_PARAMS + [(validator.STRATEGY_NAME_KEY, str)]
+    + [(field.name, field.type) for field in dataclasses.fields(Settings)]
+).items())
+
+RESTART_PARAMS = (validator.STRATEGY_NAME_KEY, 'wallet_base_currency_name', 'wallet_counter_currency_name')
+
+# in the order of the arguments of set_credentials
+EXCHANGE_CREDENTIALS = {
+    'binance': ('exchange_source_api_key', 'exchange_source_api_secret'),
+    'borderless': (
+        'exchange_destination_miner_address',
+        'exchange_destination_miner_scookie',
+        'exchange_destination_nrg_public_key',
+        'exchange_destination_nrg_private_key',
+        'wallet_base_currency_wallet',
+        'wallet_counter_currency_wallet',
+    ),
+}
+
+# see inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+_INOTIFY_EVENT = struct.Struct('iIII')
+
+
+def _libc_inotify():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class ConfigFileWatcher:
+    """
+    Calls on_change once the file was replaced or written, a burst of changes
+    is one call
+    """
+
+    def __init__(self, path: str, on_change: Callable[[], None], poll_interval: float, debounce: float = 0.2):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._path = os.path.abspath(path)
+        self._on_change = on_change
+        self._debounce = debounce
+        self._poll_loop = aiopubsub.loop.Loop(self._poll, delay=poll_interval)
+        self._fd: Optional[int] = None
+        self._last_stat: Optional[Tuple[int, int, int]] = None
+        self._pending: Optional[asyncio.Handle] = None
+
+    def start(self) -> None:
+        libc = _libc_inotify()
+        if libc is not None:
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            # the directory, the file is replaced by a rename
+            if fd >= 0 and libc.inotify_add_watch(fd, os.path.dirname(self._path).encode(), IN_CLOSE_WRITE | IN_MOVED_TO) >= 0:
+                self._fd = fd
+                asyncio.get_event_loop().add_reader(fd, self._read_events)
+                self._logger.info('Watching %s with inotify', self._path)
+                return
+            if fd >= 0:
+                os.close(fd)
+
+        self._logger.info('inotify not available, polling %s', self._path)
+        self._last_stat = self._stat()
+        self._poll_loop.start()
+
+    async def stop(self) -> None:
+        if self._pending is not None:
+            self._pending.cancel()
+        if self._fd is not None:
+            asyncio.get_event_loop().remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = None
+        await self._poll_loop.stop_wait()
+
+    def _read_events(self) -> None:
+        try:
+            data = os.read(self._fd, 4096)
+        except BlockingIOError:
+            return
+
+        name = os.path.basename(self._path)
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = _INOTIFY_EVENT.unpack_from(data, offset)
+            offset += _INOTIFY_EVENT.size
+            if data[offset:offset + length].rstrip(b'\0').decode() == name:
+                self._changed()
+            offset += length
+
+    def _stat(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(self._path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    async def _poll(self) -> None:
+        stat = self._stat()
+        if stat != self._last_stat:
+            self._last_stat = stat
+            self._changed()
+
+    def _changed(self) -> None:
+        if self._pending is not None:
+            self._pending.cancel()
+        self._pending = asyncio.get_event_loop().call_later(self._debounce, self._on_change)
+
+
+class ConfigReloader:
+
+    def __init__(self, strategy, path: str = config_yaml):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._strategy = strategy
+        self._watcher = ConfigFileWatcher(path, self._on_change, config('config_poll_interval', parser=float))
+        # one reload at a time, in the order of the changes
+        self._reloading = asyncio.Lock()
+
+    def start(self) -> None:
+        self._watcher.start()
+
+    async def stop(self) -> None:
+        await self._watcher.stop()
+
+    def _on_change(self) -> None:
+        asyncio.ensure_future(self.reload())
+
+    async def reload(self) -> bool:
+        """
+        Swaps in the config file if valid, True once swapped
+        """
+        async with self._reloading:
+            try:
+                candidate, yaml_env = read_config_file()
+                validator.validate(candidate)
+                settings = Settings.from_config(candidate)
+                new_values = {key: candidate(key, parser=parser) for key, parser in WATCHED_PARAMS}
+            except Exception:
+                self._logger.exception('Invalid config, keeping the running one')
+                return False
+
+            strategy_name = new_values[validator.STRATEGY_NAME_KEY]
+            if helpers.is_config_reloaded(strategy_name):
+                helpers.refresh_reloaded_config_done(strategy_name)
+
+            changed = set(key for key, parser in WATCHED_PARAMS if config(key, parser=parser) != new_values[key])
+            if not changed:
+                self._logger.info('Config file changed, same values')
+                return False
+
+            # the values are not logged, most of them are secrets
+            self._logger.warning('Config changed: %s', ', '.join(sorted(changed)))
+            if changed.intersection(RESTART_PARAMS):
+                self._logger.warning('Strategy or currency pair changed. Restarting MMM bot')
+                raise SystemExit(0)
+
+            # the config and the settings together, no tick in between
+            swap_config_file(yaml_env)
+            self._strategy.update_settings(settings)
+            settings.log(self._logger)
+
+            for exchange in (self._strategy.taker_exchange, self._strategy.maker_exchange):
+                keys = EXCHANGE_CREDENTIALS.get(exchange.name, ())
+                if changed.intersection(keys):
+                    await exchange.set_credentials(*(config(key, parser=str) for key in keys))
+            return True
@@ -0,0 +1,46 @@
+"""
+Settings resolved once from the config
+
+config() walks the os env, the config file and the defaults and parses the
+value on every call. The values of the strategy and the ones read on the hot
+paths of the exchanges and the watchers are resolved into a frozen Settings
+at start and on every reload of the config (see mm_bot.config.reloader),
+and handed to them. A reload replaces the whole object, they never see half
+of a change.
+"""
+import dataclasses
+import logging
+from decimal import Decimal
+
+from mm_bot.config import config
+
+
+@dataclasses.dataclass(frozen=True)
+class Settings:
+    # the field names are the config keys, the types their parsers
+    dry_run: bool
+    max_open_orders: int
+    min_profitability_rate: Decimal
+    max_qty_per_order: Decimal
+    cancel_order_threshold: Decimal
+    should_cancel_order: bool
+    exchange_binance_loop_delay: int
+    exchange_borderless_loop_delay: int
+    exchange_borderless_deposit_length: int
+    exchange_borderless_settlement_window_length: int
+    exchange_borderless_incremental_matched_orders: bool
+    exchange_borderless_matched_orders_reorg_depth: int
+    watcher_unlock_sweep_interval: int
+
+    @classmethod
+    def from_config(cls, cfg=config) -> 'Settings':
+        """
+        Raises the errors of everett for a missing or invalid value
+        """
+        return cls(**{field.name: cfg(field.name, parser=field.type) for field in dataclasses.fields(cls)})
+
+    def report(self) -> str:
+        return '\n'.join(f'  {field.name}: {getattr(self, field.name)}' for field in dataclasses.fields(self))
+
+    def log(self, logger: logging.Logger) -> None:
+        logger.info('Settings:\n%s', self.report())
@@ -0,0 +1,106 @@
+import asyncio
+import os
+from decimal import Decimal
+
+import pytest
+
+import mm_bot.config
+from mm_bot.config import config, read_config_file, swap_config_file
+from mm_bot.config import reloader
+from mm_bot.config.reloader import ConfigFileWatcher, ConfigReloader
+from mm_bot.config.validator import REQUIRED_PARAMS
+
+VALUES = {
+    'strategy_name': 'cross_market',
+    'dry_run': 'true',
+    'should_cancel_order': 'false',
+    'cancel_order_threshold': '0.01',
+    'max_open_orders': '3',
+    'max_qty_per_order': '0.007',
+    'min_profitability_rate': '0.001',
+    'wallet_base_currency_name': 'LSK',
+    'wallet_counter_currency_name': 'BTC',
+}
+
+
+def write_config(path, **values):
+    values = {**{key: 'key' for key, _ in REQUIRED_PARAMS}, **VALUES, **values}
+    with open(f'{path}.tmp', 'w') as f:
+        f.write('\n'.join(['mmbc:'] + [f'  {key}: "{value}"' for key, value in values.items()]))
+    os.replace(f'{path}.tmp', path)
+
+
+class FakeExchange:
+
+    def __init__(self, name):
+        self.name = name
+        self.credentials = None
+
+    async def set_credentials(self, *credentials):
+        self.credentials = credentials
+
+
+class FakeStrategy:
+
+    def __init__(self):
+        self.taker_exchange = FakeExchange('binance')
+        self.maker_exchange = FakeExchange('borderless')
+        self.settings = None
+
+    def update_settings(self, settings):
+        self.settings = settings
+
+
+@pytest.fixture
+def config_file(tmp_path, monkeypatch):
+    path = str(tmp_path / 'cross_market.yaml')
+    write_config(path)
+    monkeypatch.setattr(mm_bot.config, 'config_yaml', path)
+    monkeypatch.setattr(mm_bot.config.yaml_env, 'cfg', mm_bot.config.yaml_env.cfg)
+    monkeypatch.setattr(mm_bot.config.yaml_env, 'path', mm_bot.config.yaml_env.path)
+    swap_config_file(read_config_file()[1])
+    return path
+
+
+@pytest.mark.asyncio
+async def test_reload(config_file):
+    strategy = FakeStrategy()
+    config_reloader = ConfigReloader(strategy, config_file)
+
+    write_config(config_file, max_open_orders='5', exchange_source_api_key='new')
+    assert await config_reloader.reload()
+    assert config('max_open_orders', parser=int) == 5
+    assert strategy.settings.max_open_orders == 5
+    assert strategy.settings.cancel_order_threshold == Decimal('0.01')
+    assert strategy.taker_exchange.credentials == ('new', 'key')
+    assert strategy.maker_exchange.credentials is None
+
+    # the running config is kept
+    write_config(config_file, max_open_orders='5', exchange_source_api_key='new', dry_run='fillme')
+    assert not await config_reloader.reload()
+    assert config('dry_run', parser=bool) is True
+
+    write_config(config_file, wallet_base_currency_name='NRG')
+    with pytest.raises(SystemExit):
+        await config_reloader.reload()
+    assert config('wallet_base_currency_name', parser=str) == 'LSK'
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('inotify', [True, False])
+async def test_watcher(config_file, monkeypatch, inotify):
+    if not inotify:
+        monkeypatch.setattr(reloader, '_libc_inotify', lambda: None)
+    changed = asyncio.Event()
+    watcher = ConfigFileWatcher(config_file, changed.set, poll_interval=0.05, debounce=0.05)
+    watcher.start()
+    await asyncio.sleep(0.1)
+
+    # another file of the directory
+    write_config(config_file + '.bak')
+    await asyncio.sleep(0.2)
+    assert not changed.is_set()
+
+    write_config(config_file, max_open_orders='5')
+    await asyncio.wait_for(changed.wait(), 2)
+    await watcher.stop()
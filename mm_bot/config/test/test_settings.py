@@ -0,0 +1,28 @@
+import dataclasses
+from decimal import Decimal
+
+import everett.manager
+import pytest
+
+from mm_bot.config import config
+from mm_bot.config.settings import Settings
+
+
+def test_from_config():
+    settings = Settings.from_config()
+    assert settings.dry_run is config('dry_run', parser=bool)
+    assert settings.min_profitability_rate == Decimal(config('min_profitability_rate', parser=str))
+    assert isinstance(settings.exchange_borderless_deposit_length, int)
+    assert 'max_open_orders: ' in settings.report()
+
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        settings.dry_run = False
+
+
+def test_invalid_value():
+    cfg = everett.manager.ConfigManager([
+        everett.manager.ConfigDictEnv({'MMBC_MAX_OPEN_ORDERS': 'many'}),
+        everett.manager.ConfigDictEnv({f'MMBC_{field.name.upper()}': '1' for field in dataclasses.fields(Settings)}),
+    ]).with_namespace('mmbc')
+    with pytest.raises(everett.InvalidValueError):
+        Settings.from_config(cfg)
@@ -27,10 +27,10 @@ REQUIRED_PARAMS = [
     ('wallet_counter_currency_wallet', str),
 ]
 
-def validate_cross_exchange_configs():
+def validate_cross_exchange_configs(cfg=config):
     invalid_params = []
     for param, parser in REQUIRED_PARAMS:
-        val = config(param, parser=parser)
+        val = cfg(param, parser=parser)
         if val == 'fillme':
             invalid_params.append(param)
 
@@ -38,8 +38,11 @@ def validate_cross_exchange_configs():
         raise InvalidParam('Please fill these values: \n\n' + '\n'.join(invalid_params))
 
 
-def validate():
-    strategy_name = config(STRATEGY_NAME_KEY, parser=str)
+def validate(cfg=config):
+    """
+    cfg is a config to be reloaded, see mm_bot.config.read_config_file
+    """
+    strategy_name = cfg(STRATEGY_NAME_KEY, parser=str)
     if strategy_name == 'cross_market':
-        validate_cross_exchange_configs()
+        validate_cross_exchange_configs(cfg)
 
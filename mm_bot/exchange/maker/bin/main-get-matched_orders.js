@@ -6,7 +6,7 @@ const { Currency, CurrencyInfo } = require('bc-sdk/dist/utils/coin')
 const cmdGetMatchedOrders = async opts => {
   const {
     bcRpcAddress, bcRpcScookie,
-    bcAddress
+    bcAddress, fromHeight
   } = opts
 
   if (!bcAddress) {
@@ -26,7 +26,12 @@ const cmdGetMatchedOrders = async opts => {
       process.stderr.write(res.message + "\n")
       process.exit(1)
     }
-    process.stdout.write(JSON.stringify(res.ordersList))
+    let ordersList = res.ordersList
+    // only the matches of takers mined since fromHeight, the bot keeps the older ones
+    if (fromHeight !== undefined) {
+      ordersList = ordersList.filter(o => !o.taker || o.taker.tradeHeight === undefined || o.taker.tradeHeight >= fromHeight)
+    }
+    process.stdout.write(JSON.stringify(ordersList))
   } catch (e) {
     process.stderr.write(e.toString() + "\n")
     process.exit(1)
@@ -1,5 +1,5 @@
 from decimal import Decimal
-from typing import DefaultDict, Dict, List, Optional, Tuple
+from typing import Any, DefaultDict, Dict, List, Optional, Tuple
 import asyncio
 import requests
 import collections
@@ -18,11 +18,12 @@ import mm_bot.model.constants
 import mm_bot.model.currency
 from mm_bot.model.constants import OrderType
 from mm_bot.exchange.base_exchange import BaseExchange
-from mm_bot.config import config
+from mm_bot.config.settings import Settings
 from mm_bot.helpers import decimal_to_str
 from mm_bot.model.currency import CurrencyPair
 
 CLI_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), 'bin/main.js'))
+PRICE_API_URL = 'https://api.binance.com/api/v3/ticker/price'
 
 from mm_bot.exchange.taker.binance import Binance
 class JSCallFailedError(Exception):
@@ -41,7 +42,6 @@ async def _call_js_cli(args: List[str], logger: Optional[logging.Logger] = None)
 
         logger.info('call_js_cli %s', ' '.join(log_args))
 
-    dry_run = config('dry_run', parser=bool)
     cmd = ' '.join(['/usr/bin/env', 'node', str(CLI_PATH)] + args)
     proc = await asyncio.create_subprocess_shell(
             cmd,
@@ -72,6 +72,34 @@ async def _call_js_cli(args: List[str], logger: Optional[logging.Logger] = None)
         raise JSCallFailedError(proc.returncode, err_msg)
 
 
+# (is_buy, price, quantity, collateralizedNrg / sendsUnit)
+ParsedBookOrder = Tuple[bool, Decimal, Decimal, Decimal]
+
+def _parse_book_order(pair: Tuple[str, str], order) -> Optional[ParsedBookOrder]:
+    """
+    pair: lowercased (base, counter)
+
+    Same results as is_buy_order / is_sell_order, calc_price and calc_quantity,
+    but every field is lowercased / parsed once. None for orders of other pairs
+    """
+    base, counter = pair
+    sends_from_chain = order['sendsFromChain'].lower()
+    receives_to_chain = order['receivesToChain'].lower()
+    if sends_from_chain == counter and receives_to_chain == base:
+        is_buy = True
+    elif sends_from_chain == base and receives_to_chain == counter:
+        is_buy = False
+    else:
+        return None
+
+    sends_unit = Decimal(order['sendsUnit'])
+    receives_unit = Decimal(order['receivesUnit'])
+    nrg_rate = Decimal(order['collateralizedNrg']) / sends_unit
+    if is_buy: # sends BTC and receives ETH
+        return True, sends_unit / receives_unit, receives_unit, nrg_rate
+    else: # sell, sends ETH and receives BTC
+        return False, receives_unit / sends_unit, sends_unit, nrg_rate
+
 CONFIRMATION_BLOCKS = {
     'btc': '1',
     'eth': '1',
@@ -85,11 +113,13 @@ class Borderless(BaseExchange):
 
     def __init__(self, hub: aiopubsub.Hub, currency: mm_bot.model.currency.CurrencyPair,
             bc_address: str, bc_scookie: str, bc_wallet_address: str, bc_private_key_hex: str,
-            base_address: str, counter_address: str):
+            base_address: str, counter_address: str, settings: Optional[Settings] = None):
         self.side = 'maker'
         self.name = 'borderless'
         self._logger = logging.getLogger(self.__class__.__name__)
-        self._loop = aiopubsub.loop.Loop(self._run, delay = config('exchange_borderless_loop_delay', parser=int))
+        # replaced on a reload of the config
+        self.settings = settings if settings is not None else Settings.from_config()
+        self._loop = aiopubsub.loop.Loop(self._run, delay = self.settings.exchange_borderless_loop_delay)
         self._hub = hub
         self._publisher = aiopubsub.Publisher(self._hub, self.name)
         self._currency = currency
@@ -104,6 +134,15 @@ class Borderless(BaseExchange):
         self._last_ask_best: mm_bot.model.book.PriceLevel = None
         self._last_bid_best: mm_bot.model.book.PriceLevel = None
 
+        # see _aggregate_order_book
+        self._parsed_orders_pair: Optional[Tuple[str, str]] = None
+        self._parsed_orders: Dict[Tuple[str, int], Optional[ParsedBookOrder]] = {}
+        self._last_order_book_keys: Optional[List[Tuple[str, int]]] = None
+        self._last_order_book: Optional[mm_bot.model.book.OrderBook] = None
+
+        # see get_order_status
+        self._matched_orders: Dict[str, Dict[str, str]] = {}
+        self._matched_orders_height: Optional[int] = None
 
     def get_confirmation_blocks(self, asset_id: str):
         asset_id = asset_id.lower()
@@ -113,6 +152,22 @@ class Borderless(BaseExchange):
         self._logger.debug('borderless start called')
         self._loop.start()
 
+    async def set_credentials(self, bc_address: str, bc_scookie: str, bc_wallet_address: str,
+                              bc_private_key_hex: str, base_address: str, counter_address: str) -> None:
+        """
+        The reloaded credentials, used from the next call of the js cli
+        """
+        self._logger.info('borderless credentials changed')
+        if bc_wallet_address != self._bc_wallet_address:
+            # the matches of the other wallet are fetched whole
+            self._matched_orders_height = None
+        self._bc_rpc_address = bc_address
+        self._bc_rpc_scookie = bc_scookie
+        self._bc_wallet_address = bc_wallet_address
+        self._bc_private_key_hex = bc_private_key_hex
+        self._bc_base_address = base_address
+        self._bc_counter_address = counter_address
+
 
     async def get_account_balance(self):
         json = await _call_js_cli([
@@ -187,7 +242,7 @@ class Borderless(BaseExchange):
 
 
     async def get_order_book(self, currency: mm_bot.model.currency.CurrencyPair) -> mm_bot.model.book.OrderBook:
-        dry_run = config('dry_run', parser=bool)
+        dry_run = self.settings.dry_run
         if dry_run:
             self._logger.info('DRY-RUN, get_order_book')
             return mm_bot.model.book.OrderBook([], [], 0, 0)
@@ -199,33 +254,60 @@ class Borderless(BaseExchange):
             '--bcAddress', self._bc_wallet_address,
             ])
 
+        return self._aggregate_order_book(currency, json)
+
+    def _aggregate_order_book(self, currency: mm_bot.model.currency.CurrencyPair, orders) -> mm_bot.model.book.OrderBook:
+        """
+        Single pass over the open orders of the whole interchange
+
+        The orders of other pairs are skipped before parsing any number. An open
+        order is an immutable tx output, so the parsed orders are kept by
+        (txHash, txOutputIndex) and only the new ones are parsed on each call.
+        When no order was added or removed the previous book is returned as is
+        """
+        pair = (currency.base.lower(), currency.counter.lower())
+        if pair != self._parsed_orders_pair:
+            self._parsed_orders_pair = pair
+            self._parsed_orders = {}
+            self._last_order_book_keys = None
+
+        keys = [(order.get('txHash'), order.get('txOutputIndex')) for order in orders]
+        if keys == self._last_order_book_keys:
+            return self._last_order_book
+
+        previous_parsed_orders = self._parsed_orders
+        parsed_orders: Dict[Tuple[str, int], Optional[ParsedBookOrder]] = {}
+
         # key is price, value is quantity
-        json_bids: DefaultDict[Decimal, Decimal] = collections.defaultdict(lambda: Decimal('0'))
-        json_asks: DefaultDict[Decimal, Decimal] = collections.defaultdict(lambda: Decimal('0'))
+        bids: Dict[Decimal, Decimal] = {}
+        asks: Dict[Decimal, Decimal] = {}
 
         bid_nrg_rate = Decimal('0')
         ask_nrg_rate = Decimal('0')
-        for order in json:
-            price = self.calc_price(currency, order)
-            quantity = self.calc_quantity(currency, order)
-
-            if self.is_buy_order(currency, order):
-                json_bids[price] += quantity
-                sends_unit = Decimal(order['sendsUnit'])
-                bid_nrg_rate += (Decimal(order['collateralizedNrg']) / sends_unit)
-            elif self.is_sell_order(currency, order):
-                json_asks[price] += quantity
-
-                sends_unit = Decimal(order['sendsUnit'])
-                ask_nrg_rate += (Decimal(order['collateralizedNrg']) / sends_unit)
+        for key, order in zip(keys, orders):
+            if key in previous_parsed_orders:
+                parsed = previous_parsed_orders[key]
             else:
+                parsed = _parse_book_order(pair, order)
+            if key[0] is not None:
+                parsed_orders[key] = parsed
+
+            if parsed is None:
                 # idon't care this
                 continue
 
-        bid = [mm_bot.model.book.PriceLevel(price, quantity) for price, quantity in json_bids.items()]
-        ask = [mm_bot.model.book.PriceLevel(price, quantity) for price, quantity in json_asks.items()]
-        bid = sorted(bid, key=lambda p: p.price, reverse=True)
-        ask = sorted(ask, key=lambda p: p.price)
+            is_buy, price, quantity, nrg_rate = parsed
+            if is_buy:
+                bids[price] = bids[price] + quantity if price in bids else quantity
+                bid_nrg_rate += nrg_rate
+            else:
+                asks[price] = asks[price] + quantity if price in asks else quantity
+                ask_nrg_rate += nrg_rate
+
+        self._parsed_orders = parsed_orders
+
+        bid = [mm_bot.model.book.PriceLevel(price, bids[price]) for price in sorted(bids, reverse=True)]
+        ask = [mm_bot.model.book.PriceLevel(price, asks[price]) for price in sorted(asks)]
 
         if len(bid) == 0:
             bid_nrg_rate = Decimal('0')
@@ -237,11 +319,17 @@ class Borderless(BaseExchange):
         else:
             ask_nrg_rate = ask_nrg_rate / len(ask)
 
-        return mm_bot.model.book.OrderBook(bid, ask, bid_nrg_rate, ask_nrg_rate)
+        order_book = mm_bot.model.book.OrderBook(bid, ask, bid_nrg_rate, ask_nrg_rate)
+        # orders without a tx output can not be told apart
+        if len(parsed_orders) == len(keys):
+            self._last_order_book_keys = keys
+            self._last_order_book = order_book
+
+        return order_book
 
     async def get_price(self, asset_id) -> Decimal:
         asset = f'{asset_id}USDT'.upper()
-        url = f'https://api.binance.com/api/v3/ticker/price?symbol={asset}'
+        url = f'{PRICE_API_URL}?symbol={asset}'
         response = requests.get(url)
 
         assert response.status_code == 200
@@ -327,7 +415,7 @@ class Borderless(BaseExchange):
             }
             self._logger.info(f'Creating order {order_body}')
 
-            dry_run = config('dry_run', parser=bool)
+            dry_run = self.settings.dry_run
             if dry_run:
                 self._logger.info('DRY-RUN, create maker order, %s', order)
                 continue
@@ -339,8 +427,8 @@ class Borderless(BaseExchange):
                     '--bcAddress', self._bc_wallet_address,
                     '--shiftMaker', self.get_confirmation_blocks(sends_from_chain),
                     '--shiftTaker', self.get_confirmation_blocks(receives_to_chain),
-                    '--depositLength', config('exchange_borderless_deposit_length', parser=str),
-                    '--settleLength', config('exchange_borderless_settlement_window_length', parser=str),
+                    '--depositLength', str(self.settings.exchange_borderless_deposit_length),
+                    '--settleLength', str(self.settings.exchange_borderless_settlement_window_length),
                     '--sendsFromChain', sends_from_chain,
                     '--receivesToChain', receives_to_chain,
                     '--sendsFromAddress', sends_from_address,
@@ -361,7 +449,7 @@ class Borderless(BaseExchange):
 
 
     async def get_unmatched_orders(self):
-        dry_run = config('dry_run', parser=bool)
+        dry_run = self.settings.dry_run
         if dry_run:
             self._logger.info('DRY-RUN, get_unmatched_orders')
             return []
@@ -396,7 +484,7 @@ class Borderless(BaseExchange):
         return json
 
     async def get_open_orders(self) -> List[mm_bot.model.order.Order]:
-        dry_run = config('dry_run', parser=bool)
+        dry_run = self.settings.dry_run
         if dry_run:
             self._logger.info('DRY-RUN, get_open_orders')
             return []
@@ -446,21 +534,34 @@ class Borderless(BaseExchange):
         if len(open_orders) > 10:
             self._logger.warn(f'More than 10 orders supplied ({len(open_orders)})')
 
-        json = await _call_js_cli([
+        args = [
             'get', 'matched_orders',
             '--bcRpcAddress', self._bc_rpc_address,
             '--bcRpcScookie', self._bc_rpc_scookie,
             '--bcAddress', self._bc_wallet_address,
-            ], self._logger)
+            ]
+        incremental = self.settings.exchange_borderless_incremental_matched_orders
+        from_height = None
+        if incremental and self._matched_orders_height is not None:
+            # the matches of the last blocks again, in case of a reorg
+            reorg_depth = self.settings.exchange_borderless_matched_orders_reorg_depth
+            from_height = max(0, self._matched_orders_height - reorg_depth)
+            args += ['--fromHeight', str(from_height)]
+
+        json = await _call_js_cli(args, self._logger)
 
         self._logger.info(f'Matched orders {len(json)}')
 
-        matched_order_mapping = {}
-        for matched_order in json:
-            maker_order = matched_order['maker']
-            tx_hash = maker_order['txHash']
-            tx_output_index = maker_order['txOutputIndex']
-            matched_order_mapping[tx_hash + '-' + str(tx_output_index)] = matched_order['taker']
+        if from_height is None:
+            self._matched_orders = {}
+        else:
+            # the window is fetched again, a match missing from it was dropped by a reorg
+            self._matched_orders = {
+                key: taker_order for key, taker_order in self._matched_orders.items()
+                if taker_order.get('tradeHeight') is None or int(taker_order['tradeHeight']) < from_height
+            }
+        self._index_matched_orders(json)
+        matched_order_mapping = self._matched_orders
 
         results = []
         for order in open_orders:
@@ -474,15 +575,52 @@ class Borderless(BaseExchange):
 
             results.append((order, status, taker_info))
 
+        # only the matches of the open orders are needed, the filled ones are not passed again
+        open_keys = set(order.tx_hash + '-' + str(order.tx_output_index) for order in open_orders)
+        self._matched_orders = {key: taker_order for key, taker_order in matched_order_mapping.items() if key in open_keys}
+
         return results
 
-    async def is_in_settlement_window(self, maker_order: mm_bot.model.order.MakerOrder) -> bool:
+    def _index_matched_orders(self, matched_orders) -> None:
+        """
+        The matched orders are kept by the tx_hash-index of the maker order,
+        the matched_orders list of the wallet only grows, so once indexed
+        only the matches since the highest taker tradeHeight seen are fetched
+        """
+        for matched_order in matched_orders:
+            maker_order = matched_order['maker']
+            taker_order = matched_order['taker']
+            tx_hash = maker_order['txHash']
+            tx_output_index = maker_order['txOutputIndex']
+            self._matched_orders[tx_hash + '-' + str(tx_output_index)] = taker_order
+
+            trade_height = taker_order.get('tradeHeight')
+            if trade_height is not None and (self._matched_orders_height is None or int(trade_height) > self._matched_orders_height):
+                self._matched_orders_height = int(trade_height)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        The matched orders index for the journal, see mm_bot.model.journal
+        """
+        return {'matched_orders': self._matched_orders, 'matched_orders_height': self._matched_orders_height}
+
+    def restore(self, snapshot: Dict[str, Any]) -> None:
+        """
+        A restored index fetches the matches since its height, not the whole list
+        """
+        self._matched_orders = dict(snapshot['matched_orders'])
+        self._matched_orders_height = snapshot['matched_orders_height']
+
+    async def get_latest_block_height(self) -> int:
         json = await _call_js_cli([
             'get', 'latest_block',
             '--bcRpcAddress', self._bc_rpc_address,
             '--bcRpcScookie', self._bc_rpc_scookie,
             ])
-        latest_bc_block = Decimal(json['height'])
+        return int(json['height'])
+
+    async def is_in_settlement_window(self, maker_order: mm_bot.model.order.MakerOrder) -> bool:
+        latest_bc_block = Decimal(await self.get_latest_block_height())
 
         block_height = Decimal(maker_order.block_height)
         settle_window = Decimal(maker_order.order_body['settlement'])
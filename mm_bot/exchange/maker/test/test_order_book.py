@@ -0,0 +1,93 @@
+import collections
+from decimal import Decimal
+
+import aiopubsub
+
+from mm_bot.exchange.maker.borderless import Borderless
+from mm_bot.model.book import OrderBook, PriceLevel
+from mm_bot.model.currency import CurrencyPair
+
+CURRENCY = CurrencyPair('LSK', 'BTC')
+
+
+def make_order(tx_hash, sends_from_chain, sends_unit, receives_to_chain, receives_unit, collateralized_nrg='10'):
+    return {
+        'txHash': tx_hash,
+        'txOutputIndex': 0,
+        'sendsFromChain': sends_from_chain,
+        'sendsUnit': sends_unit,
+        'receivesToChain': receives_to_chain,
+        'receivesUnit': receives_unit,
+        'collateralizedNrg': collateralized_nrg,
+    }
+
+
+def make_borderless():
+    return Borderless(aiopubsub.Hub(), CURRENCY, '', '', '', '', '', '')
+
+
+def reference_order_book(borderless, currency, orders):
+    """
+    The per order Decimal aggregation get_order_book used to do
+    """
+    bids = collections.defaultdict(lambda: Decimal('0'))
+    asks = collections.defaultdict(lambda: Decimal('0'))
+    bid_nrg_rate = Decimal('0')
+    ask_nrg_rate = Decimal('0')
+    for order in orders:
+        price = borderless.calc_price(currency, order)
+        quantity = borderless.calc_quantity(currency, order)
+        if borderless.is_buy_order(currency, order):
+            bids[price] += quantity
+            bid_nrg_rate += Decimal(order['collateralizedNrg']) / Decimal(order['sendsUnit'])
+        elif borderless.is_sell_order(currency, order):
+            asks[price] += quantity
+            ask_nrg_rate += Decimal(order['collateralizedNrg']) / Decimal(order['sendsUnit'])
+
+    bid = [PriceLevel(price, bids[price]) for price in sorted(bids, reverse=True)]
+    ask = [PriceLevel(price, asks[price]) for price in sorted(asks)]
+    return OrderBook(
+        bid, ask,
+        bid_nrg_rate / len(bid) if bid else Decimal('0'),
+        ask_nrg_rate / len(ask) if ask else Decimal('0'),
+    )
+
+
+ORDERS = [
+    # buys, send btc and receive lsk
+    make_order('a', 'btc', '0.0002', 'lsk', '2'),
+    make_order('b', 'BTC', '0.0001', 'LSK', '1', '3'),
+    make_order('c', 'btc', '0.00033', 'lsk', '3.3'),
+    make_order('d', 'btc', '0.00009', 'lsk', '1'),
+    # sells, send lsk and receive btc
+    make_order('e', 'lsk', '5', 'btc', '0.0006'),
+    make_order('f', 'lsk', '1.5', 'btc', '0.00018', '7'),
+    # other pair
+    make_order('g', 'eth', '1', 'btc', '0.02'),
+]
+
+
+def test_aggregate_order_book_matches_reference():
+    borderless = make_borderless()
+    order_book = borderless._aggregate_order_book(CURRENCY, ORDERS)
+
+    assert order_book == reference_order_book(borderless, CURRENCY, ORDERS)
+    assert order_book.bid == [
+        PriceLevel(Decimal('0.0001'), Decimal('6.3')),
+        PriceLevel(Decimal('0.00009'), Decimal('1')),
+    ]
+    assert order_book.ask == [PriceLevel(Decimal('0.00012'), Decimal('6.5'))]
+
+
+def test_aggregate_order_book_reuses_parsed_orders():
+    borderless = make_borderless()
+    order_book = borderless._aggregate_order_book(CURRENCY, ORDERS)
+    assert borderless._aggregate_order_book(CURRENCY, list(ORDERS)) is order_book
+
+    orders = ORDERS[1:] + [make_order('h', 'lsk', '2', 'btc', '0.0003')]
+    assert borderless._aggregate_order_book(CURRENCY, orders) == reference_order_book(borderless, CURRENCY, orders)
+    assert ('a', 0) not in borderless._parsed_orders
+    assert ('h', 0) in borderless._parsed_orders
+
+    currency = CurrencyPair('ETH', 'BTC')
+    assert borderless._aggregate_order_book(currency, orders) == reference_order_book(borderless, currency, orders)
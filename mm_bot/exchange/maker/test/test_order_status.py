@@ -0,0 +1,68 @@
+import aiopubsub
+import pytest
+
+import mm_bot.exchange.maker.borderless as borderless_module
+from mm_bot.exchange.maker.borderless import Borderless
+from mm_bot.model.constants import Status
+from mm_bot.model.currency import CurrencyPair
+from mm_bot.model.order import MakerOrder
+
+
+def make_match(tx_hash, trade_height):
+    return {
+        'maker': {'txHash': tx_hash, 'txOutputIndex': 0},
+        'taker': {'txHash': f'taker-{tx_hash}', 'tradeHeight': trade_height, 'receivesToAddress': 'addr'},
+    }
+
+
+def make_maker_order(tx_hash):
+    return MakerOrder(
+        exchange='borderless', status=Status.OPEN, order_type='buy', currency='LSK/BTC',
+        order_body={}, tx_hash=tx_hash, tx_output_index=0, block_height='1', taker_order_body={},
+        created_at=None, updated_at=None,
+    )
+
+
+@pytest.mark.asyncio
+async def test_get_order_status_incremental(monkeypatch):
+    matches = [make_match('a', 10), make_match('b', 20)]
+    from_heights = []
+
+    async def fake_js_cli(args, logger=None):
+        from_height = int(args[args.index('--fromHeight') + 1]) if '--fromHeight' in args else None
+        from_heights.append(from_height)
+        return [m for m in matches if from_height is None or m['taker']['tradeHeight'] >= from_height]
+    monkeypatch.setattr(borderless_module, '_call_js_cli', fake_js_cli)
+
+    borderless = Borderless(aiopubsub.Hub(), CurrencyPair('LSK', 'BTC'), '', '', '', '', '', '')
+    orders = [make_maker_order(tx_hash) for tx_hash in ('a', 'c')]
+    assert [status for _, status, _ in await borderless.get_order_status(orders)] == [Status.FILLED, Status.OPEN]
+
+    matches.append(make_match('c', 30))
+    results = await borderless.get_order_status(orders)
+    assert [status for _, status, _ in results] == [Status.FILLED, Status.FILLED]
+    assert results[1][2]['txHash'] == 'taker-c'
+    # the matches since the highest tradeHeight seen, less the reorg depth
+    assert from_heights == [None, 14]
+
+
+@pytest.mark.asyncio
+async def test_get_order_status_reorg(monkeypatch):
+    matches = [make_match('a', 10), make_match('b', 20)]
+
+    async def fake_js_cli(args, logger=None):
+        from_height = int(args[args.index('--fromHeight') + 1]) if '--fromHeight' in args else None
+        return [m for m in matches if from_height is None or m['taker']['tradeHeight'] >= from_height]
+    monkeypatch.setattr(borderless_module, '_call_js_cli', fake_js_cli)
+
+    borderless = Borderless(aiopubsub.Hub(), CurrencyPair('LSK', 'BTC'), '', '', '', '', '', '')
+    orders = [make_maker_order(tx_hash) for tx_hash in ('a', 'b')]
+    assert [status for _, status, _ in await borderless.get_order_status(orders)] == [Status.FILLED, Status.FILLED]
+
+    # the match of b is dropped by a reorg
+    del matches[1]
+    assert [status for _, status, _ in await borderless.get_order_status(orders)] == [Status.FILLED, Status.OPEN]
+
+    # a is filled and not open anymore, its match is pruned
+    await borderless.get_order_status(orders[1:])
+    assert borderless.snapshot()['matched_orders'] == {}
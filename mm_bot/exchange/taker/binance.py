@@ -8,7 +8,7 @@ import binance
 from datetime import datetime
 
 from mm_bot.exchange.base_exchange import BaseExchange
-from mm_bot.config import config
+from mm_bot.config.settings import Settings
 import mm_bot.model.book
 import mm_bot.model.constants
 import mm_bot.model.currency
@@ -24,9 +24,11 @@ class Binance(BaseExchange):
     name = 'binance'
 
     def __init__(self, hub: aiopubsub.Hub, currency: mm_bot.model.currency.CurrencyPair,
-            loop_delay, api_key: str, api_secret: str):
+            loop_delay, api_key: str, api_secret: str, settings: Optional[Settings] = None):
         self.side = 'taker'
         self._logger = logging.getLogger(self.__class__.__name__)
+        # replaced on a reload of the config
+        self.settings = settings if settings is not None else Settings.from_config()
         self._client = binance.AsyncClient(api_key, api_secret)
         self._loop = aiopubsub.loop.Loop(self._run, delay = loop_delay)
         self._hub = hub
@@ -76,6 +78,14 @@ class Binance(BaseExchange):
         self._logger.info('binance stopping')
         await self._client.session.close()
 
+    async def set_credentials(self, api_key: str, api_secret: str) -> None:
+        """
+        A new client for the reloaded api key, the loop goes on with it
+        """
+        self._logger.info('binance credentials changed, new client')
+        client, self._client = self._client, binance.AsyncClient(api_key, api_secret)
+        await client.session.close()
+
     async def create_orders(self, orders_to_open):
         """
         orders_to_open:
@@ -85,7 +95,7 @@ class Binance(BaseExchange):
             'price': best_bid_price_from_maker
         }]
         """
-        dry_run = config('dry_run', parser=bool)
+        dry_run = self.settings.dry_run
         orders_to_return = []
         for order in orders_to_open:
             if order['order_type'] == mm_bot.model.constants.OrderType.SELL:
@@ -146,7 +156,11 @@ class Binance(BaseExchange):
 
         return orders
 
-    async def transfer_asset(self, asset_id: str, to_addr: str, amount: Decimal, private_key: Optional[str]=None, from_addr: Optional[str]=None):
+    async def transfer_asset(self, asset_id: str, to_addr: str, amount: Decimal, private_key: Optional[str]=None, from_addr: Optional[str]=None,
+                             withdraw_order_id: Optional[str]=None):
+        """
+        withdraw_order_id is the client id of the withdrawal, binance rejects a second one with the same id
+        """
         asset_id = asset_id.upper()
         if asset_id == 'WAV':
             asset_id = 'WAVES'
@@ -154,10 +168,14 @@ class Binance(BaseExchange):
         self._logger.info('Init transfer in Binance for asset: %s, to_addr: %s, amount: %s', asset_id, to_addr, amount)
 
         try:
-            result = await client.withdraw(
+            params = {}
+            if withdraw_order_id is not None:
+                params['withdrawOrderId'] = withdraw_order_id
+            result = await self._client.withdraw(
                     asset=asset_id,
                     address=to_addr,
-                    amount=amount)
+                    amount=amount,
+                    **params)
 
             self._logger.info('Succeeded, withdraw  for asset: %s, to_addr: %s, amount: %s', asset_id, to_addr, amount)
         except BinanceAPIException as e:
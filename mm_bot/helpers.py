@@ -1,10 +1,13 @@
 import os
+import json
 import decimal
 
 def decimal_to_str(num: decimal.Decimal, precision=80):
     return '{0:.{prec}f}'.format(num, prec=precision).rstrip('0')
 
 LOGS_FILE_PATTERN = './logs/money_machine.log-'
+PROFILES_FILE_PATTERN = './logs/profile-'
+MEMORY_STATS_FILE = './logs/memory_stats.jsonl'
 CONFIG_DIR = os.environ.get('CONFIG_DIR', '/tmp/').rstrip('/')
 
 def get_config_path(strategy):
@@ -27,3 +30,37 @@ def is_config_reloaded(strategy):
 def refresh_reloaded_config_done(strategy):
     config_path = config_updated_lock_file(strategy)
     os.system(f'rm {config_path}')
+
+
+def profile_request_file(strategy):
+    config_path = f'{CONFIG_DIR}/{strategy}.profile'
+    return config_path
+
+def signal_profile_requested(strategy, mode, duration):
+    request_path = profile_request_file(strategy)
+    # replaced at once, the bot polls it every second
+    with open(f'{request_path}.tmp', 'w') as f:
+        json.dump({'mode': mode, 'duration': duration}, f)
+    os.replace(f'{request_path}.tmp', request_path)
+
+def pop_profile_request(strategy):
+    """
+    The request, left in place when it can not be parsed
+    """
+    request_path = profile_request_file(strategy)
+    if not os.path.isfile(request_path):
+        return None
+
+    try:
+        with open(request_path, 'r') as f:
+            request = json.load(f)
+    except ValueError:
+        return None
+
+    os.remove(request_path)
+    return request
+
+def drop_profile_request(strategy):
+    request_path = profile_request_file(strategy)
+    if os.path.isfile(request_path):
+        os.remove(request_path)
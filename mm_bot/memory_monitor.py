@@ -0,0 +1,162 @@
+"""
+Periodic memory observatory of the bot process
+
+Logs and exports (as json lines next to the logs) the RSS, the counts of the
+objects the bot keeps creating, the pending messages in the hub and,
+optionally, the allocation sites that grew since the previous sample.
+"""
+import asyncio
+import collections
+import gc
+import json
+import logging
+import os
+import resource
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+import aiopubsub
+
+from mm_bot.helpers import MEMORY_STATS_FILE
+
+TRACKED_TYPES = ('OrderBook', 'PriceLevel', 'MakerOrder', 'TakerOrder')
+TRACEMALLOC_FRAMES = 10
+# the stats file is cut back to the last max_samples once it holds twice as many
+MAX_SAMPLES = 2000
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def get_rss_bytes() -> int:
+    """
+    Current resident set size, falls back to the peak RSS where /proc is not available
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        # ru_maxrss is in KB on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def count_objects(type_names=TRACKED_TYPES) -> Dict[str, int]:
+    counts = collections.Counter({name: 0 for name in type_names})
+    for obj in gc.get_objects():
+        name = type(obj).__name__
+        if name in counts:
+            counts[name] += 1
+
+    return dict(counts)
+
+
+def get_hub_queue_sizes(hub: aiopubsub.Hub) -> Dict[str, int]:
+    """
+    Unread messages per subscription, a growing number means a consumer can not keep up
+    """
+    unreads = getattr(hub, '_unreads', {})
+    return {
+        '.'.join(key): sum(callback() for callback in callbacks)
+        for key, callbacks in unreads.items()
+    }
+
+
+class MemoryMonitor:
+
+    def __init__(self, hub: aiopubsub.Hub, interval: int, top_n: int = 10,
+                 trace_allocations: bool = False, rss_limit_mb: Optional[int] = None,
+                 stats_file: Optional[str] = MEMORY_STATS_FILE, max_samples: int = MAX_SAMPLES):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._loop = aiopubsub.loop.Loop(self._run, delay=interval)
+        self._hub = hub
+        self._top_n = top_n
+        self._trace_allocations = trace_allocations
+        self._rss_limit_bytes = rss_limit_mb * 1024 * 1024 if rss_limit_mb else None
+        self._stats_file = stats_file
+        self._max_samples = max_samples
+        # the lines of the stats file, counted at the first export
+        self._stats_lines: Optional[int] = None
+
+        self._last_snapshot: Optional[tracemalloc.Snapshot] = None
+        self._last_rss: Optional[int] = None
+
+    def start(self) -> None:
+        self._logger.info('Start memory monitor, rss limit: %s bytes, trace allocations: %s',
+                          self._rss_limit_bytes, self._trace_allocations)
+        if self._trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        self._loop.start()
+
+    async def stop(self) -> None:
+        await self._loop.stop_wait()
+
+    def _allocation_growth(self) -> List[str]:
+        if not tracemalloc.is_tracing():
+            return []
+
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ))
+        if self._last_snapshot is None:
+            self._last_snapshot = snapshot
+            return []
+
+        growth = snapshot.compare_to(self._last_snapshot, 'lineno')
+        self._last_snapshot = snapshot
+        return [str(stat) for stat in growth[:self._top_n] if stat.size_diff > 0]
+
+    def sample(self) -> Dict[str, Any]:
+        rss = get_rss_bytes()
+        stats = {
+            'timestamp': int(time.time()),
+            'rss_bytes': rss,
+            'rss_growth_bytes': rss - self._last_rss if self._last_rss is not None else 0,
+            'objects': count_objects(),
+            'asyncio_tasks': len(asyncio.all_tasks()),
+            'hub_queue_sizes': get_hub_queue_sizes(self._hub),
+            'allocation_growth': self._allocation_growth(),
+        }
+        self._last_rss = rss
+
+        return stats
+
+    def is_over_limit(self, stats: Dict[str, Any]) -> bool:
+        return self._rss_limit_bytes is not None and stats['rss_bytes'] > self._rss_limit_bytes
+
+    def _export(self, stats: Dict[str, Any]) -> None:
+        if self._stats_lines is None:
+            self._stats_lines = 0
+            if os.path.isfile(self._stats_file):
+                with open(self._stats_file, 'rb') as f:
+                    self._stats_lines = sum(1 for _ in f)
+
+        with open(self._stats_file, 'a') as f:
+            f.write(json.dumps(stats) + '\n')
+        self._stats_lines += 1
+
+        if self._stats_lines >= 2 * self._max_samples:
+            with open(self._stats_file, 'rb') as f:
+                lines = f.readlines()[-self._max_samples:]
+            # replaced at once, the web ui reads the last line
+            with open(f'{self._stats_file}.tmp', 'wb') as f:
+                f.writelines(lines)
+            os.replace(f'{self._stats_file}.tmp', self._stats_file)
+            self._stats_lines = len(lines)
+
+    async def _run(self) -> None:
+        stats = self.sample()
+        self._logger.info(
+            'rss: %s MB (%+d KB), tasks: %s, objects: %s, hub queues: %s',
+            round(stats['rss_bytes'] / 1024 / 1024, 2), stats['rss_growth_bytes'] // 1024,
+            stats['asyncio_tasks'], stats['objects'], stats['hub_queue_sizes']
+        )
+        for line in stats['allocation_growth']:
+            self._logger.info('allocation growth: %s', line)
+
+        if self._stats_file is not None:
+            self._export(stats)
+
+        if self.is_over_limit(stats):
+            self._logger.warning('RSS %s bytes is over the limit %s bytes, exiting to reclaim memory',
+                                 stats['rss_bytes'], self._rss_limit_bytes)
+            raise SystemExit(0)
@@ -0,0 +1,88 @@
+"""
+Archival of the orders done with, to keep the working tables small
+
+The bot scans maker_orders and taker_orders by status on every loop, the
+settled, expired and canceled orders only grow them and their indexes.
+A maker order is archived with its taker orders once all of them are in a
+terminal status and were last updated before the retention window. The
+rows are moved to the *_archive tables, with the same columns and ids, in
+small batches, each one a short transaction of its own.
+
+The read APIs of the repository span the archive tables only when asked
+with include_archive, the archived orders are not updated anymore.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+import aiopubsub
+import sqlalchemy
+
+from mm_bot.model.constants import Status
+from mm_bot.model.order import metadata, MakerOrdersTable, TakerOrdersTable
+
+MAKER_TERMINAL_STATUSES = (Status.SETTLED, Status.EXPIRED, Status.CANCELED)
+TAKER_TERMINAL_STATUSES = (Status.FILLED, Status.EXPIRED, Status.CANCELED)
+
+
+def _archive_table(table: sqlalchemy.Table, *indexes: sqlalchemy.Index) -> sqlalchemy.Table:
+    return sqlalchemy.Table(
+        f'{table.name}_archive',
+        metadata,
+        *[column.copy() for column in table.columns],
+        *indexes,
+    )
+
+# the indexes of the queries spanning the archive, the identifiers are unique in the working tables only
+MakerOrdersArchiveTable = _archive_table(
+    MakerOrdersTable,
+    sqlalchemy.Index('maker_orders_archive_currency', 'currency', 'id'),
+)
+TakerOrdersArchiveTable = _archive_table(
+    TakerOrdersTable,
+    sqlalchemy.Index('taker_orders_archive_filled', 'status', 'created_at'),
+    sqlalchemy.Index('taker_orders_archive_maker_order_id', 'maker_order_id'),
+)
+
+ARCHIVE_TABLES = {
+    MakerOrdersTable: MakerOrdersArchiveTable,
+    TakerOrdersTable: TakerOrdersArchiveTable,
+}
+
+
+class OrderArchiver:
+
+    def __init__(self, repository, retention: timedelta, batch_size: int, interval: int):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._loop = aiopubsub.loop.Loop(self._run, delay=interval)
+        self._repository = repository
+        self._retention = retention
+        self._batch_size = batch_size
+
+    def start(self) -> None:
+        self._logger.info('Start archiving the orders older than %s in batches of %s', self._retention, self._batch_size)
+        self._loop.start()
+
+    async def stop(self) -> None:
+        await self._loop.stop_wait()
+
+    async def archive(self) -> int:
+        """
+        Archives the orders done with before the retention window, batch by
+        batch, the trading loop runs in between the batches
+        """
+        updated_before = datetime.utcnow() - self._retention
+        archived = 0
+        while True:
+            count = await self._repository.archive_orders(updated_before, self._batch_size)
+            archived += count
+            if count < self._batch_size:
+                break
+            await asyncio.sleep(0)
+
+        return archived
+
+    async def _run(self) -> None:
+        archived = await self.archive()
+        if archived:
+            self._logger.info('Archived %s maker orders with their taker orders', archived)
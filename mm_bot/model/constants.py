@@ -11,6 +11,38 @@ class Status:
     SETTLED = 'settled'
     EXPIRED = 'expired'
 
+class Settlement:
+    """
+    The processing of a filled taker order by the order fill watcher
+    """
+    SETTLED = 'settled' # the maker order is settled
+    EXPIRED = 'expired' # the maker order expired before the fill
+    MISSING = 'missing' # no maker order
+    INVALID = 'invalid' # the maker order can not be settled from its status
+
+class JobKind:
+    """
+    The jobs of the outbox, see mm_bot.model.outbox
+    """
+    TRANSFER = 'transfer'
+    UNLOCK = 'unlock'
+
+class JobStatus:
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+class JournalEvent:
+    """
+    The events of the strategy journal, see mm_bot.model.journal
+    """
+    BOOK = 'book' # an order book of an exchange
+    DECISION = 'decision' # the orders the strategy decided to open
+    SENT = 'sent' # orders sent to an exchange
+    ACK = 'ack' # orders created by an exchange and written in the db
+    STATUS = 'status' # a status change of an order, the fills among them
+
 class OrderType:
     BUY = 'buy'
     SELL = 'sell'
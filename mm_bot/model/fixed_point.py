@@ -0,0 +1,31 @@
+"""
+Fixed point columns of the orders tables
+
+The price, quantity and notional of order_body are kept as integers of
+10^-decimals so sqlite compares and sums them exactly, rounded half to even
+past their decimals. The integers of sqlite are 64 bits, so the columns have
+fewer decimals than the currencies.
+"""
+from decimal import Decimal
+from typing import Union
+
+PRICE_COLUMN_DECIMALS = 12
+AMOUNT_COLUMN_DECIMALS = 10 # quantity and notional
+MAX_COLUMN_VALUE = 2 ** 63 - 1
+
+Amount = Union[Decimal, str, int]
+
+
+def to_scaled(value: Amount, decimals: int) -> int:
+    """
+    value as an integer of 10^-decimals, rounded half to even, ex to_scaled('0.0001493', 12) -> 149300000
+    """
+    scaled = int(Decimal(value).scaleb(decimals).to_integral_value())
+    if abs(scaled) > MAX_COLUMN_VALUE:
+        raise ValueError(f'{value} does not fit 64 bits with {decimals} decimals')
+
+    return scaled
+
+
+def from_scaled(value: int, decimals: int) -> Decimal:
+    return Decimal(value).scaleb(-decimals)
@@ -0,0 +1,232 @@
+"""
+Append-only journal of the strategy events, for a fast restart
+
+The bot exits on every config save and every 8 hours, and a start used to
+wait for the exchanges before its first tick. The journal keeps what the
+strategy waits for: the last order books and the snapshots of the exchanges
+(the matched orders index of borderless). A start restores them in
+milliseconds, the strategy ticks right away on the books fresher than
+MMBC_JOURNAL_MAX_BOOK_AGE seconds and the exchange loops reconcile them in
+the background.
+
+The events (see constants.JournalEvent) are appended as json lines to
+journal.jsonl with one fsync every MMBC_JOURNAL_FSYNC_INTERVAL seconds, a
+crash loses the events of the last interval at most. Every
+MMBC_JOURNAL_SNAPSHOT_EVENTS events and on stop the state is compacted to
+snapshot.json and the journal starts over.
+
+The orders stay in the db, the journal tells which hedges were sent but not
+acknowledged when the bot stopped, they may be open on the exchange.
+"""
+import asyncio
+import dataclasses
+import json
+import logging
+import os
+import threading
+import time
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional
+
+import aiopubsub
+
+from mm_bot.model.book import OrderBook, PriceLevel
+from mm_bot.model.constants import JournalEvent
+
+SNAPSHOT_FILE = 'snapshot.json'
+JOURNAL_FILE = 'journal.jsonl'
+
+
+def encode_book(book: OrderBook) -> Dict[str, Any]:
+    return dataclasses.asdict(book)
+
+
+def decode_book(value: Dict[str, Any]) -> OrderBook:
+    def levels(side):
+        return [PriceLevel(Decimal(str(level['price'])), Decimal(str(level['quantity']))) for level in value[side]]
+
+    return OrderBook(
+        levels('bid'), levels('ask'), Decimal(str(value['bid_nrg_rate'])), Decimal(str(value['ask_nrg_rate']))
+    )
+
+
+@dataclasses.dataclass
+class JournalState:
+    seq: int = 0
+    # the last book of every exchange with the time it was journaled at
+    books: Dict[str, Dict[str, Any]] = dataclasses.field(default_factory=dict)
+    decision: Optional[Dict[str, Any]] = None
+    # the orders sent with a key and not acknowledged yet, by key
+    unacked: Dict[str, Dict[str, Any]] = dataclasses.field(default_factory=dict)
+    # the snapshots of the exchanges taken at the last compaction
+    exchanges: Dict[str, Any] = dataclasses.field(default_factory=dict)
+
+    def apply(self, event: Dict[str, Any]) -> None:
+        self.seq = event['seq']
+        kind, data = event['kind'], event['data']
+        if kind == JournalEvent.BOOK:
+            self.books[data['exchange']] = {'at': event['at'], 'book': data['book']}
+        elif kind == JournalEvent.DECISION:
+            self.decision = dict(data, at=event['at'])
+        elif kind == JournalEvent.SENT:
+            for key, request in zip(data['keys'], data['requests']):
+                if key is not None:
+                    self.unacked[key] = {'exchange': data['exchange'], 'at': event['at'], 'request': request}
+        elif kind == JournalEvent.ACK:
+            for key in data['keys']:
+                self.unacked.pop(key, None)
+
+    def book(self, exchange: str, max_age: float, now: Optional[float] = None) -> Optional[OrderBook]:
+        """
+        The last book of the exchange, None when older than max_age seconds
+        """
+        book = self.books.get(exchange)
+        now = time.time() if now is None else now
+        if book is None or now - book['at'] > max_age:
+            return None
+        return decode_book(book['book'])
+
+    @classmethod
+    def from_dict(cls, value: Dict[str, Any]) -> 'JournalState':
+        return cls(**{field.name: value[field.name] for field in dataclasses.fields(cls) if field.name in value})
+
+
+class Journal:
+
+    def __init__(self, directory: str, fsync_interval: float, snapshot_events: int):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._loop = aiopubsub.loop.Loop(self._run, delay=fsync_interval)
+        self._directory = directory
+        self._snapshot_events = snapshot_events
+        self._snapshot_sources: Dict[str, Callable[[], Any]] = {}
+        self._buffer: List[str] = []
+        self._events_since_snapshot = 0
+        self._file = None
+        # the writes in the order of the events, a write canceled by stop() goes on in its thread
+        self._flushing = asyncio.Lock()
+        self._write_lock = threading.Lock()
+        self.state = JournalState()
+
+    @property
+    def _snapshot_path(self) -> str:
+        return os.path.join(self._directory, SNAPSHOT_FILE)
+
+    @property
+    def _journal_path(self) -> str:
+        return os.path.join(self._directory, JOURNAL_FILE)
+
+    def add_snapshot_source(self, name: str, source: Callable[[], Any]) -> None:
+        """
+        source() is written in the snapshots as state.exchanges[name]
+        """
+        self._snapshot_sources[name] = source
+
+    def restore(self) -> JournalState:
+        """
+        The state of the last snapshot with the events journaled after it,
+        a torn last line of a crash is dropped
+        """
+        started = time.monotonic()
+        os.makedirs(self._directory, exist_ok=True)
+        if os.path.exists(self._snapshot_path):
+            with open(self._snapshot_path, 'r') as f:
+                self.state = JournalState.from_dict(json.load(f))
+
+        valid_bytes = 0
+        if os.path.exists(self._journal_path):
+            with open(self._journal_path, 'rb') as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        self._logger.warning('Torn event at byte %s of the journal, dropped', valid_bytes)
+                        break
+
+                    valid_bytes += len(line)
+                    # the events before the snapshot are in it
+                    if event['seq'] > self.state.seq:
+                        self.state.apply(event)
+                        self._events_since_snapshot += 1
+            os.truncate(self._journal_path, valid_bytes)
+
+        self._file = open(self._journal_path, 'ab')
+        self._logger.info('Restored journal at event %s (%s after the snapshot) in %.3fs',
+                          self.state.seq, self._events_since_snapshot, time.monotonic() - started)
+        return self.state
+
+    def append(self, kind: str, data: Dict[str, Any]) -> None:
+        event = {'seq': self.state.seq + 1, 'at': time.time(), 'kind': kind, 'data': data}
+        self.state.apply(event)
+        self._buffer.append(json.dumps(event, default=str))
+        self._events_since_snapshot += 1
+
+    def start(self) -> None:
+        if self._file is None:
+            self.restore()
+        self._loop.start()
+
+    async def stop(self) -> None:
+        await self._loop.stop_wait()
+        if self._file is None:
+            return
+
+        await self.flush()
+        await self.compact()
+        self._file.close()
+        self._file = None
+
+    async def flush(self) -> None:
+        """
+        Writes the buffered events with one fsync, off the event loop
+        """
+        async with self._flushing:
+            if not self._buffer:
+                return
+
+            lines, self._buffer = self._buffer, []
+            await asyncio.get_event_loop().run_in_executor(None, self._write, lines)
+            if self._events_since_snapshot >= self._snapshot_events:
+                await self._compact()
+
+    def _write(self, lines: List[str]) -> None:
+        with self._write_lock:
+            self._file.write(('\n'.join(lines) + '\n').encode())
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    async def compact(self) -> None:
+        """
+        Writes the state as the snapshot and starts the journal over, the
+        events still buffered are in the snapshot already and skipped when
+        read back
+        """
+        async with self._flushing:
+            await self._compact()
+
+    async def _compact(self) -> None:
+        for name, source in self._snapshot_sources.items():
+            self.state.exchanges[name] = source()
+        snapshot = json.dumps(dataclasses.asdict(self.state), default=str)
+        await asyncio.get_event_loop().run_in_executor(None, self._write_snapshot, snapshot)
+        self._logger.debug('Compacted %s events into the snapshot at event %s', self._events_since_snapshot, self.state.seq)
+        self._events_since_snapshot = 0
+
+    def _write_snapshot(self, snapshot: str) -> None:
+        path = self._snapshot_path + '.tmp'
+        with self._write_lock:
+            with open(path, 'w') as f:
+                f.write(snapshot)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path, self._snapshot_path)
+            directory = os.open(self._directory, os.O_RDONLY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+
+            self._file.truncate(0)
+            os.fsync(self._file.fileno())
+
+    async def _run(self) -> None:
+        await self.flush()
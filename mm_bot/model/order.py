@@ -1,14 +1,142 @@
 from datetime import datetime
 from decimal import Decimal
-from typing import Any, Dict, TypeVar
+from typing import Any, Dict, Optional, Tuple, TypeVar
 import dataclasses
 
 import sqlalchemy
 
 from mm_bot.model.constants import Status, OrderType
+from mm_bot.model import fixed_point
 
 metadata = sqlalchemy.MetaData()
 
+# columns derived from order_body: price in 10^-PRICE_COLUMN_DECIMALS of the counter currency,
+# quantity (base) and notional (price * quantity, counter) in 10^-AMOUNT_COLUMN_DECIMALS
+SCALED_COLUMNS = ('price', 'quantity', 'notional')
+
+# values parsed from order_body, kept until order_body or order_type is replaced
+_CACHED_SLOTS = ('_cached_body', '_cached_order_type', '_price', '_quantity')
+# the field values when the order was last read or written by the repository
+_PERSISTED_SLOT = '_persisted'
+
+
+def _slotted(cls):
+    """
+    Recreate the dataclass with __slots__ for its fields and the parsed values,
+    dataclass(slots=True) is only available from python 3.10
+    """
+    field_names = tuple(field.name for field in dataclasses.fields(cls))
+    cls_dict = dict(cls.__dict__)
+    cls_dict['__slots__'] = field_names + _CACHED_SLOTS + (_PERSISTED_SLOT, )
+    cls_dict['_FIELDS'] = field_names
+    # the defaults stay in the generated __init__, as class attributes they would clash with the slots
+    for name in field_names:
+        cls_dict.pop(name, None)
+    cls_dict.pop('__dict__', None)
+    cls_dict.pop('__weakref__', None)
+
+    return type(cls)(cls.__name__, cls.__bases__, cls_dict)
+
+
+class _BaseOrder:
+    __slots__ = ()
+
+    def __post_init__(self):
+        self._cached_body = None
+        self._cached_order_type = None
+        self._persisted = None
+
+    def mark_persisted(self, values: Optional[Tuple[Any, ...]] = None) -> None:
+        """
+        Called by the repository once the order is in sync with its row,
+        values are the field_values written when the order changed meanwhile
+        """
+        self._persisted = self.field_values() if values is None else values
+
+    def field_values(self) -> Tuple[Any, ...]:
+        return tuple(getattr(self, name) for name in self._FIELDS)
+
+    def persisted_value(self, name: str) -> Any:
+        """
+        The value of the field at the last mark_persisted, None if it was never called
+        """
+        if self._persisted is None:
+            return None
+        return self._persisted[self._FIELDS.index(name)]
+
+    def column_values(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self._FIELDS}
+
+    def scaled_values(self) -> Dict[str, Optional[int]]:
+        """
+        The SCALED_COLUMNS, None when order_body has no valid price and quantity
+        """
+        try:
+            price = self.price()
+            quantity = self.quantity()
+            return {
+                'price': fixed_point.to_scaled(price, fixed_point.PRICE_COLUMN_DECIMALS),
+                'quantity': fixed_point.to_scaled(quantity, fixed_point.AMOUNT_COLUMN_DECIMALS),
+                'notional': fixed_point.to_scaled(price * quantity, fixed_point.AMOUNT_COLUMN_DECIMALS),
+            }
+        except (KeyError, TypeError, ValueError, ArithmeticError):
+            return dict.fromkeys(SCALED_COLUMNS)
+
+    def changed_values(self) -> Dict[str, Any]:
+        """
+        The columns changed since mark_persisted, all of them if it was never called
+        """
+        if self._persisted is None:
+            return self.column_values()
+
+        changed = {}
+        for name, persisted in zip(self._FIELDS, self._persisted):
+            value = getattr(self, name)
+            if value is not persisted and value != persisted:
+                changed[name] = value
+
+        return changed
+
+    def _parsed(self) -> None:
+        """
+        Fill the cached values of order_body if it was replaced since they were parsed
+        """
+        if self._cached_body is self.order_body and self._cached_order_type == self.order_type:
+            return
+
+        self._price, self._quantity = self._parse()
+        self._cached_body = self.order_body
+        self._cached_order_type = self.order_type
+
+    def is_buy(self) -> bool:
+        return self.order_type == OrderType.BUY
+
+    def is_sell(self) -> bool:
+        return self.order_type == OrderType.SELL
+
+    def price(self) -> Decimal:
+        self._parsed()
+        return self._price
+
+    def quantity(self) -> Decimal:
+        self._parsed()
+        return self._quantity
+
+    def _as_object(self, field_names) -> Dict[str, Any]:
+        obj = {}
+        for key in field_names:
+            value = getattr(self, key)
+            if type(value) == datetime:
+                value = value.replace(microsecond=0).isoformat()
+
+            obj[key] = value
+
+        self._parsed()
+        obj['quantity'] = str(self._quantity)
+        obj['price'] = str(self._price)
+
+        return obj
+
 MakerOrdersTable = sqlalchemy.Table(
     'maker_orders',
     metadata,
@@ -27,10 +155,21 @@ MakerOrdersTable = sqlalchemy.Table(
     sqlalchemy.Column('created_at', sqlalchemy.DateTime, nullable=True),
     sqlalchemy.Column('updated_at', sqlalchemy.DateTime, nullable=True),
 
+    # parsed from order_body by the repository, last as they are not fields of the orders, see SCALED_COLUMNS
+    sqlalchemy.Column('price', sqlalchemy.BigInteger, nullable=True),
+    sqlalchemy.Column('quantity', sqlalchemy.BigInteger, nullable=True),
+    sqlalchemy.Column('notional', sqlalchemy.BigInteger, nullable=True),
+
+    sqlalchemy.Index('maker_orders_identifier', 'exchange', 'tx_hash', 'tx_output_index', unique=True),
+    sqlalchemy.Index('maker_orders_price', 'price'),
+    sqlalchemy.Index('maker_orders_currency', 'currency', 'id'),
+    # the ids of the archived orders are not handed out again, see mm_bot.model.archive
+    sqlite_autoincrement=True,
 )
 
+@_slotted
 @dataclasses.dataclass
-class MakerOrder:
+class MakerOrder(_BaseOrder):
     exchange: str
     status: str
     order_type: str
@@ -44,15 +183,10 @@ class MakerOrder:
     updated_at: datetime
     id: int = None
 
-    IDENTIFIER = 'tx_hash'
+    # the columns of the unique index maker_orders_identifier
+    IDENTIFIER = ('exchange', 'tx_hash', 'tx_output_index')
 
-    def is_buy(self) -> bool:
-        return self.order_type == OrderType.BUY
-
-    def is_sell(self) -> bool:
-        return self.order_type == OrderType.SELL
-
-    def price(self) -> Decimal:
+    def _parse(self) -> Tuple[Decimal, Decimal]:
         """
         The price of ETH/BTC is 1 ETH worths how many BTC as BTC is quote
         if BUY ETH/BTC, you receive ETH and send BTC
@@ -60,39 +194,21 @@ class MakerOrder:
         if SELL ETH/BTC, you receive BTC and send ETH
             receivesUnit / sendsUnit
 
-        Return decimal.Decimal
+        Return (price, quantity) as decimal.Decimal
         """
         sends_unit = Decimal(self.order_body['sendsUnit'])
         receives_unit = Decimal(self.order_body['receivesUnit'])
         if self.is_buy(): # sends BTC and receives ETH
-            return sends_unit / receives_unit
-        else: # sell
-            return receives_unit / sends_unit
-
-    def quantity(self) -> Decimal:
-        if self.is_buy(): # sends BTC and receives ETH
-            return Decimal(self.order_body['receivesUnit'])
+            return sends_unit / receives_unit, receives_unit
         else: # sell, sends ETH
-            return Decimal(self.order_body['sendsUnit'])
+            return receives_unit / sends_unit, sends_unit
 
     def as_object(self):
-        obj = {}
-        exclude_fields = {'tx_hash', 'tx_output_index'}
-        for field in dataclasses.fields(self):
-            key = field.name
-            if key in exclude_fields:
-                continue
-
-            value = getattr(self, key)
-            if type(value) == datetime:
-                value = value.replace(microsecond=0).isoformat()
-
-            obj[key] = value
-
-        obj['quantity'] = str(self.quantity())
-        obj['price'] = str(self.price())
+        return self._as_object(_MAKER_OBJECT_FIELDS)
 
-        return obj
+_MAKER_OBJECT_FIELDS = tuple(
+    field.name for field in dataclasses.fields(MakerOrder) if field.name not in {'tx_hash', 'tx_output_index'}
+)
 
 
 TakerOrdersTable = sqlalchemy.Table(
@@ -109,10 +225,25 @@ TakerOrdersTable = sqlalchemy.Table(
 
     sqlalchemy.Column('created_at', sqlalchemy.DateTime, nullable=True),
     sqlalchemy.Column('updated_at', sqlalchemy.DateTime, nullable=True),
+
+    # parsed from order_body by the repository, last as they are not fields of the orders, see SCALED_COLUMNS
+    sqlalchemy.Column('price', sqlalchemy.BigInteger, nullable=True),
+    sqlalchemy.Column('quantity', sqlalchemy.BigInteger, nullable=True),
+    sqlalchemy.Column('notional', sqlalchemy.BigInteger, nullable=True),
+    # how the fill was processed by the order fill watcher, NULL until then, see constants.Settlement
+    sqlalchemy.Column('settlement', sqlalchemy.String, nullable=True),
+
+    sqlalchemy.Index('taker_orders_identifier', 'exchange', 'order_id', unique=True),
+    sqlalchemy.Index('taker_orders_price', 'price'),
+    sqlalchemy.Index('taker_orders_filled', 'status', 'created_at'),
+    sqlalchemy.Index('taker_orders_maker_order_id', 'maker_order_id'),
+    sqlalchemy.Index('taker_orders_settlement', 'status', 'settlement'),
+    sqlite_autoincrement=True,
 )
 
+@_slotted
 @dataclasses.dataclass
-class TakerOrder:
+class TakerOrder(_BaseOrder):
     exchange: str
     status: str
     order_type: str
@@ -124,40 +255,20 @@ class TakerOrder:
     updated_at: datetime
     id: int = None
 
-    IDENTIFIER = 'order_id'
-
-    def is_buy(self) -> bool:
-        return self.order_type == OrderType.BUY
+    # the columns of the unique index taker_orders_identifier
+    IDENTIFIER = ('exchange', 'order_id')
 
-    def is_sell(self) -> bool:
-        return self.order_type == OrderType.SELL
-
-    def price(self) -> Decimal:
+    def _parse(self) -> Tuple[Decimal, Decimal]:
         """
-        Return decimal.Decimal
+        Return (price, quantity) as decimal.Decimal
         """
-        return Decimal(self.order_body['price'])
-
-    def quantity(self) -> Decimal:
-        return Decimal(self.order_body['quantity'])
+        return Decimal(self.order_body['price']), Decimal(self.order_body['quantity'])
 
     def as_object(self):
-        obj = {}
-        exclude_fields = {'order_body'}
-        for field in dataclasses.fields(self):
-            key = field.name
-            if key in exclude_fields:
-                continue
-
-            value = getattr(self, key)
-            if type(value) == datetime:
-                value = value.replace(microsecond=0).isoformat()
+        return self._as_object(_TAKER_OBJECT_FIELDS)
 
-            obj[key] = value
-
-        obj['quantity'] = str(self.quantity())
-        obj['price'] = str(self.price())
-
-        return obj
+_TAKER_OBJECT_FIELDS = tuple(
+    field.name for field in dataclasses.fields(TakerOrder) if field.name != 'order_body'
+)
 
 Order = TypeVar('Order', MakerOrder, TakerOrder)
@@ -1,98 +1,193 @@
 import time
 import logging
+from typing import Optional
 
 import aiopubsub
 
 from mm_bot.config import config
-from mm_bot.model.constants import Status
+from mm_bot.config.settings import Settings
+from mm_bot.model import outbox
+from mm_bot.model.poller import AdaptivePoller, ORDERS_PLACED, budget_of
+from mm_bot.model.unlock_scheduler import UnlockScheduler
+from mm_bot.model.constants import Settlement, Status
 from mm_bot.model.order import Order
-from mm_bot.model.repository import OrderRepository
+from mm_bot.model.order_store import InvalidTransitionError, OrderStore
 from mm_bot.exchange.taker.binance import Binance
 
 # FIXME, rename the class
 class OrderFillWatcher():
 
-    def __init__(self, repository: OrderRepository, exchange, borderless_exchange): # TODO: PING add both exchange
+    def __init__(self, store: OrderStore, exchange, borderless_exchange, hub: Optional[aiopubsub.Hub] = None,
+                 settings: Optional[Settings] = None): # TODO: PING add both exchange
         self._logger = logging.getLogger(f'{self.__class__.__name__}({exchange})')
-        self._loop = aiopubsub.loop.Loop(self._run, delay = 2) # TODO move to config or use config.sleep
+        self._settings = settings if settings is not None else Settings.from_config()
+        # the delay after every poll is the one of the poller, see mm_bot.model.poller
+        self._loop = aiopubsub.loop.Loop(self._run, delay = None)
+        self._poller = AdaptivePoller(
+            config('watcher_min_delay', parser=float),
+            config('watcher_max_delay', parser=float),
+            config('watcher_backoff', parser=float),
+            budget_of(exchange.name),
+        )
+        self._subscriber = aiopubsub.Subscriber(hub, f'order_fill_watcher_{exchange.name}') if hub is not None else None
 
         self.exchange = exchange
         self.borderless_exchange = borderless_exchange
-        self._repository = repository
+        # the orders are read from and changed in the store, see mm_bot.model.order_store
+        self._store = store
 
         self._last_attempt_to_unlock = time.time()
+        self._unlock_scheduler = UnlockScheduler(self._settings.exchange_borderless_deposit_length)
+
+    @property
+    def settings(self) -> Settings:
+        return self._settings
+
+    @settings.setter
+    def settings(self, settings: Settings) -> None:
+        """
+        Replaced on a reload of the config, with the deposit length of the unlock scheduler
+        """
+        self._settings = settings
+        self._unlock_scheduler.deposit_length = settings.exchange_borderless_deposit_length
 
     def start(self) -> None:
         self._logger.debug(f'Start to watch order fill events in {self.exchange}')
+        if self._subscriber is not None:
+            self._subscriber.add_sync_listener(('*',) + ORDERS_PLACED, self._on_orders_placed)
         self._loop.start()
 
     async def stop(self) -> None:
         self._logger.debug('Stopping')
         await self._loop.stop_wait()
+        if self._subscriber is not None:
+            await self._subscriber.remove_all_listeners()
+
+    def _on_orders_placed(self, key, exchange_name: str) -> None:
+        if exchange_name == self.exchange.name:
+            self._poller.wake()
 
     async def unlock_borderless_orders(self):
-        # throttle it
-        if time.time() - self._last_attempt_to_unlock < 10 * 60: # 10 min
+        """
+        The sweep of all the unmatched orders, for the ones the unlock
+        scheduler does not know of, like the orders missing in the db
+        """
+        if time.time() - self._last_attempt_to_unlock < self.settings.watcher_unlock_sweep_interval:
             return
 
         self._last_attempt_to_unlock = time.time()
         unmatched_orders = await self.exchange.get_unmatched_orders()
-        for unmatched_order in unmatched_orders:
+        # run by the outbox worker, a tx already unlocked or being unlocked is not enqueued again
+        jobs = [
+            outbox.unlock_job(self.exchange.name, unmatched_order['tx_hash'], unmatched_order['tx_output_index'])
+            for unmatched_order in unmatched_orders
+        ]
+        if jobs:
+            self._logger.info('Enqueue unlocking of %s txs', len(jobs))
+            self._store.enqueue_jobs(jobs)
+
+    async def unlock_due_orders(self) -> None:
+        """
+        Enqueues the unlocks of the open maker orders whose deposit window is
+        over, see mm_bot.model.unlock_scheduler
+        """
+        if self._unlock_scheduler.next_height is None:
+            return
+
+        latest_height = await self.exchange.get_latest_block_height()
+        due = self._unlock_scheduler.pop_due(latest_height)
+        if due:
+            self._logger.info('Enqueue unlocking of %s txs at height %s', len(due), latest_height)
+            self._store.enqueue_jobs([
+                outbox.unlock_job(self.exchange.name, tx_hash, tx_output_index) for tx_hash, tx_output_index in due
+            ])
+
+    async def settle_filled_orders(self) -> None:
+        """
+        Settles the maker orders of the new fills, the filled taker orders and
+        their maker orders are read from the store and the processed ones are
+        marked, so a loop only touches the new fills. The transfer of the
+        assets is enqueued in the transaction which marks the maker order
+        settled and is run by the outbox worker.
+        """
+        unsettled_orders = await self._store.unsettled_orders()
+        self._logger.info("Loaded unsettled filled binance orders: %s", len(unsettled_orders))
+
+        processed = {Settlement.SETTLED: [], Settlement.EXPIRED: [], Settlement.MISSING: [], Settlement.INVALID: []}
+        for order, maker_order in unsettled_orders:
+            if maker_order is None:
+                self._logger.warning("Maker order (id: %s) of taker order %s is missing", order.maker_order_id, order.id)
+                processed[Settlement.MISSING].append(order)
+                continue
+
+            if maker_order.status == Status.EXPIRED:
+                self._logger.info("Maker order (id: %s) is in expired status", maker_order.id)
+                processed[Settlement.EXPIRED].append(order)
+                continue
+
+            # settled by a loop which stopped before marking the taker order
+            if maker_order.status == Status.SETTLED:
+                processed[Settlement.SETTLED].append(order)
+                continue
+
+            order_body = maker_order.order_body
+            taker_order_body = maker_order.taker_order_body
+
+            # init a transfer from binance, which is binance with asset as sends_from_chain
+            # to address is to_addr
+            sends_from_chain = order_body['sendsFromChain']
+            asset_id = sends_from_chain
+            to_addr = taker_order_body['receivesToAddress']
+            amount = order_body['sendsUnit']
+
+            job = outbox.transfer_job(
+                self.exchange.name, maker_order.tx_hash, maker_order.tx_output_index, asset_id, to_addr, amount
+            )
+
+            self._logger.info("Mark order %s as %s, enqueue transfer %s", maker_order.id, Status.SETTLED, job['key'])
             try:
-                self._logger.info('Attempt unlocking tx: %s %s', unmatched_order['tx_hash'], unmatched_order['tx_output_index'])
-                res = await self.exchange.unlock_tx(unmatched_order['tx_hash'], unmatched_order['tx_output_index'])
-                self._logger.info('Done unlock with result: %s', res)
-            except Exception as e:
-                self._logger.exception('Error when unlocking')
+                self._store.transition(maker_order, Status.SETTLED, jobs=[job])
+            except InvalidTransitionError as e:
+                # like a maker order read from the db as canceled, not tried again
+                self._logger.warning('Not settling taker order %s: %s', order.id, e)
+                processed[Settlement.INVALID].append(order)
+                continue
+            processed[Settlement.SETTLED].append(order)
+
+        for settlement, orders in processed.items():
+            self._store.mark_settlement(orders, settlement)
+
+    def _transition(self, order: Order, status: str, **changes) -> None:
+        try:
+            self._store.transition(order, status, **changes)
+        except InvalidTransitionError as e:
+            self._logger.warning('Not updating order status: %s', e)
 
     async def _run(self) -> None:
+        busy = await self.poll()
+        await self._poller.sleep(busy)
+
+    async def poll(self) -> bool:
+        """
+        Returns whether there are orders to watch
+        """
         self._logger.debug('Poking %s', self.exchange)
+        await self._store.ensure_loaded()
 
         if self.exchange.name == Binance.name:
-            # since the orders in the db were created right after creating the orders from binance
-            # we need to load it from the db
-            open_orders = await self._repository.get_open_orders(self.exchange.side)
-            self._logger.info('Open orders from db: %s', len(open_orders))
+            # the orders are added to the store right after creating the orders in binance
+            open_orders = self._store.open_orders(self.exchange.side)
+            self._logger.info('Open orders from store: %s', len(open_orders))
             order_statuses = await self.exchange.get_order_status(open_orders)
             for order, status, _ in order_statuses:
                 if order.status == status:
                     continue
 
                 self._logger.info('Updating order status: %s to %s', order.id, status)
-                order.status = status
-                await self._repository.update_order(order)
+                self._transition(order, status)
 
-
-            filled_binance_orders = await self._repository.get_filled_orders(self.exchange.side)
-            self._logger.info("Loaded filled binance orders: %s", len(filled_binance_orders))
-            for order in filled_binance_orders:
-                # load the maker order and init the transfer from binance
-                status = order.status
-                if status == Status.FILLED:
-                    maker_order_id = order.maker_order_id
-                    maker_order = await self._repository.get_order_by_id('maker', maker_order_id)
-                    if maker_order is None:
-                        continue
-
-                    if maker_order.status == Status.EXPIRED:
-                        self._logger.info("Maker order (id: %s) is in expired status", maker_order.id)
-                        continue
-
-                    order_body = maker_order.order_body
-                    taker_order_body = maker_order.taker_order_body
-
-                    # init a transfer from binance, which is binance with asset as sends_from_chain
-                    # to address is to_addr
-                    sends_from_chain = order_body['sendsFromChain']
-                    asset_id = sends_from_chain
-                    to_addr = taker_order_body['receivesToAddress']
-                    amount = order_body['sendsUnit']
-
-                    await self.exchange.transfer_asset(asset_id, to_addr, amount)
-
-                    maker_order.status = Status.SETTLED
-                    self._logger.info("Mark order %s as %s", maker_order.id, maker_order.status)
-                    await self._repository.update_order(maker_order)
+            await self.settle_filled_orders()
+            return len(open_orders) != 0
         # borderless
         else:
             await self.unlock_borderless_orders()
@@ -103,31 +198,38 @@ class OrderFillWatcher():
                 self._logger.info('Loaded open orders %s from exchange: %s', len(open_orders_from_exchange), open_orders_from_exchange)
                 # save the open order to the db, as the borderless takes some time to mine the tx
                 # the create_orders does not have order info immediately
-                # find or create in db
-                await self._repository.find_update_or_create_orders(open_orders_from_exchange)
+                # find or create in the store
+                await self._store.upsert(open_orders_from_exchange)
 
-            open_orders_from_db = await self._repository.get_open_orders(self.exchange.side)
+            open_orders_from_db = self._store.open_orders(self.exchange.side)
 
             self._logger.info('Open orders %s to check status', len(open_orders_from_db))
 
             order_statuses = await self.exchange.get_order_status(open_orders_from_db)
             for order, status, taker_info in order_statuses:
+                if status == Status.FILLED:
+                    # matched, the collateral is not unlocked
+                    self._unlock_scheduler.cancel(order)
+
                 is_in_settlement_window = await self.borderless_exchange.is_in_settlement_window(order)
                 if not is_in_settlement_window:
                     self._logger.info("Order is not in the settle_window anymore so i will not send assets. Order id: %s", order.id)
-                    order.status = Status.EXPIRED
-                    self._logger.info("Mark order %s as %s", order.id, order.status)
-                    await self._repository.update_order(order)
+                    self._logger.info("Mark order %s as %s", order.id, Status.EXPIRED)
+                    self._transition(order, Status.EXPIRED)
                     continue
 
                 if order.status == status:
                     continue
 
                 self._logger.info('Updating order status: %s to %s', order.id, status)
-                order.status = status
+                changes = {}
                 if taker_info is not None:
                     self._logger.info('Updating order taker_order_body: %s to %s', order.id, taker_info)
-                    order.taker_order_body = taker_info
+                    changes['taker_order_body'] = taker_info
+
+                self._transition(order, status, **changes)
 
-                await self._repository.update_order(order)
+            self._unlock_scheduler.schedule([o for o in open_orders_from_db if o.status == Status.OPEN])
+            await self.unlock_due_orders()
 
+            return len(open_orders_from_db) != 0
@@ -0,0 +1,317 @@
+"""
+In-memory store of the live orders, with write-behind persistence
+
+The live orders are loaded once from the repository and kept indexed by
+id, by the tx key (tx_hash, tx_output_index) of the maker orders, by the
+binance order id of the taker orders and by status, the strategy and the
+order fill watchers read them from here instead of the db.
+
+A status changes by transition(), along TRANSITIONS. The changed orders
+and the outbox jobs of the transitions are written by a flush, every
+MMBC_ORDER_STORE_FLUSH_INTERVAL seconds or once MMBC_ORDER_STORE_BATCH_SIZE
+orders changed, all of them in one transaction (see
+OrderRepository.update_orders), the db is there for durability only. The
+new orders are written through, they need their ids.
+
+A maker order leaves the store with its taker orders once all of them are
+done with: the maker order settled, expired or canceled and the taker
+orders canceled, expired or filled and processed by the settlement.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+import aiopubsub
+
+from mm_bot.model.constants import JournalEvent, Status
+from mm_bot.model.journal import Journal
+from mm_bot.model.order import Order, MakerOrder, TakerOrder
+from mm_bot.model.repository import OrderRepository
+
+TRANSITIONS = {
+    MakerOrder: {
+        Status.OPEN: (Status.FILLED, Status.EXPIRED, Status.CANCELED),
+        Status.FILLED: (Status.SETTLED, Status.EXPIRED),
+    },
+    TakerOrder: {
+        Status.OPEN: (Status.FILLED, Status.EXPIRED, Status.CANCELED),
+    },
+}
+
+MAKER_DONE_STATUSES = (Status.SETTLED, Status.EXPIRED, Status.CANCELED)
+TAKER_DONE_STATUSES = (Status.EXPIRED, Status.CANCELED)
+
+
+class InvalidTransitionError(Exception):
+    def __init__(self, order: Order, status: str):
+        super().__init__(f'{order.__class__.__name__} {order.id} can not move from {order.status} to {status}')
+        self.order = order
+        self.status = status
+
+
+def side_of(order: Order) -> str:
+    return 'maker' if isinstance(order, MakerOrder) else 'taker'
+
+
+class OrderStore:
+
+    def __init__(self, repository: OrderRepository, flush_interval: float, batch_size: int,
+                 journal: Optional[Journal] = None):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        # the delay after every flush is the wait for the next one
+        self._loop = aiopubsub.loop.Loop(self._run, delay=None)
+        self.repository = repository
+        self._flush_interval = flush_interval
+        self._full = asyncio.Event()
+        self._batch_size = batch_size
+        self._journal = journal
+        self._loaded = False
+        self._loading = asyncio.Lock()
+
+        self._orders: Dict[str, Dict[int, Order]] = {'maker': {}, 'taker': {}}
+        self._by_status: Dict[Tuple[str, str], Dict[int, Order]] = defaultdict(dict)
+        self._by_tx_key: Dict[Tuple[str, int], MakerOrder] = {}
+        self._by_order_id: Dict[str, TakerOrder] = {}
+        self._takers_by_maker_id: Dict[int, Dict[int, TakerOrder]] = defaultdict(dict)
+        # the ids of the filled taker orders processed by the settlement, see constants.Settlement
+        self._settled: Set[int] = set()
+
+        # waiting for the next flush
+        self._dirty: Dict[Tuple[str, int], Order] = {}
+        self._jobs: List[dict] = []
+        self._new_settlements: Dict[str, List[TakerOrder]] = defaultdict(list)
+
+    def start(self) -> None:
+        self._loop.start()
+
+    async def stop(self) -> None:
+        await self._loop.stop_wait()
+        await self.flush()
+
+    async def ensure_loaded(self) -> None:
+        """
+        Loads the live orders: the open and filled maker orders with their
+        taker orders, the open taker orders and the filled ones not settled yet
+        """
+        async with self._loading:
+            if not self._loaded:
+                await self._load()
+
+    async def _load(self) -> None:
+
+        makers = await self.repository.get_open_orders('maker') + await self.repository.get_filled_orders('maker')
+        takers = await self.repository.get_open_orders('taker')
+        unsettled = set()
+        for taker_order, maker_order in await self.repository.get_unsettled_orders():
+            takers.append(taker_order)
+            unsettled.add(taker_order.id)
+            if maker_order is not None:
+                makers.append(maker_order)
+        # the hedges of the filled maker orders, a maker order is hedged once
+        takers += await self.repository.get_taker_orders_by_maker_id(
+            set(o.id for o in makers if o.status == Status.FILLED)
+        )
+
+        # the first one read wins, the others are the same rows
+        for order in makers + takers:
+            if order.id not in self._orders[side_of(order)]:
+                self._index(order)
+                if isinstance(order, TakerOrder) and order.status == Status.FILLED and order.id not in unsettled:
+                    self._settled.add(order.id)
+        self._loaded = True
+        self._logger.info('Loaded %s maker and %s taker orders', len(self._orders['maker']), len(self._orders['taker']))
+
+    def _index(self, order: Order) -> None:
+        side = side_of(order)
+        self._orders[side][order.id] = order
+        self._by_status[(side, order.status)][order.id] = order
+        if isinstance(order, MakerOrder):
+            self._by_tx_key[(order.tx_hash, order.tx_output_index)] = order
+        else:
+            self._by_order_id[order.order_id] = order
+            self._takers_by_maker_id[order.maker_order_id][order.id] = order
+
+    def _unindex(self, order: Order) -> None:
+        side = side_of(order)
+        del self._orders[side][order.id]
+        del self._by_status[(side, order.status)][order.id]
+        if isinstance(order, MakerOrder):
+            self._by_tx_key.pop((order.tx_hash, order.tx_output_index), None)
+        else:
+            self._by_order_id.pop(order.order_id, None)
+            takers = self._takers_by_maker_id[order.maker_order_id]
+            del takers[order.id]
+            if not takers:
+                del self._takers_by_maker_id[order.maker_order_id]
+            self._settled.discard(order.id)
+
+# reads #
+
+    def get(self, side: str, _id: int) -> Optional[Order]:
+        return self._orders[side].get(_id)
+
+    def get_by_tx_key(self, tx_hash: str, tx_output_index: int) -> Optional[MakerOrder]:
+        return self._by_tx_key.get((tx_hash, tx_output_index))
+
+    def get_by_order_id(self, order_id: str) -> Optional[TakerOrder]:
+        return self._by_order_id.get(order_id)
+
+    def orders(self, side: str, status: str) -> List[Order]:
+        return list(self._by_status[(side, status)].values())
+
+    def open_orders(self, side: str) -> List[Order]:
+        return self.orders(side, Status.OPEN)
+
+    def taker_orders_of(self, maker_order_id: int) -> List[TakerOrder]:
+        return list(self._takers_by_maker_id.get(maker_order_id, {}).values())
+
+    async def unsettled_orders(self) -> List[Tuple[TakerOrder, Optional[MakerOrder]]]:
+        """
+        The filled taker orders not processed by the settlement yet with their
+        maker orders (None when missing), a maker order done with before the
+        store was loaded is read from the db
+        """
+        unsettled = []
+        for order in sorted(self._by_status[('taker', Status.FILLED)].values(), key=lambda o: o.id):
+            if order.id in self._settled:
+                continue
+
+            maker_order = self._orders['maker'].get(order.maker_order_id)
+            if maker_order is None:
+                maker_order = await self.repository.get_order_by_id('maker', order.maker_order_id)
+                if maker_order is not None:
+                    self._index(maker_order)
+            unsettled.append((order, maker_order))
+        return unsettled
+
+# writes #
+
+    async def add(self, orders: List[Order]) -> List[Order]:
+        """
+        The new orders are written through
+        """
+        await self.repository.create_orders(orders)
+        for order in orders:
+            self._index(order)
+        return orders
+
+    async def upsert(self, orders: List[MakerOrder]) -> List[MakerOrder]:
+        """
+        The maker orders listed by the exchange, the known ones get the order
+        body and the block height of the exchange, the others are upserted in the db
+        """
+        unknown = []
+        for order in orders:
+            known = self.get_by_tx_key(order.tx_hash, order.tx_output_index)
+            if known is None:
+                unknown.append(order)
+            elif (known.order_body, known.block_height) != (order.order_body, order.block_height):
+                known.order_body = order.order_body
+                known.block_height = order.block_height
+                self._changed(known)
+
+        if unknown:
+            for order in await self.repository.find_update_or_create_orders(unknown):
+                previous = self._orders['maker'].get(order.id)
+                if previous is not None:
+                    self._unindex(previous)
+                self._index(order)
+        return orders
+
+    def transition(self, order: Order, status: str, jobs: List[dict] = (), **changes) -> None:
+        """
+        Moves the order to status along TRANSITIONS with the changes of its
+        other fields, the jobs are enqueued in the transaction of the change
+        """
+        if status not in TRANSITIONS[type(order)].get(order.status, ()):
+            raise InvalidTransitionError(order, status)
+
+        side = side_of(order)
+        del self._by_status[(side, order.status)][order.id]
+        order.status = status
+        for name, value in changes.items():
+            setattr(order, name, value)
+        self._by_status[(side, status)][order.id] = order
+        self._jobs.extend(jobs)
+        self._changed(order)
+        if self._journal is not None:
+            self._journal.append(JournalEvent.STATUS, {'side': side, 'id': order.id, 'status': status})
+
+    def enqueue_jobs(self, jobs: List[dict]) -> None:
+        self._jobs.extend(jobs)
+
+    def mark_settlement(self, taker_orders: List[TakerOrder], settlement: str) -> None:
+        self._settled.update(o.id for o in taker_orders)
+        self._new_settlements[settlement].extend(taker_orders)
+
+    def _changed(self, order: Order) -> None:
+        self._dirty[(side_of(order), order.id)] = order
+        if len(self._dirty) >= self._batch_size:
+            self._full.set()
+
+    async def flush(self) -> None:
+        """
+        Writes the changed orders and the jobs in one transaction, then the
+        settlements. Kept for the next flush when the db fails.
+        """
+        if not self._dirty and not self._jobs and not self._new_settlements:
+            return
+
+        dirty, self._dirty = self._dirty, {}
+        jobs, self._jobs = self._jobs, []
+        new_settlements, self._new_settlements = self._new_settlements, defaultdict(list)
+        try:
+            await self.repository.update_orders(list(dirty.values()), jobs=jobs)
+        except BaseException:
+            # failed or canceled by stop()
+            self._dirty = {**dirty, **self._dirty}
+            self._jobs = jobs + self._jobs
+            for settlement, orders in new_settlements.items():
+                self._new_settlements[settlement][:0] = orders
+            raise
+
+        try:
+            for settlement in list(new_settlements):
+                await self.repository.mark_settlement(new_settlements[settlement], settlement)
+                del new_settlements[settlement]
+        except BaseException:
+            for settlement, orders in new_settlements.items():
+                self._new_settlements[settlement][:0] = orders
+            raise
+        self._logger.debug('Flushed %s orders, %s jobs', len(dirty), len(jobs))
+        self._evict()
+
+    def _is_done(self, order: Order) -> bool:
+        if (side_of(order), order.id) in self._dirty:
+            return False
+        if isinstance(order, MakerOrder):
+            return order.status in MAKER_DONE_STATUSES
+        return order.status in TAKER_DONE_STATUSES or (order.status == Status.FILLED and order.id in self._settled)
+
+    def _evict(self) -> None:
+        for maker_order in self.orders('maker', Status.SETTLED) + self.orders('maker', Status.EXPIRED) + self.orders('maker', Status.CANCELED):
+            taker_orders = self.taker_orders_of(maker_order.id)
+            if self._is_done(maker_order) and all(self._is_done(o) for o in taker_orders):
+                for order in [maker_order] + taker_orders:
+                    self._unindex(order)
+
+        # the taker orders of the maker orders which left the store
+        for maker_order_id in [i for i in self._takers_by_maker_id if i not in self._orders['maker']]:
+            taker_orders = self.taker_orders_of(maker_order_id)
+            if all(self._is_done(o) for o in taker_orders):
+                for order in taker_orders:
+                    self._unindex(order)
+
+    async def _run(self) -> None:
+        try:
+            await asyncio.wait_for(self._full.wait(), self._flush_interval)
+            self._logger.debug('%s orders changed, flushing before the interval', len(self._dirty))
+        except asyncio.TimeoutError:
+            pass
+        self._full.clear()
+
+        try:
+            await self.flush()
+        except Exception:
+            self._logger.exception('Error when flushing the orders, retrying at the next interval')
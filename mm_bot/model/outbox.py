@@ -0,0 +1,224 @@
+"""
+Transactional outbox of the asset transfers and the unlocks
+
+A transfer is written as a job in the same transaction which marks its
+maker order settled, an unlock is written when the unmatched order is found.
+The key of a job is its idempotency key, a job is enqueued once per key
+(a failed one is armed again). OutboxWorker runs the due jobs in the
+background with bounded concurrency and retries them with exponential
+backoff, so a slow withdrawal does not block the order fill watcher.
+
+A job interrupted by a crash is run again only when its kind is resumable,
+an interrupted transfer may have been sent and is failed for a human to
+check instead of risking a double transfer.
+"""
+import asyncio
+import dataclasses
+import logging
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import aiopubsub
+import sqlalchemy
+
+from mm_bot.model.constants import JobKind, JobStatus
+from mm_bot.model.order import metadata
+
+RESUMABLE_KINDS = (JobKind.UNLOCK,)
+
+OutboxTable = sqlalchemy.Table(
+    'outbox',
+    metadata,
+    sqlalchemy.Column('id', sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column('kind', sqlalchemy.String, nullable=False),
+    sqlalchemy.Column('key', sqlalchemy.VARCHAR(255), nullable=False),
+    sqlalchemy.Column('payload', sqlalchemy.JSON, nullable=False),
+    sqlalchemy.Column('status', sqlalchemy.String, nullable=False),
+    sqlalchemy.Column('attempts', sqlalchemy.Integer, nullable=False, default=0),
+    sqlalchemy.Column('last_error', sqlalchemy.Text, nullable=True),
+    sqlalchemy.Column('next_attempt_at', sqlalchemy.DateTime, nullable=False),
+    sqlalchemy.Column('created_at', sqlalchemy.DateTime, nullable=False),
+    sqlalchemy.Column('started_at', sqlalchemy.DateTime, nullable=True),
+    sqlalchemy.Column('finished_at', sqlalchemy.DateTime, nullable=True),
+
+    sqlalchemy.Index('outbox_key', 'key', unique=True),
+    sqlalchemy.Index('outbox_due', 'status', 'next_attempt_at'),
+)
+
+# the same statement for sqlite and postgresql, a pending, running or done job is not enqueued twice
+ENQUEUE = sqlalchemy.text(
+    'INSERT INTO outbox (kind, key, payload, status, attempts, next_attempt_at, created_at) '
+    'VALUES (:kind, :key, :payload, :status, 0, :next_attempt_at, :created_at) '
+    'ON CONFLICT (key) DO UPDATE SET '
+    'payload = excluded.payload, status = excluded.status, attempts = 0, last_error = NULL, '
+    'next_attempt_at = excluded.next_attempt_at, created_at = excluded.created_at, '
+    'started_at = NULL, finished_at = NULL '
+    f"WHERE outbox.status = '{JobStatus.FAILED}'"
+).bindparams(
+    sqlalchemy.bindparam('payload', type_=sqlalchemy.JSON),
+    sqlalchemy.bindparam('next_attempt_at', type_=sqlalchemy.DateTime),
+    sqlalchemy.bindparam('created_at', type_=sqlalchemy.DateTime),
+)
+
+
+@dataclasses.dataclass
+class Job:
+    id: int
+    kind: str
+    key: str
+    payload: Dict[str, Any]
+    attempts: int
+    created_at: datetime
+
+
+def _job(kind: str, key: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    The values of ENQUEUE
+    """
+    now = datetime.utcnow()
+    return {
+        'kind': kind, 'key': key, 'payload': payload, 'status': JobStatus.PENDING,
+        'next_attempt_at': now, 'created_at': now,
+    }
+
+
+def transfer_job(exchange: str, tx_hash: str, tx_output_index: int, asset_id: str, to_addr: str, amount: Any) -> Dict[str, Any]:
+    # one transfer per maker order, by its output and not by its row id
+    return _job(JobKind.TRANSFER, f'{JobKind.TRANSFER}:{exchange}:{tx_hash}:{tx_output_index}', {
+        'exchange': exchange,
+        'asset_id': asset_id,
+        'to_addr': to_addr,
+        'amount': str(amount),
+    })
+
+
+def unlock_job(exchange: str, tx_hash: str, tx_output_index: int) -> Dict[str, Any]:
+    return _job(JobKind.UNLOCK, f'{JobKind.UNLOCK}:{exchange}:{tx_hash}:{tx_output_index}', {
+        'exchange': exchange,
+        'tx_hash': tx_hash,
+        'tx_output_index': tx_output_index,
+    })
+
+
+def exchange_handlers(exchanges: Dict[str, Any]) -> Dict[str, Callable[[Job], Awaitable[Any]]]:
+    """
+    The handlers of the jobs, the exchanges by name
+    """
+    async def transfer(job: Job) -> Any:
+        payload = job.payload
+        exchange = exchanges[payload['exchange']]
+        # the key identifies the withdrawal at the exchange
+        return await exchange.transfer_asset(
+            payload['asset_id'], payload['to_addr'], Decimal(payload['amount']), withdraw_order_id=job.key
+        )
+
+    async def unlock(job: Job) -> Any:
+        payload = job.payload
+        return await exchanges[payload['exchange']].unlock_tx(payload['tx_hash'], payload['tx_output_index'])
+
+    return {JobKind.TRANSFER: transfer, JobKind.UNLOCK: unlock}
+
+
+@dataclasses.dataclass
+class JobMetrics:
+    done: int = 0
+    retried: int = 0
+    failed: int = 0
+    run_seconds: float = 0.0
+    max_run_seconds: float = 0.0
+    wait_seconds: float = 0.0 # from enqueued to started
+
+    def as_dict(self) -> Dict[str, Any]:
+        runs = self.done + self.retried + self.failed
+        return dict(
+            dataclasses.asdict(self),
+            avg_run_seconds=self.run_seconds / runs if runs else 0.0,
+            avg_wait_seconds=self.wait_seconds / runs if runs else 0.0,
+        )
+
+
+class OutboxWorker:
+
+    def __init__(self, repository, handlers: Dict[str, Callable[[Job], Awaitable[Any]]],
+                 concurrency: int, max_attempts: int, backoff: float, delay: float):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._loop = aiopubsub.loop.Loop(self._run, delay=delay)
+        self._repository = repository
+        self._handlers = handlers
+        self._concurrency = concurrency
+        self._max_attempts = max_attempts
+        self._backoff = backoff
+        self._recovered = False
+        self._running: Dict[int, asyncio.Future] = {}
+        self.metrics: Dict[str, JobMetrics] = {kind: JobMetrics() for kind in handlers}
+
+    def start(self) -> None:
+        self._logger.info('Start running the outbox jobs, concurrency: %s, max attempts: %s',
+                          self._concurrency, self._max_attempts)
+        self._loop.start()
+
+    async def stop(self) -> None:
+        await self._loop.stop_wait()
+        # the jobs started are finished, an interrupted transfer would be failed at the next start
+        if self._running:
+            await asyncio.gather(*self._running.values(), return_exceptions=True)
+
+    def backoff(self, attempts: int) -> timedelta:
+        return timedelta(seconds=self._backoff * 2 ** (attempts - 1))
+
+    async def run_due_jobs(self) -> None:
+        if not self._recovered:
+            resumed, failed = await self._repository.recover_jobs(RESUMABLE_KINDS)
+            if resumed or failed:
+                self._logger.warning('Interrupted jobs, resumed: %s, failed to be checked: %s', resumed, failed)
+            self._recovered = True
+
+        free = self._concurrency - len(self._running)
+        if free <= 0:
+            return
+
+        for job in await self._repository.get_due_jobs(datetime.utcnow(), free):
+            if job.id not in self._running:
+                self._running[job.id] = asyncio.ensure_future(self._execute(job))
+
+    async def _execute(self, job: Job) -> None:
+        metrics = self.metrics.setdefault(job.kind, JobMetrics())
+        try:
+            started_at = datetime.utcnow()
+            await self._repository.start_job(job, started_at)
+            job.attempts += 1
+            metrics.wait_seconds += max(0.0, (started_at - job.created_at).total_seconds())
+
+            started = time.monotonic()
+            error: Optional[Exception] = None
+            try:
+                await self._handlers[job.kind](job)
+            except Exception as e:
+                error = e
+            elapsed = time.monotonic() - started
+            metrics.run_seconds += elapsed
+            metrics.max_run_seconds = max(metrics.max_run_seconds, elapsed)
+
+            if error is None:
+                metrics.done += 1
+                await self._repository.finish_job(job, datetime.utcnow())
+                self._logger.info('Job %s %s done in %.3fs, attempt %s', job.id, job.key, elapsed, job.attempts)
+            elif job.attempts < self._max_attempts:
+                metrics.retried += 1
+                next_attempt_at = datetime.utcnow() + self.backoff(job.attempts)
+                await self._repository.retry_job(job, next_attempt_at, repr(error))
+                self._logger.warning('Job %s %s failed in %.3fs, attempt %s, retry at %s: %r',
+                                     job.id, job.key, elapsed, job.attempts, next_attempt_at, error)
+            else:
+                metrics.failed += 1
+                await self._repository.fail_job(job, datetime.utcnow(), repr(error))
+                self._logger.error('Job %s %s failed after %s attempts: %r', job.id, job.key, job.attempts, error)
+        except Exception:
+            self._logger.exception('Error when running job %s', job.id)
+        finally:
+            del self._running[job.id]
+
+    async def _run(self) -> None:
+        await self.run_due_jobs()
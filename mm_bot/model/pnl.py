@@ -0,0 +1,108 @@
+"""
+Daily rollup of the profit and the volume of the filled orders
+
+A row per day and currency, the day is the creation day (utc) of the order.
+It is maintained by the repository in the transaction which moves an order:
+    taker order to filled: filled + 1, volume + taker notional,
+        profit + the profit of the pair as in get_filled_orders_in_range
+    maker order to settled: settled + 1, settled_volume + maker notional
+The amounts are in 10^-AMOUNT_COLUMN_DECIMALS of the counter currency, like
+the notional columns of the orders.
+"""
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import sqlalchemy
+
+from mm_bot.helpers import decimal_to_str
+from mm_bot.model import fixed_point
+from mm_bot.model.constants import OrderType, Status
+from mm_bot.model.order import metadata, MakerOrder, TakerOrder
+
+DailyPnlTable = sqlalchemy.Table(
+    'daily_pnl',
+    metadata,
+    sqlalchemy.Column('day', sqlalchemy.Date, primary_key=True),
+    sqlalchemy.Column('currency', sqlalchemy.VARCHAR(255), primary_key=True),
+    sqlalchemy.Column('filled', sqlalchemy.Integer, nullable=False, default=0),
+    sqlalchemy.Column('volume', sqlalchemy.BigInteger, nullable=False, default=0),
+    sqlalchemy.Column('profit', sqlalchemy.BigInteger, nullable=False, default=0),
+    sqlalchemy.Column('settled', sqlalchemy.Integer, nullable=False, default=0),
+    sqlalchemy.Column('settled_volume', sqlalchemy.BigInteger, nullable=False, default=0),
+)
+
+COUNTERS = ('filled', 'volume', 'profit', 'settled', 'settled_volume')
+AMOUNTS = ('volume', 'profit', 'settled_volume')
+
+# the same statement for sqlite and postgresql
+UPSERT_DAILY_PNL = sqlalchemy.text(
+    'INSERT INTO daily_pnl (day, currency, filled, volume, profit, settled, settled_volume) '
+    'VALUES (:day, :currency, :filled, :volume, :profit, :settled, :settled_volume) '
+    'ON CONFLICT (day, currency) DO UPDATE SET ' +
+    ', '.join(f'{counter} = daily_pnl.{counter} + excluded.{counter}' for counter in COUNTERS)
+).bindparams(sqlalchemy.bindparam('day', type_=sqlalchemy.Date))
+
+
+def day_of(order) -> date:
+    """
+    The day of created_at, of updated_at without it, as the daily_pnl migration
+    """
+    created_at = order.created_at or order.updated_at
+    if isinstance(created_at, str):
+        created_at = datetime.fromisoformat(created_at.rstrip('Z'))
+    return (created_at or datetime.utcnow()).date()
+
+
+def is_rolled_up(order, status: str, previous_status: Optional[str]) -> bool:
+    """
+    The order moved to the status counted by the rollup
+    """
+    rolled_up_status = Status.FILLED if isinstance(order, TakerOrder) else Status.SETTLED
+    return status == rolled_up_status and previous_status != rolled_up_status
+
+
+def pair_profit(maker_order_type: str, maker_notional: Optional[int], taker_notional: Optional[int]) -> int:
+    if maker_notional is None or taker_notional is None:
+        return 0
+
+    if maker_order_type == OrderType.BUY:
+        return taker_notional - maker_notional
+    else:
+        return maker_notional - taker_notional
+
+
+def rollup_values(orders: List[Any], makers: Dict[int, Tuple[str, Optional[int]]]) -> List[Dict[str, Any]]:
+    """
+    The values of UPSERT_DAILY_PNL for the orders moved to filled (taker) or
+    settled (maker), makers are (order_type, notional) by id for the maker
+    orders of the taker orders
+    """
+    rows: Dict[Tuple[date, str], Dict[str, Any]] = {}
+    for order in orders:
+        day = day_of(order)
+        row = rows.setdefault((day, order.currency), dict(
+            {counter: 0 for counter in COUNTERS}, day=day, currency=order.currency
+        ))
+        notional = order.scaled_values()['notional']
+        if isinstance(order, TakerOrder):
+            row['filled'] += 1
+            row['volume'] += notional or 0
+            if order.maker_order_id in makers:
+                row['profit'] += pair_profit(*makers[order.maker_order_id], notional)
+        elif isinstance(order, MakerOrder):
+            row['settled'] += 1
+            row['settled_volume'] += notional or 0
+
+    return list(rows.values())
+
+
+def as_report(row) -> Dict[str, Any]:
+    report = {'currency': row['currency']}
+    if 'day' in row.keys():
+        report['day'] = row['day'].isoformat()
+    for counter in COUNTERS:
+        value = row[counter] or 0
+        if counter in AMOUNTS:
+            value = decimal_to_str(fixed_point.from_scaled(value, fixed_point.AMOUNT_COLUMN_DECIMALS))
+        report[counter] = value
+    return report
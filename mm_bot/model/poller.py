@@ -0,0 +1,98 @@
+"""
+Adaptive polling of the exchanges by the order fill watchers
+
+A watcher polls at min_delay while it has orders open, the delay is
+multiplied by backoff after every idle poll up to max_delay, and a
+('*', 'orders', 'placed') message of the hub wakes it up right away, the
+strategy publishes it with the name of the exchange after placing orders.
+
+The polls of an exchange are capped by a budget of polls per minute shared
+by its watchers, MMBC_WATCHER_<EXCHANGE>_BUDGET.
+"""
+import asyncio
+import collections
+import logging
+import time
+from typing import Deque, Dict, Optional
+
+from mm_bot.config import config
+
+ORDERS_PLACED = ('orders', 'placed')
+
+_budgets: Dict[str, 'PollBudget'] = {}
+
+
+class PollBudget:
+    """
+    At most calls polls in period seconds
+    """
+
+    def __init__(self, calls: int, period: float = 60.0):
+        self._calls = calls
+        self._period = period
+        self._polls: Deque[float] = collections.deque()
+
+    def wait_time(self, now: float) -> float:
+        """
+        The seconds to wait at now for the next poll
+        """
+        while self._polls and now - self._polls[0] >= self._period:
+            self._polls.popleft()
+        if len(self._polls) < self._calls:
+            return 0.0
+        return self._polls[0] + self._period - now
+
+    def spend(self, now: float) -> None:
+        self._polls.append(now)
+
+
+def budget_of(exchange: str) -> PollBudget:
+    """
+    The budget of an exchange shared by its watchers
+    """
+    if exchange not in _budgets:
+        _budgets[exchange] = PollBudget(config(f'watcher_{exchange}_budget', parser=int))
+    return _budgets[exchange]
+
+
+class AdaptivePoller:
+
+    def __init__(self, min_delay: float, max_delay: float, backoff: float, budget: Optional[PollBudget] = None):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._min_delay = min_delay
+        self._max_delay = max_delay
+        self._backoff = backoff
+        self._budget = budget
+        self._woken = asyncio.Event()
+        self.delay = min_delay
+        self.polls = 0
+
+    def wake(self) -> None:
+        self._woken.set()
+
+    def next_delay(self, busy: bool) -> float:
+        if busy:
+            return self._min_delay
+        return min(self.delay * self._backoff, self._max_delay)
+
+    async def sleep(self, busy: bool) -> None:
+        """
+        Waits for the next poll, busy tells whether the last poll found orders to watch
+        """
+        self.delay = self.next_delay(busy)
+        try:
+            await asyncio.wait_for(self._woken.wait(), self.delay)
+            self._logger.debug('Woken up after orders were placed')
+            # a fill may be close, poll fast until the orders are seen
+            self.delay = self._min_delay
+        except asyncio.TimeoutError:
+            pass
+        self._woken.clear()
+
+        if self._budget is not None:
+            wait_time = self._budget.wait_time(time.monotonic())
+            if wait_time > 0:
+                self._logger.debug('Poll budget spent, waiting %.2fs', wait_time)
+                await asyncio.sleep(wait_time)
+            self._budget.spend(time.monotonic())
+        self.polls += 1
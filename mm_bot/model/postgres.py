@@ -0,0 +1,169 @@
+"""
+PostgreSQL for the fleets of bots sharing a central database
+
+A databases.Database on asyncpg with the pool sized per process, a bot
+runs one pair so a few connections are enough and many bots do not exhaust
+max_connections of the server.
+
+PostgresDatabase answers the bulk writes of SQLiteDatabase with the same
+signatures, so the repository does not tell them apart: `insert_many` takes
+the ids from the sequence up front and loads the rows with COPY,
+`upsert_many` is INSERT ... ON CONFLICT DO UPDATE ... RETURNING, and
+`execute_many` / `execute_batches` / `execute_all` run in one transaction.
+
+asyncpg and psycopg2-binary (for alembic) are the `postgres` extra,
+poetry install -E postgres.
+"""
+import json
+import typing
+
+import sqlalchemy
+from databases import Database
+from databases.core import DatabaseURL
+from sqlalchemy import Table, func, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql import ClauseElement
+
+from mm_bot.config import config
+
+# the bind parameters of a statement are numbered with an int16
+MAX_PARAMETERS = 32767
+
+
+def is_postgres(url: str) -> bool:
+    return DatabaseURL(url).dialect == 'postgresql'
+
+
+def _copy_processors(table: Table, columns: typing.Sequence[str]) -> typing.List[typing.Optional[typing.Callable]]:
+    """
+    COPY bypasses the bind processors of sqlalchemy, asyncpg takes the json columns as text
+    """
+    return [json.dumps if isinstance(table.c[column].type, sqlalchemy.JSON) else None for column in columns]
+
+
+class PostgresDatabase(Database):
+
+    def __init__(self, url: str, min_size: typing.Optional[int] = None, max_size: typing.Optional[int] = None):
+        try:
+            import asyncpg  # noqa: F401
+        except ImportError:
+            raise RuntimeError(
+                'a postgresql database needs asyncpg, install the postgres extra: '
+                'poetry install -E postgres (or pip install asyncpg psycopg2-binary)'
+            ) from None
+
+        super().__init__(
+            url,
+            min_size=config('database_postgres_min_size', parser=int) if min_size is None else min_size,
+            max_size=config('database_postgres_max_size', parser=int) if max_size is None else max_size,
+        )
+
+    async def insert_many(
+        self, table: Table, values: typing.List[dict], keys: typing.Sequence[str],
+        batches: typing.List[typing.Tuple[ClauseElement, typing.List[dict]]] = (),
+    ) -> typing.List[int]:
+        """
+        COPY of the rows with ids taken from the sequence of the table,
+        returns the ids in the order of values, keys are not needed for them.
+        batches (see execute_batches) run after them in the same transaction.
+        """
+        if not values:
+            return []
+
+        columns = ['id'] + [column for column in values[0] if column != 'id']
+        processors = _copy_processors(table, columns)
+        sequence = func.pg_get_serial_sequence(table.name, 'id')
+        # typed, asyncpg does not tell generate_series(int) from generate_series(bigint) of untyped parameters
+        count = sqlalchemy.cast(len(values), sqlalchemy.Integer)
+        id_query = select([func.nextval(sequence)]).select_from(func.generate_series(1, count))
+
+        async with self.connection() as connection:
+            async with connection.transaction():
+                ids = [row[0] for row in await connection.fetch_all(id_query)]
+                records = [
+                    tuple(
+                        processor(value) if processor is not None and value is not None else value
+                        for processor, value in zip(processors, [row_id] + [row[column] for column in columns[1:]])
+                    )
+                    for row_id, row in zip(ids, values)
+                ]
+                await connection.raw_connection.copy_records_to_table(table.name, records=records, columns=columns)
+                await self._execute_batches(connection, batches)
+
+        return ids
+
+    async def upsert_many(self, table: Table, values: typing.List[dict], keys: typing.Sequence[str]) -> typing.List[int]:
+        """
+        INSERT ... ON CONFLICT (keys) DO UPDATE of the other columns, returns
+        the ids of the rows in the order of values. keys need a unique index.
+        """
+        if not values:
+            return []
+
+        key_columns = [table.c[key] for key in keys]
+        rows_per_statement = max(1, MAX_PARAMETERS // len(values[0]))
+        ids_by_key = {}
+        async with self.connection() as connection:
+            async with connection.transaction():
+                for start in range(0, len(values), rows_per_statement):
+                    statement = postgresql.insert(table).values(values[start:start + rows_per_statement])
+                    statement = statement.on_conflict_do_update(
+                        index_elements=list(keys),
+                        set_={column: statement.excluded[column] for column in values[0] if column not in keys},
+                    ).returning(table.c.id, *key_columns)
+                    for row in await connection.fetch_all(statement):
+                        ids_by_key[tuple(row[i] for i in range(1, len(keys) + 1))] = row[0]
+
+        return [ids_by_key[tuple(value[key] for key in keys)] for value in values]
+
+    def _compile_many(self, query: ClauseElement, values: typing.List[dict]) -> typing.Tuple[str, typing.List[list]]:
+        """
+        The query compiled once for the keys of the first values, with the
+        $n parameters of asyncpg as databases numbers them, and the arguments
+        of every values
+        """
+        dialect = self._backend._dialect
+        compiled = query.compile(dialect=dialect, column_keys=list(values[0]))
+        keys = sorted(compiled.construct_params(values[0]))
+        statement = compiled.string % {key: f'${i}' for i, key in enumerate(keys, start=1)}
+        processors = {
+            key: processor for key, processor in (
+                (key, compiled.binds[key].type.dialect_impl(dialect).bind_processor(dialect)) for key in keys
+            ) if processor is not None
+        }
+        args = []
+        for value in values:
+            params = compiled.construct_params(value)
+            args.append([processors[key](params[key]) if key in processors else params[key] for key in keys])
+
+        return statement, args
+
+    async def execute_batches(self, batches: typing.List[typing.Tuple[ClauseElement, typing.List[dict]]]) -> None:
+        """
+        Every query is compiled once for the keys of its first values and run
+        with executemany, all the values of a query need the same keys.
+        All the batches run in one transaction.
+        """
+        async with self.connection() as connection:
+            async with connection.transaction():
+                await self._execute_batches(connection, batches)
+
+    async def _execute_batches(self, connection, batches: typing.List[typing.Tuple[ClauseElement, typing.List[dict]]]) -> None:
+        for query, values in batches:
+            if not values:
+                continue
+
+            statement, args = self._compile_many(query, values)
+            await connection.raw_connection.executemany(statement, args)
+
+    async def execute_many(self, query: ClauseElement, values: typing.List[dict]) -> None:
+        await self.execute_batches([(query, values)])
+
+    async def execute_all(self, queries: typing.List[ClauseElement]) -> None:
+        """
+        The queries one after the other in one transaction
+        """
+        async with self.connection() as connection:
+            async with connection.transaction():
+                for query in queries:
+                    await connection.execute(query)
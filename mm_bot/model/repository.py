@@ -1,21 +1,75 @@
-from typing import List, Set, Union, Optional
+from datetime import datetime
+from typing import List, Set, Tuple, Union, Optional
 from typing_extensions import Literal
-import dataclasses
 
 import arrow
 import asyncio
+import sqlalchemy
 from databases import Database
-from sqlalchemy import func, select, bindparam, text
+from sqlalchemy import func, select, bindparam, text, tuple_
 
-from mm_bot.model.constants import Status, OrderType
+from mm_bot.model import outbox, pnl
+from mm_bot.model.constants import JobStatus, Status, OrderType
 from mm_bot.model.order import Order, MakerOrder, MakerOrdersTable, TakerOrder, TakerOrdersTable
+from mm_bot.model.outbox import Job, OutboxTable
+from mm_bot.model.pnl import DailyPnlTable
+from mm_bot.model.postgres import PostgresDatabase, is_postgres
+from mm_bot.model.sqlite import SQLiteDatabase, is_sqlite
 from mm_bot.helpers import decimal_to_str
 
+# the databases with the bulk writes insert_many, upsert_many, execute_batches and execute_all
+BULK_DATABASES = (SQLiteDatabase, PostgresDatabase)
+
+# ids per UPDATE, below the 999 variables of older sqlite
+MARK_SETTLEMENT_BATCH = 500
+
+
+def row_values(row, start: int = 0, stop: Optional[int] = None) -> list:
+    """
+    The values of row by position, the rows of postgresql are mappings which
+    can not be sliced or unpacked
+    """
+    return [row[i] for i in range(start, len(row) if stop is None else stop)]
+
+
+def to_record(record_cls, row) -> Order:
+    # the SCALED_COLUMNS come after the fields
+    row_id, *fields = row_values(row, 0, len(record_cls._FIELDS))
+    record = record_cls(*fields)
+    record.id = row_id
+    record.mark_persisted()
+    return record
+
+
+def with_scaled_values(order: Order, values: dict) -> dict:
+    """
+    The SCALED_COLUMNS are written along with the columns they are parsed from
+    """
+    if 'order_body' in values or 'order_type' in values:
+        values.update(order.scaled_values())
+    return values
+
+
+def table_of(order: Order) -> sqlalchemy.Table:
+    if isinstance(order, MakerOrder):
+        return MakerOrdersTable
+    elif isinstance(order, TakerOrder):
+        return TakerOrdersTable
+    else:
+        raise RuntimeError('invalid side')
+
 
 class OrderRepository:
 
     def __init__(self, db_path: str):
-        self._db = Database(db_path)
+        # sqlite gets a single writer and read only connections, see mm_bot.model.sqlite
+        # postgresql a pool sized per process, see mm_bot.model.postgres
+        if is_sqlite(db_path):
+            self._db = SQLiteDatabase(db_path)
+        elif is_postgres(db_path):
+            self._db = PostgresDatabase(db_path)
+        else:
+            self._db = Database(db_path)
         self._connected = False
 
 
@@ -30,8 +84,8 @@ class OrderRepository:
         if self._connected:
             await self._db.disconnect()
 
-    async def get_all_orders(self, side: Union[Literal['maker'], Literal['taker']]) -> List[Order]:
-        return await self._get_orders(side, None)
+    async def get_all_orders(self, side: Union[Literal['maker'], Literal['taker']], include_archive: bool = False) -> List[Order]:
+        return await self._get_orders(side, None, include_archive=include_archive)
 
     async def get_open_orders(self, side: Union[Literal['maker'], Literal['taker']]) -> List[Order]:
         return await self._get_orders(side, Status.OPEN)
@@ -53,7 +107,7 @@ class OrderRepository:
         for order in TakerOrder.select(lambda o: o.maker_order_id in filled_maker_order_ids):
             filled_maker_order_ids.discard(order.maker_order_id)
 
-    async def get_order_by_id(self, side: Union[Literal['maker'], Literal['taker']], _id: int) -> Optional[Order]:
+    async def get_order_by_id(self, side: Union[Literal['maker'], Literal['taker']], _id: int, include_archive: bool = False) -> Optional[Order]:
         if side == 'maker':
             tbl_cls = MakerOrdersTable
             record_cls = MakerOrder
@@ -67,32 +121,62 @@ class OrderRepository:
 
         query = tbl_cls.select().where(tbl_cls.c.id == _id)
         row = await self._db.fetch_one(query=query)
+        if row is None and include_archive:
+            from mm_bot.model.archive import ARCHIVE_TABLES
+            archive_tbl = ARCHIVE_TABLES[tbl_cls]
+            row = await self._db.fetch_one(query=archive_tbl.select().where(archive_tbl.c.id == _id))
         if row is None:
             return None
 
-        row_id, *fields = row
-
-        order = record_cls(*fields)
-        order.id = row_id
-
-        return order
+        return to_record(record_cls, row)
 
 
     async def get_taker_orders_by_maker_id(self, maker_ids: Set[int]) -> List[TakerOrder]:
         await self._ensure_connected()
         query = TakerOrdersTable.select().where(TakerOrdersTable.c.maker_order_id.in_(maker_ids))
         res = await self._db.fetch_all(query=query)
-        # TODO this mapping to record class should be pulled up to function outside of repo class
-        results = []
-        res = await self._db.fetch_all(query=query)
-        for row_id, *fields in res:
-            record = TakerOrder(*fields)
-            record.id = row_id
-            results.append(record)
+        return [to_record(TakerOrder, row) for row in res]
 
-        return results
+    async def get_unsettled_orders(self) -> List[Tuple[TakerOrder, Optional[MakerOrder]]]:
+        """
+        The filled taker orders not processed by the settlement yet with their
+        maker orders (None when missing), in one query. The processed ones are
+        marked by mark_settlement and skipped by the index on (status, settlement).
+        """
+        await self._ensure_connected()
+        query = select([TakerOrdersTable, MakerOrdersTable]) \
+            .select_from(TakerOrdersTable.outerjoin(MakerOrdersTable, MakerOrdersTable.c.id == TakerOrdersTable.c.maker_order_id)) \
+            .where(TakerOrdersTable.c.status == Status.FILLED) \
+            .where(TakerOrdersTable.c.settlement.is_(None)) \
+            .order_by(TakerOrdersTable.c.id)
 
-    async def _get_orders(self, side: Union[Literal['maker'], Literal['taker']], status: Optional[Status], count=False) -> Union[List[Order], bool]:
+        res = await self._db.fetch_all(query=query)
+        taker_columns = len(TakerOrdersTable.c)
+        return [
+            (
+                to_record(TakerOrder, row_values(row, 0, taker_columns)),
+                to_record(MakerOrder, row_values(row, taker_columns)) if row[taker_columns] is not None else None,
+            )
+            for row in res
+        ]
+
+    async def mark_settlement(self, taker_orders: List[TakerOrder], settlement: str) -> None:
+        """
+        The filled taker orders are processed, see constants.Settlement
+        """
+        if len(taker_orders) == 0:
+            return
+
+        await self._ensure_connected()
+        ids = [o.id for o in taker_orders]
+        for start in range(0, len(ids), MARK_SETTLEMENT_BATCH):
+            query = TakerOrdersTable.update() \
+                .where(TakerOrdersTable.c.id.in_(ids[start:start + MARK_SETTLEMENT_BATCH])) \
+                .values(settlement=settlement)
+            await self._db.execute(query=query)
+
+    async def _get_orders(self, side: Union[Literal['maker'], Literal['taker']], status: Optional[Status], count=False,
+                          include_archive=False) -> Union[List[Order], bool]:
         if side == 'maker':
             tbl_cls = MakerOrdersTable
             record_cls = MakerOrder
@@ -108,50 +192,68 @@ class OrderRepository:
             query = select([func.count()]).select_from(tbl_cls)
             if status:
                 query = query.where(tbl_cls.c.status == status)
-            count, = await self._db.fetch_one(query = query)
+            count = (await self._db.fetch_one(query = query))[0]
             return count
         else:
-            query = tbl_cls.select()
-            if status:
-                query = query.where(tbl_cls.c.status == status)
-            results = []
+            tables = [tbl_cls]
+            if include_archive:
+                from mm_bot.model.archive import ARCHIVE_TABLES
+                tables.append(ARCHIVE_TABLES[tbl_cls])
+            queries = []
+            for tbl in tables:
+                query = tbl.select()
+                if status:
+                    query = query.where(tbl.c.status == status)
+                queries.append(query)
+            query = queries[0] if len(queries) == 1 else sqlalchemy.union_all(*queries)
             res = await self._db.fetch_all(query=query)
-            for row_id, *fields in res:
-                record = record_cls(*fields)
-                record.id = row_id
-                results.append(record)
-
-            return results
+            return [to_record(record_cls, row) for row in res]
 
     async def find_update_or_create_orders(self, orders: List[Order]) -> List[Order]:
+        """
+        Orders are identified by the columns of their IDENTIFIER, sqlite and
+        postgresql upsert them with one statement per batch
+        """
         if len(orders) == 0:
             return orders
 
-        if isinstance(orders[0], MakerOrder):
-            tbl_cls = MakerOrdersTable
-            order_identifier_key = MakerOrder.IDENTIFIER
-        elif isinstance(orders[0], TakerOrder):
-            tbl_cls = TakerOrdersTable
-            order_identifier_key = TakerOrder.IDENTIFIER
-        else:
-            raise RuntimeError('invalid side')
+        tbl_cls = table_of(orders[0])
+        order_identifier_keys = orders[0].IDENTIFIER
+        await self._ensure_connected()
 
-        identifiers = list(map(lambda o: getattr(o, order_identifier_key), orders))
-        select_query = tbl_cls.select().where(getattr(tbl_cls.c, order_identifier_key).in_(identifiers))
+        if isinstance(self._db, BULK_DATABASES):
+            values = []
+            for order in orders:
+                value = order.column_values()
+                del value['id']
+                values.append(with_scaled_values(order, value))
+
+            row_ids = await self._db.upsert_many(tbl_cls, values, order_identifier_keys)
+            for order, row_id in zip(orders, row_ids):
+                order.id = row_id
+                order.mark_persisted()
+
+            return orders
+
+        def identifier_of(o):
+            return tuple(getattr(o, key) for key in order_identifier_keys)
+
+        identifier_columns = [getattr(tbl_cls.c, key) for key in order_identifier_keys]
+        identifiers = list(map(identifier_of, orders))
+        select_query = tbl_cls.select().where(tuple_(*identifier_columns).in_(identifiers))
         existing_orders = await self._db.fetch_all(query=select_query)
 
-        existing_order_identifiers = set(map(lambda o: getattr(o, order_identifier_key), existing_orders))
         existing_order_identifier_to_order_mapping = dict(
-            map(lambda o: (getattr(o, order_identifier_key), o), existing_orders)
+            map(lambda o: (identifier_of(o), o), existing_orders)
         )
 
-        new_orders = list(filter(lambda o: getattr(o, order_identifier_key) not in existing_order_identifiers, orders))
+        new_orders = list(filter(lambda o: identifier_of(o) not in existing_order_identifier_to_order_mapping, orders))
         newly_created_orders = await self.create_orders(new_orders)
 
         orders_to_be_updated = []
         for order in orders:
-            identifier = getattr(order, order_identifier_key)
-            if identifier in existing_order_identifiers:
+            identifier = identifier_of(order)
+            if identifier in existing_order_identifier_to_order_mapping:
                 order.id = existing_order_identifier_to_order_mapping[identifier].id
                 orders_to_be_updated.append(order)
 
@@ -161,13 +263,34 @@ class OrderRepository:
 
     async def create_orders(self, orders: List[Order]) -> List[Order]:
         """
+        sqlite inserts all the orders with multi row INSERTs and postgresql
+        with COPY in one transaction with the daily_pnl rollup, other databases
+        invoke create_order one by one as
         self._db.execute_many(query=query, values=values) does not return ids
-
-        since the number of orders is small, we can just invoke create_order one by one instead of
-        using execute_many
         """
-        tasks = map(lambda order: self.create_order(order), orders)
-        return await asyncio.gather(*tasks)
+        if len(orders) == 0:
+            return orders
+
+        if not isinstance(self._db, BULK_DATABASES):
+            tasks = map(lambda order: self.create_order(order), orders)
+            return await asyncio.gather(*tasks)
+
+        await self._ensure_connected()
+        tbl_cls = table_of(orders[0])
+        values = []
+        for order in orders:
+            value = order.column_values()
+            del value['id']
+            values.append(with_scaled_values(order, value))
+
+        rollup = await self._rollup([o for o in orders if pnl.is_rolled_up(o, o.status, None)])
+        row_ids = await self._db.insert_many(tbl_cls, values, orders[0].IDENTIFIER, batches=[(pnl.UPSERT_DAILY_PNL, rollup)])
+        for order, row_id in zip(orders, row_ids):
+            order.id = row_id
+        for order in orders:
+            order.mark_persisted()
+
+        return orders
 
     async def create_order(self, order: Order) -> Order:
         """{
@@ -177,45 +300,125 @@ class OrderRepository:
             'price': best_bid_price_from_maker
         }
         """
-
-        if isinstance(order, MakerOrder):
-            tbl_cls = MakerOrdersTable
-        elif isinstance(order, TakerOrder):
-            tbl_cls = TakerOrdersTable
-        else:
-            raise RuntimeError('invalid side')
+        tbl_cls = table_of(order)
 
         await self._ensure_connected()
         query = tbl_cls.insert()
-        value = dataclasses.asdict(order)
-        row_id = await self._db.execute(query=query, values=value)
+        value = with_scaled_values(order, order.column_values())
+        if value['id'] is None:
+            # postgresql inserts an explicit NULL instead of taking the next id
+            del value['id']
+        rollup = await self._rollup([order]) if pnl.is_rolled_up(order, order.status, None) else []
+        if not rollup:
+            row_id = await self._db.execute(query=query, values=value)
+        elif isinstance(self._db, BULK_DATABASES):
+            # the order and its rollup in one transaction
+            if 'id' in value:
+                await self._db.execute_batches([(query, [value]), (pnl.UPSERT_DAILY_PNL, rollup)])
+                row_id = value['id']
+            else:
+                row_id, = await self._db.insert_many(tbl_cls, [value], order.IDENTIFIER, batches=[(pnl.UPSERT_DAILY_PNL, rollup)])
+        else:
+            async with self._db.transaction():
+                row_id = await self._db.execute(query=query, values=value)
+                await self._apply_rollup(rollup)
         order.id = row_id
+        order.mark_persisted()
 
         return order
 
-    async def update_order(self, order: Order) -> Order:
+    def _changed_values(self, order: Order) -> dict:
         """
         order has to have id in it
         """
         if not order.id:
             raise RuntimeError('Cannot UPDATE non-persisted order')
 
-        if isinstance(order, MakerOrder):
-            tbl_cls = MakerOrdersTable
-        elif isinstance(order, TakerOrder):
-            tbl_cls = TakerOrdersTable
-        else:
-            raise RuntimeError('invalid side')
+        values = order.changed_values()
+        values.pop('id', None)
+        return with_scaled_values(order, values)
 
-        await self._ensure_connected()
-        values = dataclasses.asdict(order)
-        del values['id']
-        query = tbl_cls.update().where(tbl_cls.c.id == order.id).values(values)
-        await self._db.execute(query = query)
+    async def update_order(self, order: Order) -> Order:
+        """
+        Only the columns changed since the order was read or written are updated
+        """
+        await self.update_orders([order])
+        return order
+
+    async def update_orders(self, orders: List[Order], jobs: List[dict] = ()) -> List[Order]:
+        """
+        Only the columns changed since the orders were read or written are
+        updated, along with the daily_pnl rollup of the orders moved to filled
+        or settled. jobs (see mm_bot.model.outbox) are enqueued with them, so a
+        status change and the transfer it calls for are committed together.
+
+        In sqlite and postgresql the orders with the same changed columns are
+        updated by one executemany, all of them, the rollup and the jobs in one
+        transaction
+        """
+        changed = []
+        for order in orders:
+            values = self._changed_values(order)
+            if values:
+                changed.append((order, values))
+        # the values written, the orders may change while they are
+        written = [order.field_values() for order in orders]
+
+        if changed or jobs:
+            await self._ensure_connected()
+            rollup = await self._rollup([
+                order for order, values in changed
+                if 'status' in values and pnl.is_rolled_up(order, order.status, order.persisted_value('status'))
+            ])
+
+            if isinstance(self._db, BULK_DATABASES):
+                batches = {}
+                for order, values in changed:
+                    tbl_cls = table_of(order)
+                    batches.setdefault((tbl_cls, tuple(values)), []).append(dict(values, _id=order.id))
+
+                await self._db.execute_batches([
+                    (tbl_cls.update().where(tbl_cls.c.id == bindparam('_id')), values)
+                    for (tbl_cls, _), values in batches.items()
+                ] + [(pnl.UPSERT_DAILY_PNL, rollup), (outbox.ENQUEUE, list(jobs))])
+            else:
+                async with self._db.transaction():
+                    for order, values in changed:
+                        tbl_cls = table_of(order)
+                        query = tbl_cls.update().where(tbl_cls.c.id == order.id).values(values)
+                        await self._db.execute(query = query)
+                    await self._apply_rollup(rollup)
+                    await self._enqueue(list(jobs))
+
+        for order, values in zip(orders, written):
+            order.mark_persisted(values)
 
-    async def update_orders(self, orders: List[Order]) -> List[Order]:
-        tasks = list(map(lambda order: self.update_order(order), orders))
-        await asyncio.gather(*tasks)
+        return orders
+
+    async def _rollup(self, orders: List[Order]) -> List[dict]:
+        """
+        The values of pnl.UPSERT_DAILY_PNL for the orders moved to filled or settled
+        """
+        if len(orders) == 0:
+            return []
+
+        makers = {}
+        maker_ids = set(o.maker_order_id for o in orders if isinstance(o, TakerOrder))
+        if maker_ids:
+            query = select([MakerOrdersTable.c.id, MakerOrdersTable.c.order_type, MakerOrdersTable.c.notional]) \
+                .where(MakerOrdersTable.c.id.in_(maker_ids))
+            for row in await self._db.fetch_all(query=query):
+                makers[row[0]] = (row[1], row[2])
+
+        return pnl.rollup_values(orders, makers)
+
+    async def _apply_rollup(self, rollup: List[dict]) -> None:
+        if rollup:
+            await self._db.execute_many(query=pnl.UPSERT_DAILY_PNL, values=rollup)
+
+    async def _enqueue(self, jobs: List[dict]) -> None:
+        if jobs:
+            await self._db.execute_many(query=outbox.ENQUEUE, values=jobs)
 
     async def delete_order(self, order: Order) -> None:
         if isinstance(order, MakerOrder):
@@ -228,6 +431,7 @@ class OrderRepository:
         if not order.id:
             raise RuntimeError('Cannot DELETE non-persisted order')
 
+        await self._ensure_connected()
         query = tbl_cls.delete().where(tbl_cls.c.id == order.id)
         await self._db.execute(query = query)
 
@@ -244,42 +448,59 @@ class OrderRepository:
         else:
             raise RuntimeError('invalid side')
 
+        await self._ensure_connected()
+        rollup = await self._rollup([o for o in orders if pnl.is_rolled_up(o, new_status, o.status)])
         stmt = tbl_cls.update().where(tbl_cls.c.id.in_(order_ids)).values({'status': new_status})
-        await self._db.execute(query=stmt)
+        # the status and the rollup in one transaction
+        if isinstance(self._db, BULK_DATABASES):
+            await self._db.execute_batches([(stmt, [{}]), (pnl.UPSERT_DAILY_PNL, rollup)])
+        else:
+            async with self._db.transaction():
+                await self._db.execute(query=stmt)
+                await self._apply_rollup(rollup)
 
 # for api #
 
-    async def get_filled_orders_in_range(self, start_date, end_date):
-        query = TakerOrdersTable.select().where(
-            TakerOrdersTable.c.status == Status.FILLED
-        )
-        filled_taker_orders = []
-        res = await self._db.fetch_all(query=query)
-        for row_id, *fields in res:
-            record = TakerOrder(*fields)
-            record.id = row_id
-            filled_taker_orders.append(record)
-        if len(filled_taker_orders) == 0:
-            return []
+    async def get_filled_orders_in_range(self, start_date, end_date, include_archive: bool = False):
+        """
+        The filled taker orders created in [start_date, end_date) with their
+        maker orders, None is an open end. Filtered, joined and sorted in the db.
+        """
+        await self._ensure_connected()
+        table_pairs = [(TakerOrdersTable, MakerOrdersTable)]
+        if include_archive:
+            # a maker order is archived with its taker orders
+            from mm_bot.model.archive import ARCHIVE_TABLES
+            table_pairs.append((ARCHIVE_TABLES[TakerOrdersTable], ARCHIVE_TABLES[MakerOrdersTable]))
+
+        filled_orders = []
+        for taker_tbl, maker_tbl in table_pairs:
+            query = select([taker_tbl, maker_tbl]) \
+                .select_from(taker_tbl.join(maker_tbl, maker_tbl.c.id == taker_tbl.c.maker_order_id)) \
+                .where(taker_tbl.c.status == Status.FILLED)
+            if start_date is not None:
+                query = query.where(taker_tbl.c.created_at >= arrow.get(start_date).to('utc').naive)
+            if end_date is not None:
+                query = query.where(taker_tbl.c.created_at < arrow.get(end_date).to('utc').naive)
+            query = query.order_by(taker_tbl.c.created_at, taker_tbl.c.id)
 
-        maker_order_ids = list(map(lambda o: o.maker_order_id, filled_taker_orders))
-        query_maker = MakerOrdersTable.select().where(MakerOrdersTable.c.id.in_(maker_order_ids))
-        filled_maker_orders_res = await self._db.fetch_all(query=query_maker)
-        id_to_maker_order_map = {}
-        for row_id, *fields in filled_maker_orders_res:
-            record = MakerOrder(*fields)
-            record.id = row_id
-            id_to_maker_order_map[str(row_id)] = record
+            res = await self._db.fetch_all(query=query)
+            taker_columns = len(taker_tbl.c)
+            filled_orders.extend(
+                (to_record(TakerOrder, row_values(row, 0, taker_columns)), to_record(MakerOrder, row_values(row, taker_columns)))
+                for row in res
+            )
+        if include_archive:
+            filled_orders.sort(key=lambda pair: (pair[0].created_at is not None, pair[0].created_at, pair[0].id))
 
         maker_taker_pairs = []
-        for taker_order in filled_taker_orders:
-            maker_order_id = str(taker_order.maker_order_id)
-            maker_order = id_to_maker_order_map[maker_order_id]
-
+        for taker_order, maker_order in filled_orders:
+            maker_total = maker_order.price() * maker_order.quantity()
+            taker_total = taker_order.price() * taker_order.quantity()
             if maker_order.order_type == OrderType.BUY:
-                profit = - maker_order.price() * maker_order.quantity() + taker_order.price() * taker_order.quantity()
+                profit = - maker_total + taker_total
             else:
-                profit = maker_order.price() * maker_order.quantity() - taker_order.price() * taker_order.quantity()
+                profit = maker_total - taker_total
 
             profit = decimal_to_str(profit)
             maker_taker_pairs.append({
@@ -293,7 +514,7 @@ class OrderRepository:
                     'maker_order_id': taker_order.maker_order_id,
                     'price': decimal_to_str(taker_order.price()),
                     'quantity': decimal_to_str(taker_order.quantity()),
-                    'total': decimal_to_str(taker_order.price() * taker_order.quantity()),
+                    'total': decimal_to_str(taker_total),
                 },
                 'maker': {
                     'id': maker_order.id,
@@ -304,12 +525,205 @@ class OrderRepository:
                     },
                     'price': decimal_to_str(maker_order.price()),
                     'quantity': decimal_to_str(maker_order.quantity()),
-                    'total': decimal_to_str(maker_order.price() * maker_order.quantity()),
+                    'total': decimal_to_str(maker_total),
                 }
             })
 
-        maker_taker_pairs = sorted(maker_taker_pairs, key=lambda o: o['created_at'])
         for o in maker_taker_pairs:
             o['created_at'] = arrow.get(o['created_at']).isoformat()
         return maker_taker_pairs
 
+    async def get_order_pairs(self, currency: Optional[str] = None, status: Optional[str] = None,
+                              before_id: Optional[int] = None, limit: int = 100,
+                              include_archive: bool = False) -> List[dict]:
+        """
+        A page of the maker orders with their taker orders, newest first.
+
+        Keyset pagination, the next page is the maker orders before the id of
+        the last one of this page, the pages do not shift when orders are
+        created and no rows are skipped with OFFSET.
+        """
+        await self._ensure_connected()
+        table_pairs = [(MakerOrdersTable, TakerOrdersTable)]
+        if include_archive:
+            # the ids are kept by the archive, a page is the first ones of both
+            from mm_bot.model.archive import ARCHIVE_TABLES
+            table_pairs.append((ARCHIVE_TABLES[MakerOrdersTable], ARCHIVE_TABLES[TakerOrdersTable]))
+
+        pairs = {}
+        for maker_tbl, taker_tbl in table_pairs:
+            page = select([maker_tbl.c.id]).order_by(maker_tbl.c.id.desc()).limit(limit)
+            if currency is not None:
+                page = page.where(maker_tbl.c.currency == currency)
+            if status is not None:
+                page = page.where(maker_tbl.c.status == status)
+            if before_id is not None:
+                page = page.where(maker_tbl.c.id < before_id)
+
+            # the last taker order of a maker order wins, as in the former dict by maker_order_id
+            query = select([maker_tbl, taker_tbl]) \
+                .select_from(maker_tbl.outerjoin(taker_tbl, taker_tbl.c.maker_order_id == maker_tbl.c.id)) \
+                .where(maker_tbl.c.id.in_(page)) \
+                .order_by(maker_tbl.c.id.desc(), taker_tbl.c.id)
+
+            res = await self._db.fetch_all(query=query)
+            maker_columns = len(maker_tbl.c)
+            for row in res:
+                maker_id = row[0]
+                if maker_id not in pairs:
+                    pairs[maker_id] = {'maker': to_record(MakerOrder, row_values(row, 0, maker_columns)).as_object(), 'taker': None}
+                if row[maker_columns] is not None:
+                    pairs[maker_id]['taker'] = to_record(TakerOrder, row_values(row, maker_columns)).as_object()
+
+        return [pairs[maker_id] for maker_id in sorted(pairs, reverse=True)[:limit]]
+
+    async def get_order_currencies(self, include_archive: bool = False) -> List[str]:
+        await self._ensure_connected()
+        query = select([MakerOrdersTable.c.currency])
+        if include_archive:
+            from mm_bot.model.archive import ARCHIVE_TABLES
+            query = sqlalchemy.union(query, select([ARCHIVE_TABLES[MakerOrdersTable].c.currency]))
+        else:
+            query = query.distinct()
+        return sorted(row[0] for row in await self._db.fetch_all(query=query))
+
+    async def archive_orders(self, updated_before: datetime, limit: int) -> int:
+        """
+        Moves up to limit maker orders with their taker orders to the archive
+        tables, the maker orders and all their taker orders have to be in a
+        terminal status and last updated before updated_before.
+        Returns the number of archived maker orders.
+        """
+        # the archive tables are only known to the processes which archive or read them, see mmm_bot
+        from mm_bot.model.archive import ARCHIVE_TABLES, MAKER_TERMINAL_STATUSES, TAKER_TERMINAL_STATUSES
+
+        await self._ensure_connected()
+        updated_at = func.coalesce(MakerOrdersTable.c.updated_at, MakerOrdersTable.c.created_at)
+        taker_updated_at = func.coalesce(TakerOrdersTable.c.updated_at, TakerOrdersTable.c.created_at)
+        not_done_takers = select([TakerOrdersTable.c.id]).where(
+            (TakerOrdersTable.c.maker_order_id == MakerOrdersTable.c.id) &
+            (TakerOrdersTable.c.status.notin_(TAKER_TERMINAL_STATUSES) | (taker_updated_at >= updated_before))
+        )
+        query = select([MakerOrdersTable.c.id]) \
+            .where(MakerOrdersTable.c.status.in_(MAKER_TERMINAL_STATUSES)) \
+            .where(updated_at < updated_before) \
+            .where(~sqlalchemy.exists(not_done_takers)) \
+            .order_by(MakerOrdersTable.c.id).limit(limit)
+        maker_ids = [row[0] for row in await self._db.fetch_all(query=query)]
+        if not maker_ids:
+            return 0
+
+        maker_archive = ARCHIVE_TABLES[MakerOrdersTable]
+        taker_archive = ARCHIVE_TABLES[TakerOrdersTable]
+        queries = [
+            maker_archive.insert().from_select(
+                [c.name for c in MakerOrdersTable.c],
+                MakerOrdersTable.select().where(MakerOrdersTable.c.id.in_(maker_ids))
+            ),
+            taker_archive.insert().from_select(
+                [c.name for c in TakerOrdersTable.c],
+                TakerOrdersTable.select().where(TakerOrdersTable.c.maker_order_id.in_(maker_ids))
+            ),
+            TakerOrdersTable.delete().where(TakerOrdersTable.c.maker_order_id.in_(maker_ids)),
+            MakerOrdersTable.delete().where(MakerOrdersTable.c.id.in_(maker_ids)),
+        ]
+        if isinstance(self._db, BULK_DATABASES):
+            await self._db.execute_all(queries)
+        else:
+            async with self._db.transaction():
+                for query in queries:
+                    await self._db.execute(query=query)
+
+        return len(maker_ids)
+
+    async def get_daily_pnl(self, start_date, end_date) -> List[dict]:
+        """
+        The daily_pnl rollup of the days in [start_date, end_date), None is an open end
+        """
+        await self._ensure_connected()
+        query = self._daily_pnl_in_range(DailyPnlTable.select(), start_date, end_date) \
+            .order_by(DailyPnlTable.c.day, DailyPnlTable.c.currency)
+        return [pnl.as_report(row) for row in await self._db.fetch_all(query=query)]
+
+    async def get_pnl_in_range(self, start_date, end_date) -> List[dict]:
+        """
+        The totals per currency of the daily_pnl rollup of the days in [start_date, end_date)
+        """
+        await self._ensure_connected()
+        query = select(
+            [DailyPnlTable.c.currency] + [func.sum(DailyPnlTable.c[counter]).label(counter) for counter in pnl.COUNTERS]
+        ).group_by(DailyPnlTable.c.currency).order_by(DailyPnlTable.c.currency)
+        query = self._daily_pnl_in_range(query, start_date, end_date)
+        return [pnl.as_report(row) for row in await self._db.fetch_all(query=query)]
+
+    def _daily_pnl_in_range(self, query, start_date, end_date):
+        if start_date is not None:
+            query = query.where(DailyPnlTable.c.day >= arrow.get(start_date).date())
+        if end_date is not None:
+            query = query.where(DailyPnlTable.c.day < arrow.get(end_date).date())
+        return query
+
+
+# outbox #
+
+    async def enqueue_jobs(self, jobs: List[dict]) -> None:
+        """
+        Enqueues the jobs made by outbox.transfer_job / outbox.unlock_job, a
+        key already pending, running or done is not enqueued again
+        """
+        if len(jobs) == 0:
+            return
+
+        await self._ensure_connected()
+        await self._enqueue(jobs)
+
+    async def get_due_jobs(self, now: datetime, limit: int) -> List[Job]:
+        """
+        The pending jobs due at now, the oldest first
+        """
+        await self._ensure_connected()
+        query = select([
+            OutboxTable.c.id, OutboxTable.c.kind, OutboxTable.c.key, OutboxTable.c.payload,
+            OutboxTable.c.attempts, OutboxTable.c.created_at
+        ]).where(OutboxTable.c.status == JobStatus.PENDING) \
+            .where(OutboxTable.c.next_attempt_at <= now) \
+            .order_by(OutboxTable.c.next_attempt_at, OutboxTable.c.id) \
+            .limit(limit)
+        return [Job(*row_values(row)) for row in await self._db.fetch_all(query=query)]
+
+    async def start_job(self, job: Job, started_at: datetime) -> None:
+        await self._update_job(job, status=JobStatus.RUNNING, attempts=job.attempts + 1, started_at=started_at)
+
+    async def finish_job(self, job: Job, finished_at: datetime) -> None:
+        await self._update_job(job, status=JobStatus.DONE, finished_at=finished_at, last_error=None)
+
+    async def retry_job(self, job: Job, next_attempt_at: datetime, error: str) -> None:
+        await self._update_job(job, status=JobStatus.PENDING, next_attempt_at=next_attempt_at, last_error=error)
+
+    async def fail_job(self, job: Job, finished_at: datetime, error: str) -> None:
+        await self._update_job(job, status=JobStatus.FAILED, finished_at=finished_at, last_error=error)
+
+    async def _update_job(self, job: Job, **values) -> None:
+        await self._ensure_connected()
+        query = OutboxTable.update().where(OutboxTable.c.id == job.id).values(values)
+        await self._db.execute(query=query)
+
+    async def recover_jobs(self, resumable_kinds: Tuple[str, ...]) -> Tuple[int, int]:
+        """
+        The jobs left running by a stopped process, the resumable kinds are
+        pending again and the others failed. Returns (resumed, failed).
+        """
+        await self._ensure_connected()
+        running = OutboxTable.c.status == JobStatus.RUNNING
+        counted = {}
+        for resumable, values in (
+            (True, {'status': JobStatus.PENDING}),
+            (False, {'status': JobStatus.FAILED, 'finished_at': datetime.utcnow(), 'last_error': 'interrupted'}),
+        ):
+            kind = OutboxTable.c.kind.in_(resumable_kinds) if resumable else OutboxTable.c.kind.notin_(resumable_kinds)
+            query = select([func.count()]).select_from(OutboxTable).where(running & kind)
+            counted[resumable] = (await self._db.fetch_one(query=query))[0]
+            if counted[resumable]:
+                await self._db.execute(query=OutboxTable.update().where(running & kind).values(values))
+
+        return counted[True], counted[False]
@@ -0,0 +1,53 @@
+"""
+The migrations of the db at start, skipped when the db is at head
+
+Run by the start scripts instead of `alembic upgrade head`:
+
+    python -m mm_bot.model.schema
+"""
+import logging
+import os
+from typing import Optional
+
+import sqlalchemy
+
+from mm_bot.config import config
+
+LOGGER = logging.getLogger('market_maker_bot.schema')
+
+MAIN_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+
+def upgrade(url: Optional[str] = None) -> bool:
+    """
+    Upgrades the db to the head of the migrations, False when it was already there
+    """
+    # alembic is only needed at start
+    from alembic import command
+    from alembic.config import Config
+    from alembic.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+
+    alembic_config = Config(os.path.join(MAIN_DIR, 'alembic.ini'))
+    alembic_config.set_main_option('script_location', os.path.join(MAIN_DIR, 'migrations'))
+    heads = set(ScriptDirectory.from_config(alembic_config).get_heads())
+
+    engine = sqlalchemy.create_engine(url or config('database_url', parser=str))
+    try:
+        with engine.connect() as connection:
+            current = set(MigrationContext.configure(connection).get_current_heads())
+            if current == heads:
+                LOGGER.info('Schema at %s, no migration', ', '.join(sorted(heads)))
+                return False
+
+            LOGGER.info('Migrating the schema from %s to %s', ', '.join(sorted(current)) or 'base', ', '.join(sorted(heads)))
+            alembic_config.attributes['connection'] = connection
+            command.upgrade(alembic_config, 'head')
+            return True
+    finally:
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    upgrade()
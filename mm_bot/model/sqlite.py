@@ -0,0 +1,386 @@
+"""
+SQLite tuned for the bot and the webserver sharing the database file
+
+In WAL mode the readers do not block the writer and the writer does not
+block the readers. All the writes of a process go through a single
+connection serialized by a lock, the reads are spread over a pool of read
+only connections. The pragmas are applied to every connection when it is
+opened.
+
+SQLiteDatabase answers the subset of databases.Database used by the
+repository and returns the same rows, plus the bulk writes `insert_many`
+`upsert_many`, `execute_many` and `execute_all` which run in a single
+transaction. The queries are compiled and their rows processed with the
+public APIs of sqlalchemy only, nothing of databases but DatabaseURL.
+"""
+import asyncio
+import contextlib
+import itertools
+import sqlite3
+import typing
+import urllib.parse
+
+import aiosqlite
+from databases.core import DatabaseURL
+from sqlalchemy.dialects.sqlite import pysqlite
+from sqlalchemy import Table, select, text, tuple_
+from sqlalchemy.sql import ClauseElement
+from sqlalchemy.sql.expression import CompoundSelect, TextClause
+from sqlalchemy.sql.compiler import Compiled
+
+from mm_bot.config import config
+
+Query = typing.Union[ClauseElement, str]
+
+# the default SQLITE_MAX_VARIABLE_NUMBER before sqlite 3.32
+MAX_VARIABLES = 999
+SUPPORTS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
+def is_sqlite(url: str) -> bool:
+    return DatabaseURL(url).dialect == 'sqlite'
+
+
+def sqlite_pragmas() -> typing.Dict[str, typing.Any]:
+    # journal_mode first, it is persisted in the file and can only be set by a writer
+    return {
+        'journal_mode': config('database_sqlite_journal_mode', parser=str),
+        'synchronous': config('database_sqlite_synchronous', parser=str),
+        'mmap_size': config('database_sqlite_mmap_size', parser=int),
+        'cache_size': config('database_sqlite_cache_size', parser=int),
+        'busy_timeout': config('database_sqlite_busy_timeout', parser=int),
+    }
+
+
+async def _open(database: str, pragmas: typing.Dict[str, typing.Any], **kwargs: typing.Any) -> aiosqlite.Connection:
+    # autocommit like databases, every statement is committed when it returns
+    connection = aiosqlite.connect(database=database, isolation_level=None, **kwargs)
+    await connection.__aenter__()
+    for name, value in pragmas.items():
+        await connection.execute(f'PRAGMA {name} = {value}')
+
+    return connection
+
+
+class _Row(typing.Sequence):
+    """
+    A row by position and by column name, like the rows of databases
+    """
+
+    def __init__(self, values: tuple, keys: typing.Dict[str, int]):
+        self._values = values
+        self._keys = keys
+
+    def __getitem__(self, key):
+        return self._values[self._keys[key] if isinstance(key, str) else key]
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __eq__(self, other) -> bool:
+        return tuple(self) == tuple(other)
+
+    def __repr__(self) -> str:
+        return repr(self._values)
+
+    def keys(self) -> typing.List[str]:
+        return list(self._keys)
+
+
+def _result_types(query: ClauseElement) -> list:
+    """
+    The types of the selected columns of query, none for a textual query
+    """
+    if isinstance(query, CompoundSelect):
+        return _result_types(query.selects[0])
+
+    return [column.type for column in getattr(query, 'inner_columns', ())]
+
+
+class _WriterPool:
+    """
+    The single writing connection, held by one query at a time
+    """
+
+    def __init__(self, connection: aiosqlite.Connection):
+        self.connection = connection
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> aiosqlite.Connection:
+        await self._lock.acquire()
+        return self.connection
+
+    async def release(self, connection: aiosqlite.Connection) -> None:
+        self._lock.release()
+
+
+class _ReaderPool:
+    """
+    Read only connections, opened on demand up to size
+    """
+
+    def __init__(self, database: str, size: int, pragmas: typing.Dict[str, typing.Any]):
+        self._uri = f'file:{urllib.parse.quote(database)}?mode=ro'
+        self._size = size
+        self._pragmas = pragmas
+        self._opened: typing.List[aiosqlite.Connection] = []
+        self._opening = 0
+        self._idle: asyncio.Queue = asyncio.Queue()
+
+    async def acquire(self) -> aiosqlite.Connection:
+        if self._idle.empty() and self._opening + len(self._opened) < self._size:
+            self._opening += 1
+            try:
+                connection = await _open(self._uri, self._pragmas, uri=True)
+            finally:
+                self._opening -= 1
+            self._opened.append(connection)
+            return connection
+
+        return await self._idle.get()
+
+    async def release(self, connection: aiosqlite.Connection) -> None:
+        self._idle.put_nowait(connection)
+
+    async def close(self) -> None:
+        for connection in self._opened:
+            await connection.close()
+        self._opened = []
+        self._idle = asyncio.Queue()
+
+
+class SQLiteDatabase:
+
+    def __init__(self, url: str, readers: typing.Optional[int] = None,
+                 pragmas: typing.Optional[typing.Dict[str, typing.Any]] = None):
+        self.url = DatabaseURL(url)
+        self._pragmas = sqlite_pragmas() if pragmas is None else pragmas
+        self._readers = config('database_sqlite_readers', parser=int) if readers is None else readers
+        # an in memory database is private to its connection
+        if self.url.database in ('', ':memory:'):
+            self._readers = 0
+
+        self._dialect = pysqlite.dialect(paramstyle='qmark')
+        # aiosqlite does not support decimals
+        self._dialect.supports_native_decimal = False
+        self._writer_pool: typing.Optional[_WriterPool] = None
+        self._reader_pool: typing.Optional[_ReaderPool] = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self._writer_pool is not None
+
+    async def connect(self) -> None:
+        """
+        The locks and queues are created here, in the loop which runs the queries
+        """
+        assert not self.is_connected, 'Already connected'
+        writer = await _open(self.url.database or ':memory:', self._pragmas)
+        self._writer_pool = _WriterPool(writer)
+        if self._readers > 0:
+            reader_pragmas = {name: value for name, value in self._pragmas.items() if name != 'journal_mode'}
+            self._reader_pool = _ReaderPool(self.url.database, self._readers, reader_pragmas)
+
+    async def disconnect(self) -> None:
+        if not self.is_connected:
+            return
+
+        if self._reader_pool is not None:
+            await self._reader_pool.close()
+            self._reader_pool = None
+        await self._writer_pool.connection.close()
+        self._writer_pool = None
+
+    @contextlib.asynccontextmanager
+    async def _connection(self, read: bool) -> typing.AsyncIterator[aiosqlite.Connection]:
+        assert self.is_connected, 'Not connected'
+        pool = self._reader_pool if read and self._reader_pool is not None else self._writer_pool
+        connection = await pool.acquire()
+        try:
+            yield connection
+        finally:
+            await pool.release(connection)
+
+    def _build_query(self, query: Query, values: typing.Optional[dict]) -> ClauseElement:
+        if isinstance(query, str):
+            query = text(query)
+        if values:
+            query = query.bindparams(**values) if isinstance(query, TextClause) else query.values(**values)
+        return query
+
+    def _rows(self, query: ClauseElement, description: tuple, rows: typing.List[tuple]) -> typing.List[_Row]:
+        """
+        The rows with the result processors of the column types applied
+        """
+        processors = [
+            column_type.dialect_impl(self._dialect).result_processor(self._dialect, column[1])
+            for column_type, column in zip(_result_types(query), description)
+        ]
+        keys = {}
+        for i, column in enumerate(description):
+            keys.setdefault(column[0], i)
+        return [
+            _Row(tuple(
+                processor(value) if processor is not None else value
+                for processor, value in itertools.zip_longest(processors, row)
+            ), keys)
+            for row in rows
+        ]
+
+    async def fetch_all(self, query: Query, values: dict = None) -> typing.List[typing.Mapping]:
+        query = self._build_query(query, values)
+        compiled = query.compile(dialect=self._dialect)
+        async with self._connection(read=True) as connection:
+            async with connection.execute(compiled.string, self._args(compiled)) as cursor:
+                return self._rows(query, cursor.description, await cursor.fetchall())
+
+    async def fetch_one(self, query: Query, values: dict = None) -> typing.Optional[typing.Mapping]:
+        query = self._build_query(query, values)
+        compiled = query.compile(dialect=self._dialect)
+        async with self._connection(read=True) as connection:
+            async with connection.execute(compiled.string, self._args(compiled)) as cursor:
+                row = await cursor.fetchone()
+                return None if row is None else self._rows(query, cursor.description, [row])[0]
+
+    async def execute(self, query: Query, values: dict = None) -> typing.Any:
+        """
+        The id of an inserted row, the count of the changed rows otherwise
+        """
+        compiled = self._build_query(query, values).compile(dialect=self._dialect)
+        async with self._connection(read=False) as connection:
+            async with connection.execute(compiled.string, self._args(compiled)) as cursor:
+                return cursor.rowcount if cursor.lastrowid == 0 else cursor.lastrowid
+
+    @contextlib.asynccontextmanager
+    async def transaction(self) -> typing.AsyncIterator[aiosqlite.Connection]:
+        """
+        Holds the writer until the transaction is committed or rolled back
+        """
+        assert self.is_connected, 'Not connected'
+        connection = await self._writer_pool.acquire()
+        try:
+            # IMMEDIATE takes the write lock of the file up front, other processes wait in busy_timeout
+            await connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield connection
+            except BaseException:
+                await connection.execute('ROLLBACK')
+                raise
+            await connection.execute('COMMIT')
+        finally:
+            await self._writer_pool.release(connection)
+
+    def _bind_processors(self, compiled: Compiled) -> typing.List[typing.Tuple[str, typing.Optional[typing.Callable]]]:
+        """
+        The names of the qmark parameters in order with the bind processors of their types
+        """
+        return [
+            (name, compiled.binds[name].type.dialect_impl(self._dialect).bind_processor(self._dialect))
+            for name in compiled.positiontup
+        ]
+
+    def _args(self, compiled: Compiled, params: typing.Optional[dict] = None, processors: typing.Optional[list] = None) -> list:
+        params = compiled.construct_params(params)
+        return [
+            processor(params[name]) if processor is not None else params[name]
+            for name, processor in (self._bind_processors(compiled) if processors is None else processors)
+        ]
+
+    async def insert_many(
+        self, table: Table, values: typing.List[dict], keys: typing.Sequence[str],
+        batches: typing.List[typing.Tuple[ClauseElement, typing.List[dict]]] = (),
+    ) -> typing.List[int]:
+        """
+        Multi row INSERTs, returns the ids of the rows in the order of values.
+        keys need a unique index, see _write_chunks. batches (see
+        execute_batches) run after them in the same transaction.
+        """
+        if not values:
+            return []
+
+        async with self.transaction() as connection:
+            ids = await self._write_chunks(connection, table, values, keys)
+            await self._execute_batches(connection, batches)
+
+        return ids
+
+    async def upsert_many(self, table: Table, values: typing.List[dict], keys: typing.Sequence[str]) -> typing.List[int]:
+        """
+        INSERT ... ON CONFLICT (keys) DO UPDATE of the other columns, returns
+        the ids of the rows in the order of values. keys need a unique index.
+        """
+        if not values:
+            return []
+
+        columns = [column for column in values[0] if column not in keys]
+        on_conflict = f' ON CONFLICT ({", ".join(keys)}) DO UPDATE SET ' + \
+            ', '.join(f'{column} = excluded.{column}' for column in columns)
+
+        async with self.transaction() as connection:
+            return await self._write_chunks(connection, table, values, keys, on_conflict)
+
+    async def _write_chunks(
+        self, connection: aiosqlite.Connection, table: Table, values: typing.List[dict],
+        keys: typing.Sequence[str], on_conflict: str = '',
+    ) -> typing.List[int]:
+        """
+        The multi row INSERTs of values, the ids of the rows in the order of
+        values come from RETURNING (sqlite 3.35+) or from a select of the
+        keys in the same transaction. The rows of RETURNING are in no given
+        order, they are matched by their keys too.
+        """
+        key_columns = [table.c[key] for key in keys]
+        rows_per_statement = max(1, MAX_VARIABLES // len(values[0]))
+        ids_by_key = {}
+        for start in range(0, len(values), rows_per_statement):
+            chunk = values[start:start + rows_per_statement]
+            compiled = table.insert().values(chunk).compile(dialect=self._dialect)
+            if SUPPORTS_RETURNING:
+                returning = ' RETURNING ' + ', '.join(['id'] + list(keys))
+                async with connection.execute(compiled.string + on_conflict + returning, self._args(compiled)) as cursor:
+                    rows = await cursor.fetchall()
+            else:
+                await connection.execute(compiled.string + on_conflict, self._args(compiled))
+                query = select([table.c.id] + key_columns).where(
+                    tuple_(*key_columns).in_([tuple(value[key] for key in keys) for value in chunk])
+                )
+                compiled = query.compile(dialect=self._dialect)
+                async with connection.execute(compiled.string, self._args(compiled)) as cursor:
+                    rows = await cursor.fetchall()
+
+            for row_id, *key in rows:
+                ids_by_key[tuple(key)] = row_id
+
+        return [ids_by_key[tuple(value[key] for key in keys)] for value in values]
+
+    async def execute_batches(self, batches: typing.List[typing.Tuple[ClauseElement, typing.List[dict]]]) -> None:
+        """
+        Every query is compiled once for the keys of its first values and run
+        with executemany, all the values of a query need the same keys.
+        All the batches run in one transaction.
+        """
+        async with self.transaction() as connection:
+            await self._execute_batches(connection, batches)
+
+    async def _execute_batches(
+        self, connection: aiosqlite.Connection, batches: typing.List[typing.Tuple[ClauseElement, typing.List[dict]]],
+    ) -> None:
+        for query, values in batches:
+            if not values:
+                continue
+
+            compiled = query.compile(dialect=self._dialect, column_keys=list(values[0]))
+            processors = self._bind_processors(compiled)
+            await connection.executemany(compiled.string, [self._args(compiled, value, processors) for value in values])
+
+    async def execute_many(self, query: ClauseElement, values: typing.List[dict]) -> None:
+        await self.execute_batches([(query, values)])
+
+    async def execute_all(self, queries: typing.List[ClauseElement]) -> None:
+        """
+        The queries one after the other in one transaction
+        """
+        async with self.transaction() as connection:
+            for query in queries:
+                compiled = query.compile(dialect=self._dialect)
+                await connection.execute(compiled.string, self._args(compiled))
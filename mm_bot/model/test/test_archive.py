@@ -0,0 +1,26 @@
+from datetime import timedelta
+
+import pytest
+
+from mm_bot.model.archive import OrderArchiver
+
+
+class FakeRepository:
+
+    def __init__(self, counts):
+        self.counts = list(counts)
+        self.calls = []
+
+    async def archive_orders(self, updated_before, limit):
+        self.calls.append((updated_before, limit))
+        return self.counts.pop(0)
+
+
+@pytest.mark.asyncio
+async def test_archive_in_batches():
+    repository = FakeRepository([2, 2, 1])
+    archiver = OrderArchiver(repository, timedelta(days=30), batch_size=2, interval=600)
+
+    assert await archiver.archive() == 5
+    assert len(repository.calls) == 3
+    assert all(limit == 2 for _, limit in repository.calls)
@@ -0,0 +1,14 @@
+from decimal import Decimal
+
+import pytest
+
+from mm_bot.model import fixed_point
+
+
+def test_scaled_columns():
+    assert fixed_point.to_scaled('0.0001493', fixed_point.PRICE_COLUMN_DECIMALS) == 149300000
+    assert fixed_point.to_scaled(Decimal('0.00000000005'), fixed_point.AMOUNT_COLUMN_DECIMALS) == 0
+    assert fixed_point.from_scaled(149300000, fixed_point.PRICE_COLUMN_DECIMALS) == Decimal('0.0001493')
+
+    with pytest.raises(ValueError):
+        fixed_point.to_scaled('10000000000', fixed_point.AMOUNT_COLUMN_DECIMALS)
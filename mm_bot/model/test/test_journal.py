@@ -0,0 +1,64 @@
+import os
+from decimal import Decimal
+
+import pytest
+
+from mm_bot.model.book import OrderBook, PriceLevel
+from mm_bot.model.constants import JournalEvent
+from mm_bot.model.journal import JOURNAL_FILE, SNAPSHOT_FILE, Journal, encode_book
+
+
+def book(price):
+    return OrderBook([PriceLevel(Decimal(price), Decimal('2'))], [PriceLevel(Decimal('0.3'), Decimal('1'))],
+                     Decimal('1.5'), Decimal('0'))
+
+
+@pytest.mark.asyncio
+async def test_restore_after_stop(tmp_path):
+    journal = Journal(str(tmp_path), fsync_interval=1, snapshot_events=100)
+    journal.restore()
+    journal.add_snapshot_source('borderless', lambda: {'matched_orders_height': 7})
+    journal.append(JournalEvent.BOOK, {'exchange': 'binance', 'book': encode_book(book('0.1'))})
+    journal.append(JournalEvent.BOOK, {'exchange': 'binance', 'book': encode_book(book('0.2'))})
+    journal.append(JournalEvent.SENT, {'exchange': 'binance', 'keys': ['hedge:1', 'hedge:2'],
+                                       'requests': [{'maker_order_id': 1}, {'maker_order_id': 2}]})
+    journal.append(JournalEvent.ACK, {'exchange': 'binance', 'keys': ['hedge:1'], 'ids': [1]})
+    await journal.stop()
+    # compacted on stop
+    assert os.path.getsize(tmp_path / JOURNAL_FILE) == 0
+
+    state = Journal(str(tmp_path), fsync_interval=1, snapshot_events=100).restore()
+    assert state.seq == 4
+    assert state.book('binance', max_age=60) == book('0.2')
+    assert state.book('binance', max_age=60, now=state.books['binance']['at'] + 61) is None
+    assert state.book('borderless', max_age=60) is None
+    assert list(state.unacked) == ['hedge:2']
+    assert state.unacked['hedge:2']['request'] == {'maker_order_id': 2}
+    assert state.exchanges == {'borderless': {'matched_orders_height': 7}}
+
+
+@pytest.mark.asyncio
+async def test_replay_after_crash(tmp_path):
+    journal = Journal(str(tmp_path), fsync_interval=1, snapshot_events=3)
+    journal.restore()
+    for i in range(4):
+        journal.append(JournalEvent.DECISION, {'exchange': 'borderless', 'orders': [{'profit': Decimal(i)}]})
+        await journal.flush()
+    # the first three are in the snapshot, the fourth in the journal
+    assert os.path.exists(tmp_path / SNAPSHOT_FILE)
+    journal.append(JournalEvent.DECISION, {'exchange': 'borderless', 'orders': []})
+    await journal.flush()
+
+    # a crash in the middle of a write
+    with open(tmp_path / JOURNAL_FILE, 'ab') as f:
+        f.write(b'{"seq": 6, "at": 1')
+
+    restored = Journal(str(tmp_path), fsync_interval=1, snapshot_events=3)
+    state = restored.restore()
+    assert state.seq == 5
+    assert state.decision['orders'] == []
+
+    # the torn event is cut off, the next ones are readable
+    restored.append(JournalEvent.DECISION, {'exchange': 'borderless', 'orders': [{'profit': '1'}]})
+    await restored.flush()
+    assert Journal(str(tmp_path), fsync_interval=1, snapshot_events=3).restore().decision['orders'] == [{'profit': '1'}]
@@ -0,0 +1,88 @@
+"""
+The migrations on sqlite, and on postgresql with MMBC_TEST_POSTGRES_URL
+"""
+import os
+
+import pytest
+import sqlalchemy
+
+from mm_bot.model import schema
+from mm_bot.model.order import metadata
+# the tables of the models, as migrations/env.py
+import mm_bot.model.archive
+import mm_bot.model.outbox
+import mm_bot.model.pnl
+
+alembic = pytest.importorskip('alembic')
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config
+from alembic.migration import MigrationContext
+
+MAIN_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+
+# the indexes of create_tables are not declared by the models
+SCHEMA_CHANGES = ('add_table', 'remove_table', 'add_column', 'remove_column')
+
+
+@pytest.fixture(params=['sqlite', 'postgresql'])
+def engine(request, tmp_path):
+    if request.param == 'sqlite':
+        url = f'sqlite:///{tmp_path}/migrations.db'
+    else:
+        url = os.environ.get('MMBC_TEST_POSTGRES_URL')
+        if url is None:
+            pytest.skip('MMBC_TEST_POSTGRES_URL is not set')
+
+    engine = sqlalchemy.create_engine(url)
+    yield engine
+
+    metadata.drop_all(engine)
+    engine.execute('DROP TABLE IF EXISTS alembic_version')
+
+
+def make_alembic_config(connection) -> Config:
+    alembic_config = Config(os.path.join(MAIN_DIR, 'alembic.ini'))
+    alembic_config.set_main_option('script_location', os.path.join(MAIN_DIR, 'migrations'))
+    alembic_config.attributes['connection'] = connection
+    return alembic_config
+
+
+def test_upgrade_downgrade(engine):
+    with engine.connect() as connection:
+        alembic_config = make_alembic_config(connection)
+        command.upgrade(alembic_config, 'head')
+        diff = compare_metadata(MigrationContext.configure(connection), metadata)
+        assert [change for change in diff if change[0] in SCHEMA_CHANGES] == []
+
+        command.downgrade(alembic_config, 'base')
+        assert sqlalchemy.inspect(connection).get_table_names() == ['alembic_version']
+        command.upgrade(alembic_config, 'head')
+
+
+def test_upgrade_skipped_at_head(engine):
+    assert schema.upgrade(str(engine.url))
+    assert 'outbox' in sqlalchemy.inspect(engine).get_table_names()
+    assert not schema.upgrade(str(engine.url))
+
+
+def test_daily_pnl_backfill(engine):
+    with engine.connect() as connection:
+        alembic_config = make_alembic_config(connection)
+        # the revision before daily_pnl
+        command.upgrade(alembic_config, 'cea2cc6ae504')
+        connection.execute(sqlalchemy.text(
+            "INSERT INTO maker_orders (id, exchange, status, order_type, currency, tx_hash, tx_output_index, notional, created_at, updated_at) "
+            "VALUES (1, 'borderless', 'settled', 'buy', 'LSK/BTC', 'a', 0, 100, NULL, '2020-02-25 05:00:00')"
+        ))
+        # neither created_at nor updated_at, like the orders of the tests
+        connection.execute(sqlalchemy.text(
+            "INSERT INTO taker_orders (id, exchange, status, order_type, currency, order_id, maker_order_id, notional, created_at, updated_at) "
+            "VALUES (1, 'binance', 'filled', 'sell', 'LSK/BTC', 'a', 1, 120, NULL, NULL)"
+        ))
+
+        command.upgrade(alembic_config, 'head')
+        rows = connection.execute(sqlalchemy.text(
+            'SELECT currency, filled, volume, profit, settled, settled_volume FROM daily_pnl ORDER BY day'
+        )).fetchall()
+        assert [tuple(row) for row in rows] == [('LSK/BTC', 0, 0, 0, 1, 100), ('LSK/BTC', 1, 120, 20, 0, 0)]
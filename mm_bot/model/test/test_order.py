@@ -75,3 +75,30 @@ class TestMakerOrder:
         assert maker_order.quantity() == receives_unit
         assert maker_order.price() == sends_unit / receives_unit
         assert maker_order.is_buy() == (order_type == 'buy')
+
+    def test_maker_order_parsed_once(self):
+        maker_order = MakerOrder(
+            exchange='borderless',
+            currency='LSK/BTC',
+            status='open',
+            order_type='sell',
+            order_body={'sendsUnit': '100', 'receivesUnit': '0.01'},
+            tx_hash='7059fc2763fba359d30b248b243107b7eb7a39909eb5dfff216f157ea53b04c8',
+            tx_output_index=0,
+            block_height='51',
+            taker_order_body={},
+            created_at=None,
+            updated_at=None,
+        )
+
+        assert not hasattr(maker_order, '__dict__')
+        assert maker_order.price() is maker_order.price()
+        assert maker_order.as_object()['price'] == '0.0001'
+        assert 'tx_hash' not in maker_order.as_object()
+
+        # replacing the body or the side drops the parsed values
+        maker_order.order_body = {'sendsUnit': '200', 'receivesUnit': '0.01'}
+        assert maker_order.quantity() == Decimal('200')
+        maker_order.order_type = 'buy'
+        assert maker_order.quantity() == Decimal('0.01')
+        assert maker_order.price() == Decimal('20000')
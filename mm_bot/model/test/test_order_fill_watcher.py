@@ -0,0 +1,64 @@
+from datetime import datetime
+
+import pytest
+import sqlalchemy
+
+from mm_bot.model.constants import Settlement, Status
+from mm_bot.model.order import metadata, MakerOrder, TakerOrder
+from mm_bot.model.order_fill_watcher import OrderFillWatcher
+from mm_bot.model.order_store import OrderStore
+from mm_bot.model.repository import OrderRepository
+
+
+class FakeExchange:
+    name = 'binance'
+    side = 'taker'
+
+
+@pytest.fixture
+def repository(tmp_path):
+    url = f'sqlite:///{tmp_path}/test.db'
+    metadata.create_all(sqlalchemy.create_engine(url))
+    return OrderRepository(url)
+
+
+@pytest.mark.asyncio
+async def test_settle_invalid_maker_order(repository):
+    [maker_order] = await repository.create_orders([MakerOrder(
+        exchange='borderless',
+        status=Status.CANCELED,
+        order_type='buy',
+        currency='LSK/BTC',
+        order_body={'sendsUnit': '0.0001', 'receivesUnit': '2', 'sendsFromChain': 'btc'},
+        tx_hash='0',
+        tx_output_index=0,
+        block_height='1',
+        taker_order_body={'receivesToAddress': 'addr'},
+        created_at=datetime(2020, 2, 25),
+        updated_at=datetime(2020, 2, 25),
+    )])
+    [taker_order] = await repository.create_orders([TakerOrder(
+        exchange='binance',
+        status=Status.FILLED,
+        order_type='sell',
+        currency='LSK/BTC',
+        order_body={'price': '0.00006', 'quantity': '2'},
+        order_id='0',
+        maker_order_id=maker_order.id,
+        created_at=datetime(2020, 2, 25),
+        updated_at=datetime(2020, 2, 25),
+    )])
+
+    store = OrderStore(repository, flush_interval=1, batch_size=100)
+    await store.ensure_loaded()
+    watcher = OrderFillWatcher(store, FakeExchange(), None)
+
+    # the canceled maker order can not be settled, the taker order is not tried again
+    await watcher.settle_filled_orders()
+    assert await store.unsettled_orders() == []
+    await store.flush()
+    assert (await repository.get_order_by_id('maker', maker_order.id)).status == Status.CANCELED
+    assert await repository.get_unsettled_orders() == []
+    assert await repository.get_due_jobs(datetime.utcnow(), 10) == []
+
+    await repository.close()
@@ -0,0 +1,148 @@
+from datetime import datetime
+
+import pytest
+import sqlalchemy
+
+from mm_bot.model.constants import Settlement, Status
+from mm_bot.model.order import metadata, MakerOrder, TakerOrder
+from mm_bot.model.order_store import InvalidTransitionError, OrderStore
+from mm_bot.model.outbox import transfer_job
+from mm_bot.model.repository import OrderRepository
+
+
+@pytest.fixture
+def repository(tmp_path):
+    url = f'sqlite:///{tmp_path}/test.db'
+    metadata.create_all(sqlalchemy.create_engine(url))
+    return OrderRepository(url)
+
+
+def maker_order(i, status=Status.OPEN):
+    return MakerOrder(
+        exchange='borderless',
+        status=status,
+        order_type='buy',
+        currency='LSK/BTC',
+        order_body={'sendsUnit': '0.0001', 'receivesUnit': '2'},
+        tx_hash=str(i),
+        tx_output_index=0,
+        block_height='1',
+        taker_order_body={},
+        created_at=datetime(2020, 2, 25),
+        updated_at=datetime(2020, 2, 25),
+    )
+
+
+def taker_order(i, maker_order_id, status=Status.OPEN):
+    return TakerOrder(
+        exchange='binance',
+        status=status,
+        order_type='sell',
+        currency='LSK/BTC',
+        order_body={'price': '0.00006', 'quantity': '2'},
+        order_id=str(i),
+        maker_order_id=maker_order_id,
+        created_at=datetime(2020, 2, 25),
+        updated_at=datetime(2020, 2, 25),
+    )
+
+
+@pytest.mark.asyncio
+async def test_load_and_write_behind(repository):
+    await repository.create_orders([maker_order(0), maker_order(1, Status.FILLED), maker_order(2, Status.SETTLED)])
+    await repository.create_orders([taker_order(0, 3, Status.FILLED)])
+    await repository.create_orders([taker_order(1, 3, Status.FILLED)])
+    await repository.mark_settlement([(await repository.get_all_orders('taker'))[0]], Settlement.SETTLED)
+
+    store = OrderStore(repository, flush_interval=1, batch_size=100)
+    await store.ensure_loaded()
+    assert [o.id for o in store.open_orders('maker')] == [1]
+    assert [o.id for o in store.orders('maker', Status.FILLED)] == [2]
+    # the settled maker order of the unsettled taker order
+    assert store.get_by_tx_key('2', 0).status == Status.SETTLED
+    assert store.get_by_order_id('0') is None
+    [(unsettled, maker)] = await store.unsettled_orders()
+    assert (unsettled.order_id, maker.id) == ('1', 3)
+
+    [hedge] = await store.add([taker_order(2, 2)])
+    assert store.get_by_order_id('2') is hedge
+    assert store.taker_orders_of(2) == [hedge]
+
+    filled = store.get('maker', 2)
+    job = transfer_job('binance', filled.tx_hash, filled.tx_output_index, 'BTC', 'addr', '0.0001')
+    store.transition(hedge, Status.FILLED)
+    store.transition(filled, Status.SETTLED, jobs=[job])
+    store.mark_settlement([unsettled], Settlement.SETTLED)
+    with pytest.raises(InvalidTransitionError):
+        store.transition(filled, Status.OPEN)
+
+    # nothing written before the flush
+    assert (await repository.get_order_by_id('maker', 2)).status == Status.FILLED
+    await store.flush()
+    assert (await repository.get_order_by_id('maker', 2)).status == Status.SETTLED
+    assert (await repository.get_order_by_id('taker', hedge.id)).status == Status.FILLED
+    assert [due.key for due in await repository.get_due_jobs(datetime.utcnow(), 10)] == [job['key']]
+    assert [(o.order_id, m.id) for o, m in await repository.get_unsettled_orders()] == [('2', 2)]
+
+    # the settled maker order 3 and its taker orders are done with
+    assert store.get('maker', 3) is None
+    assert store.get_by_order_id('1') is None
+    assert store.get('maker', 2) is filled
+
+    store.mark_settlement([hedge], Settlement.SETTLED)
+    await store.flush()
+    assert store.get('maker', 2) is None
+    assert store.get_by_order_id('2') is None
+    assert [o.id for o in store.open_orders('maker')] == [1]
+
+    await repository.close()
+
+
+@pytest.mark.asyncio
+async def test_upsert(repository):
+    store = OrderStore(repository, flush_interval=1, batch_size=100)
+    [known] = await store.add([maker_order(0)])
+    known.block_height = None
+    known.mark_persisted()
+
+    listed = [maker_order(0), maker_order(1)]
+    await store.upsert(listed)
+    assert store.get_by_tx_key('0', 0) is known
+    assert known.block_height == '1'
+    assert store.get_by_tx_key('1', 0).id == 2
+    assert [o.id for o in store.open_orders('maker')] == [1, 2]
+
+    await store.flush()
+    assert (await repository.get_order_by_id('maker', 1)).block_height == '1'
+
+    await repository.close()
+
+
+class FailingRepository:
+
+    def __init__(self):
+        self.fail = True
+        self.written = []
+
+    async def update_orders(self, orders, jobs=()):
+        if self.fail:
+            raise RuntimeError('db is gone')
+        self.written.append(([o.id for o in orders], list(jobs)))
+
+
+@pytest.mark.asyncio
+async def test_flush_kept_on_error():
+    repository = FailingRepository()
+    store = OrderStore(repository, flush_interval=1, batch_size=2)
+    order = maker_order(0)
+    order.id = 1
+    store._index(order)
+
+    store.transition(order, Status.FILLED)
+    store.enqueue_jobs([{'key': 'unlock'}])
+    with pytest.raises(RuntimeError):
+        await store.flush()
+
+    repository.fail = False
+    await store.flush()
+    assert repository.written == [([1], [{'key': 'unlock'}])]
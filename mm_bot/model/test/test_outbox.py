@@ -0,0 +1,79 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from mm_bot.model.constants import JobKind
+from mm_bot.model.outbox import Job, OutboxWorker, RESUMABLE_KINDS
+
+
+class FakeRepository:
+
+    def __init__(self, jobs):
+        self.jobs = list(jobs)
+        self.calls = []
+
+    async def recover_jobs(self, resumable_kinds):
+        self.calls.append(('recover', resumable_kinds))
+        return 0, 0
+
+    async def get_due_jobs(self, now, limit):
+        jobs, self.jobs = self.jobs[:limit], self.jobs[limit:]
+        return jobs
+
+    async def start_job(self, job, started_at):
+        self.calls.append(('start', job.id))
+
+    async def finish_job(self, job, finished_at):
+        self.calls.append(('finish', job.id))
+
+    async def retry_job(self, job, next_attempt_at, error):
+        self.calls.append(('retry', job.id))
+
+    async def fail_job(self, job, finished_at, error):
+        self.calls.append(('fail', job.id))
+
+
+def job(job_id, attempts=0):
+    return Job(job_id, JobKind.UNLOCK, f'unlock:borderless:{job_id}:0', {}, attempts, datetime.utcnow())
+
+
+@pytest.mark.asyncio
+async def test_run_due_jobs_bounded():
+    repository = FakeRepository([job(i) for i in range(5)])
+    release = asyncio.Event()
+    running = []
+
+    async def unlock(job):
+        running.append(job.id)
+        await release.wait()
+        if job.id == 1:
+            raise RuntimeError('unlock failed')
+
+    worker = OutboxWorker(repository, {JobKind.UNLOCK: unlock}, concurrency=2, max_attempts=2, backoff=1, delay=1)
+    await worker.run_due_jobs()
+    await worker.run_due_jobs()
+    await asyncio.sleep(0)
+    assert running == [0, 1]
+    assert repository.calls[0] == ('recover', RESUMABLE_KINDS)
+
+    release.set()
+    await worker.stop()
+    assert ('finish', 0) in repository.calls
+    assert ('retry', 1) in repository.calls
+    assert worker.metrics[JobKind.UNLOCK].done == 1
+    assert worker.metrics[JobKind.UNLOCK].retried == 1
+
+
+@pytest.mark.asyncio
+async def test_fail_after_max_attempts():
+    repository = FakeRepository([job(0, attempts=1)])
+
+    async def unlock(job):
+        raise RuntimeError('unlock failed')
+
+    worker = OutboxWorker(repository, {JobKind.UNLOCK: unlock}, concurrency=1, max_attempts=2, backoff=1, delay=1)
+    await worker.run_due_jobs()
+    await worker.stop()
+    assert repository.calls[-1] == ('fail', 0)
+    assert worker.backoff(3) == timedelta(seconds=4)
@@ -0,0 +1,41 @@
+import asyncio
+
+import aiopubsub
+import pytest
+
+from mm_bot.model.poller import AdaptivePoller, ORDERS_PLACED, PollBudget
+
+
+def test_poll_budget():
+    budget = PollBudget(2, period=60)
+    budget.spend(0)
+    budget.spend(10)
+    assert budget.wait_time(20) == 40
+    assert budget.wait_time(60) == 0
+
+
+@pytest.mark.asyncio
+async def test_backoff_when_idle():
+    poller = AdaptivePoller(min_delay=0.001, max_delay=0.004, backoff=2)
+    delays = []
+    for busy in (False, False, False, True, False):
+        await poller.sleep(busy)
+        delays.append(poller.delay)
+
+    assert delays == [0.002, 0.004, 0.004, 0.001, 0.002]
+
+
+@pytest.mark.asyncio
+async def test_wake_on_orders_placed():
+    hub = aiopubsub.Hub()
+    poller = AdaptivePoller(min_delay=0.001, max_delay=60, backoff=2)
+    poller.delay = 60
+    subscriber = aiopubsub.Subscriber(hub, 'watcher')
+    subscriber.add_sync_listener(('*',) + ORDERS_PLACED, lambda key, exchange: poller.wake())
+
+    sleep = asyncio.ensure_future(poller.sleep(False))
+    await asyncio.sleep(0)
+    aiopubsub.Publisher(hub, 'strategy').publish(ORDERS_PLACED, 'borderless')
+    await asyncio.wait_for(sleep, 1)
+    assert poller.delay == 0.001
+    await subscriber.remove_all_listeners()
@@ -1,12 +1,20 @@
 import os
+import subprocess
+import sys
+from datetime import datetime, timedelta
 
 import pytest
 import sqlalchemy
+from sqlalchemy import select
 from sqlalchemy.pool import StaticPool
 
+from mm_bot.model import pnl
 from mm_bot.model.repository import OrderRepository
-from mm_bot.model.order import metadata, MakerOrder, TakerOrder
-from mm_bot.model.constants import Status
+from mm_bot.model.order import metadata, MakerOrder, TakerOrder, TakerOrdersTable
+from mm_bot.model.constants import JobKind, JobStatus, Settlement, Status
+from mm_bot.model.outbox import OutboxTable, transfer_job, unlock_job
+# the archive tables, the repository imports them only when it reads or archives them
+import mm_bot.model.archive
 
 @pytest.fixture
 def repository_with_schema(caplog):
@@ -28,7 +36,10 @@ def repository_with_schema(caplog):
     yield r
 
     metadata.drop_all(engine)
-    os.remove(f'{main_dir}/test.db')
+    # the journal files of the WAL mode
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(f'{main_dir}/test.db{suffix}'):
+            os.remove(f'{main_dir}/test.db{suffix}')
 
 @pytest.mark.asyncio
 async def test_instance():
@@ -99,7 +110,7 @@ async def test_get_all_orders(repository_with_schema):
             currency='BTC/ETH',
             order_body={'foo': 'bar', 'baz': 1},
             tx_hash='a1b2b3c4d5e6faa2321',
-            tx_output_index=1,
+            tx_output_index=2,
             block_height='1',
             taker_order_body={},
             created_at=None,
@@ -195,7 +206,7 @@ async def test_get_taker_orders_by_maker_id(repository_with_schema):
         order_type='buy',
         currency='BTC/ETH',
         order_body={'foo': 'bar', 'baz': 2},
-        order_id='ee55df98-95d7-409f-a8f0-d8a5bf047acd',
+        order_id='fe55df98-95d7-409f-a8f0-d8a5bf047acd',
         maker_order_id = 1,
         created_at=None,
         updated_at=None,
@@ -288,9 +299,448 @@ async def test_find_update_or_create_orders(repository_with_schema):
     assert len(updated_orders) == 2
     for order in updated_orders:
         if order.order_id == new_taker_order.order_id:
-            assert order.id == 2
+            # the ids are not reused, the upsert of the existing order takes one too
+            assert order.id > taker_order.id
         else:
             assert order.id == taker_order.id
             assert order.order_body == updated_order_body
             assert order == taker_order
 
+
+@pytest.mark.asyncio
+async def test_create_orders(repository_with_schema):
+    taker_orders = [
+        TakerOrder(
+            exchange='binance',
+            status='open',
+            order_type='buy',
+            currency='BTC/ETH',
+            order_body={'foo': 'bar', 'baz': i},
+            order_id=str(i),
+            maker_order_id = 1,
+            created_at=None,
+            updated_at=None,
+        )
+        for i in range(200)
+    ]
+    await repository_with_schema.create_order(taker_orders[0])
+    created_orders = await repository_with_schema.create_orders(taker_orders[1:])
+
+    assert [order.id for order in created_orders] == list(range(2, 201))
+    for order in created_orders:
+        fetched_order = await repository_with_schema.get_order_by_id('taker', order.id)
+        assert fetched_order == order
+
+@pytest.mark.asyncio
+async def test_update_orders_writes_changed_columns(repository_with_schema):
+    taker_orders = await repository_with_schema.create_orders([
+        TakerOrder(
+            exchange='binance',
+            status='open',
+            order_type='buy',
+            currency='BTC/ETH',
+            order_body={'foo': 'bar', 'baz': i},
+            order_id=str(i),
+            maker_order_id = 1,
+            created_at=None,
+            updated_at=None,
+        )
+        for i in range(3)
+    ])
+    assert taker_orders[0].changed_values() == {}
+
+    # the status changed in the db behind the orders
+    await repository_with_schema.update_status(taker_orders[:2], Status.FILLED)
+    taker_orders[0].order_body = {'foo': 'bar bar'}
+    taker_orders[2].status = Status.CANCELED
+    await repository_with_schema.update_orders(taker_orders)
+
+    first, second, third = [await repository_with_schema.get_order_by_id('taker', o.id) for o in taker_orders]
+    assert first.order_body == {'foo': 'bar bar'}
+    assert first.status == Status.FILLED
+    assert second.status == Status.FILLED
+    assert third.status == Status.CANCELED
+    assert taker_orders[2].changed_values() == {}
+
+@pytest.mark.asyncio
+async def test_find_update_or_create_maker_orders_by_output(repository_with_schema):
+    def maker_order(tx_output_index, status):
+        return MakerOrder(
+            exchange='borderless',
+            status=status,
+            order_type='sell',
+            currency='BTC/ETH',
+            order_body={'foo': 'bar'},
+            tx_hash='a1b2b3c4d5e6faa2321',
+            tx_output_index=tx_output_index,
+            block_height='1',
+            taker_order_body={},
+            created_at=None,
+            updated_at=None,
+        )
+
+    first, second = await repository_with_schema.find_update_or_create_orders([maker_order(0, 'open'), maker_order(1, 'open')])
+    assert (first.id, second.id) == (1, 2)
+
+    # same tx hash, the output index tells the orders apart
+    updated, created = await repository_with_schema.find_update_or_create_orders([maker_order(1, 'filled'), maker_order(2, 'open')])
+    assert updated.id == second.id
+    assert created.id > second.id
+
+    fetched_order = await repository_with_schema.get_order_by_id('maker', 2)
+    assert fetched_order.status == 'filled'
+    assert await repository_with_schema.count_open_orders('maker') == 2
+
+@pytest.mark.asyncio
+async def test_scaled_columns_written(repository_with_schema):
+    taker_order = await repository_with_schema.create_order(TakerOrder(
+        exchange='binance',
+        status='open',
+        order_type='buy',
+        currency='LSK/BTC',
+        order_body={'price': '0.0001', 'quantity': '2'},
+        order_id='ee55df98-95d7-409f-a8f0-d8a5bf047acd',
+        maker_order_id = 1,
+        created_at=None,
+        updated_at=None,
+    ))
+
+    async def scaled_columns():
+        query = select([TakerOrdersTable.c.price, TakerOrdersTable.c.quantity, TakerOrdersTable.c.notional])
+        return tuple(await repository_with_schema._db.fetch_one(query))
+
+    assert await scaled_columns() == (100000000, 20000000000, 2000000)
+
+    taker_order.order_body = {'price': '0.0002', 'quantity': '2'}
+    await repository_with_schema.update_orders([taker_order])
+    assert await scaled_columns() == (200000000, 20000000000, 4000000)
+
+    fetched_order = await repository_with_schema.get_order_by_id('taker', taker_order.id)
+    assert fetched_order == taker_order
+
+@pytest.mark.asyncio
+async def test_daily_pnl_rollup(repository_with_schema):
+    def maker_order(tx_hash, created_at):
+        return MakerOrder(
+            exchange='borderless',
+            status='open',
+            order_type='buy',
+            currency='LSK/BTC',
+            order_body={'sendsUnit': '0.0001', 'receivesUnit': '2'},
+            tx_hash=tx_hash,
+            tx_output_index=0,
+            block_height='1',
+            taker_order_body={},
+            created_at=created_at,
+            updated_at=created_at,
+        )
+
+    def taker_order(maker_order):
+        return TakerOrder(
+            exchange='binance',
+            status='open',
+            order_type='sell',
+            currency='LSK/BTC',
+            order_body={'price': '0.00006', 'quantity': '2'},
+            order_id=maker_order.tx_hash,
+            maker_order_id=maker_order.id,
+            created_at=maker_order.created_at,
+            updated_at=maker_order.created_at,
+        )
+
+    days = [datetime(2020, 2, 25, 5), datetime(2020, 2, 25, 23), datetime(2020, 2, 26, 1)]
+    maker_orders = await repository_with_schema.create_orders([maker_order(str(i), day) for i, day in enumerate(days)])
+    taker_orders = await repository_with_schema.create_orders([taker_order(o) for o in maker_orders])
+
+    for order in taker_orders:
+        order.status = Status.FILLED
+    await repository_with_schema.update_orders(taker_orders)
+    # already filled, not rolled up twice
+    await repository_with_schema.update_order(taker_orders[0])
+    maker_orders[0].status = Status.SETTLED
+    await repository_with_schema.update_order(maker_orders[0])
+
+    daily_pnl = await repository_with_schema.get_daily_pnl(None, None)
+    assert [(d['day'], d['filled'], d['profit'], d['volume'], d['settled']) for d in daily_pnl] == [
+        ('2020-02-25', 2, '0.00004', '0.00024', 1),
+        ('2020-02-26', 1, '0.00002', '0.00012', 0),
+    ]
+
+    pnl_in_range, = await repository_with_schema.get_pnl_in_range('2020-02-26', None)
+    assert (pnl_in_range['currency'], pnl_in_range['filled']) == ('LSK/BTC', 1)
+
+    filled_orders = await repository_with_schema.get_filled_orders_in_range('2020-02-25T06:00:00', '2020-02-26')
+    assert [o['taker']['id'] for o in filled_orders] == [taker_orders[1].id]
+    assert filled_orders[0]['profit'] == '0.00002'
+
+@pytest.mark.asyncio
+async def test_daily_pnl_rollup_in_transaction(repository_with_schema, monkeypatch):
+    def taker_order(order_id, status):
+        return TakerOrder(
+            exchange='binance',
+            status=status,
+            order_type='sell',
+            currency='LSK/BTC',
+            order_body={'price': '0.00006', 'quantity': '2'},
+            order_id=order_id,
+            maker_order_id=1,
+            created_at=datetime(2020, 2, 25),
+            updated_at=datetime(2020, 2, 25),
+        )
+
+    open_order = await repository_with_schema.create_order(taker_order('0', Status.OPEN))
+    # the rollup fails, the order writes are rolled back with it
+    monkeypatch.setattr(pnl, 'UPSERT_DAILY_PNL', sqlalchemy.text('INSERT INTO no_daily_pnl (day) VALUES (:day)'))
+
+    with pytest.raises(Exception):
+        await repository_with_schema.update_status([open_order], Status.FILLED)
+    with pytest.raises(Exception):
+        await repository_with_schema.create_order(taker_order('1', Status.FILLED))
+    with pytest.raises(Exception):
+        await repository_with_schema.create_orders([taker_order('2', Status.FILLED)])
+
+    orders = await repository_with_schema._get_orders('taker', None)
+    assert [(o.order_id, o.status) for o in orders] == [('0', Status.OPEN)]
+
+@pytest.mark.asyncio
+async def test_get_order_pairs(repository_with_schema):
+    maker_orders = await repository_with_schema.create_orders([
+        MakerOrder(
+            exchange='borderless',
+            status='open' if i % 2 else 'settled',
+            order_type='buy',
+            currency='LSK/BTC' if i < 6 else 'ETH/BTC',
+            order_body={'sendsUnit': '0.0001', 'receivesUnit': '2'},
+            tx_hash=str(i),
+            tx_output_index=0,
+            block_height='1',
+            taker_order_body={},
+            created_at=datetime(2020, 2, 25),
+            updated_at=datetime(2020, 2, 25),
+        )
+        for i in range(8)
+    ])
+    taker_orders = await repository_with_schema.create_orders([
+        TakerOrder(
+            exchange='binance',
+            status='filled',
+            order_type='sell',
+            currency=o.currency,
+            order_body={'price': '0.00006', 'quantity': '2'},
+            order_id=o.tx_hash,
+            maker_order_id=o.id,
+            created_at=datetime(2020, 2, 25),
+            updated_at=datetime(2020, 2, 25),
+        )
+        for o in maker_orders if o.status == 'settled'
+    ])
+    taker_by_maker_id = {o.maker_order_id: o.as_object() for o in taker_orders}
+
+    assert await repository_with_schema.get_order_currencies() == ['ETH/BTC', 'LSK/BTC']
+
+    first_page = await repository_with_schema.get_order_pairs(currency='LSK/BTC', limit=4)
+    second_page = await repository_with_schema.get_order_pairs(
+        currency='LSK/BTC', before_id=first_page[-1]['maker']['id'], limit=4
+    )
+    assert [p['maker']['id'] for p in first_page + second_page] == [6, 5, 4, 3, 2, 1]
+    for pair in first_page + second_page:
+        assert pair['maker'] == maker_orders[pair['maker']['id'] - 1].as_object()
+        assert pair['taker'] == taker_by_maker_id.get(pair['maker']['id'])
+
+    open_pairs = await repository_with_schema.get_order_pairs(status='open')
+    assert [p['maker']['id'] for p in open_pairs] == [8, 6, 4, 2]
+
+@pytest.mark.asyncio
+async def test_archive_orders(repository_with_schema):
+    def maker_order(i, status, updated_at):
+        return MakerOrder(
+            exchange='borderless',
+            status=status,
+            order_type='buy',
+            currency='LSK/BTC',
+            order_body={'sendsUnit': '0.0001', 'receivesUnit': '2'},
+            tx_hash=str(i),
+            tx_output_index=0,
+            block_height='1',
+            taker_order_body={},
+            created_at=datetime(2020, 1, 1),
+            updated_at=updated_at,
+        )
+
+    old, recent = datetime(2020, 1, 2), datetime(2020, 3, 1)
+    maker_orders = await repository_with_schema.create_orders([
+        maker_order(0, 'settled', old),
+        maker_order(1, 'expired', old),
+        maker_order(2, 'open', old),
+        maker_order(3, 'settled', recent),
+        maker_order(4, 'settled', old), # its taker order is still open
+    ])
+    taker_orders = await repository_with_schema.create_orders([
+        TakerOrder(
+            exchange='binance',
+            status='open' if o.tx_hash == '4' else 'filled',
+            order_type='sell',
+            currency=o.currency,
+            order_body={'price': '0.00006', 'quantity': '2'},
+            order_id=o.tx_hash,
+            maker_order_id=o.id,
+            created_at=datetime(2020, 1, 1),
+            updated_at=old,
+        )
+        for o in maker_orders
+    ])
+
+    assert await repository_with_schema.archive_orders(datetime(2020, 2, 1), 1) == 1
+    assert await repository_with_schema.archive_orders(datetime(2020, 2, 1), 10) == 1
+    assert await repository_with_schema.archive_orders(datetime(2020, 2, 1), 10) == 0
+
+    assert [o.id for o in await repository_with_schema.get_all_orders('maker')] == [3, 4, 5]
+    assert [o.maker_order_id for o in await repository_with_schema.get_all_orders('taker')] == [3, 4, 5]
+    assert await repository_with_schema.get_order_by_id('maker', 1) is None
+
+    # the history spans the archive
+    assert await repository_with_schema.get_order_by_id('maker', 1, include_archive=True) == maker_orders[0]
+    assert await repository_with_schema.get_order_by_id('taker', 2, include_archive=True) == taker_orders[1]
+    all_maker_orders = await repository_with_schema.get_all_orders('maker', include_archive=True)
+    assert sorted(o.id for o in all_maker_orders) == [1, 2, 3, 4, 5]
+    pairs = await repository_with_schema.get_order_pairs(limit=3, include_archive=True)
+    assert [(p['maker']['id'], p['taker']['id']) for p in pairs] == [(5, 5), (4, 4), (3, 3)]
+    pairs = await repository_with_schema.get_order_pairs(before_id=3, include_archive=True)
+    assert [(p['maker']['id'], p['taker']['id']) for p in pairs] == [(2, 2), (1, 1)]
+    filled_orders = await repository_with_schema.get_filled_orders_in_range(None, None, include_archive=True)
+    assert [o['taker']['id'] for o in filled_orders] == [1, 2, 3, 4]
+
+@pytest.mark.asyncio
+async def test_archived_ids_not_reused(repository_with_schema):
+    def maker_order(i):
+        return MakerOrder(
+            exchange='borderless',
+            status='settled',
+            order_type='buy',
+            currency='LSK/BTC',
+            order_body={'sendsUnit': '0.0001', 'receivesUnit': '2'},
+            tx_hash=str(i),
+            tx_output_index=0,
+            block_height='1',
+            taker_order_body={},
+            created_at=datetime(2020, 1, 1),
+            updated_at=datetime(2020, 1, 1),
+        )
+
+    await repository_with_schema.create_orders([maker_order(0), maker_order(1)])
+    assert await repository_with_schema.archive_orders(datetime(2020, 2, 1), 10) == 2
+
+    # the top id was archived
+    new_order = await repository_with_schema.create_order(maker_order(2))
+    [new_order_of_batch] = await repository_with_schema.create_orders([maker_order(3)])
+    assert (new_order.id, new_order_of_batch.id) == (3, 4)
+    assert await repository_with_schema.archive_orders(datetime(2020, 2, 1), 10) == 2
+    all_maker_orders = await repository_with_schema.get_all_orders('maker', include_archive=True)
+    assert sorted(o.id for o in all_maker_orders) == [1, 2, 3, 4]
+
+@pytest.mark.asyncio
+async def test_get_unsettled_orders(repository_with_schema):
+    maker_orders = await repository_with_schema.create_orders([
+        MakerOrder(
+            exchange='borderless',
+            status='open',
+            order_type='buy',
+            currency='LSK/BTC',
+            order_body={'sendsUnit': '0.0001', 'receivesUnit': '2'},
+            tx_hash=str(i),
+            tx_output_index=0,
+            block_height='1',
+            taker_order_body={},
+            created_at=datetime(2020, 2, 25),
+            updated_at=datetime(2020, 2, 25),
+        )
+        for i in range(2)
+    ])
+    taker_orders = await repository_with_schema.create_orders([
+        TakerOrder(
+            exchange='binance',
+            status='open' if i == 0 else 'filled',
+            order_type='sell',
+            currency='LSK/BTC',
+            order_body={'price': '0.00006', 'quantity': '2'},
+            order_id=str(i),
+            maker_order_id=maker_order_id,
+            created_at=datetime(2020, 2, 25),
+            updated_at=datetime(2020, 2, 25),
+        )
+        for i, maker_order_id in enumerate([1, 2, 42])
+    ])
+
+    unsettled_orders = await repository_with_schema.get_unsettled_orders()
+    assert unsettled_orders == [(taker_orders[1], maker_orders[1]), (taker_orders[2], None)]
+
+    await repository_with_schema.mark_settlement([taker_orders[1]], Settlement.SETTLED)
+    assert await repository_with_schema.get_unsettled_orders() == [(taker_orders[2], None)]
+
+
+@pytest.mark.asyncio
+async def test_update_orders_enqueues_jobs(repository_with_schema):
+    [maker_order] = await repository_with_schema.create_orders([
+        MakerOrder(
+            exchange='borderless',
+            status='filled',
+            order_type='buy',
+            currency='LSK/BTC',
+            order_body={'sendsUnit': '0.0001', 'receivesUnit': '2'},
+            tx_hash='0',
+            tx_output_index=0,
+            block_height='1',
+            taker_order_body={},
+            created_at=datetime(2020, 2, 25),
+            updated_at=datetime(2020, 2, 25),
+        )
+    ])
+
+    maker_order.status = Status.SETTLED
+    job = transfer_job('binance', maker_order.tx_hash, maker_order.tx_output_index, 'BTC', 'addr', '0.0001')
+    await repository_with_schema.update_orders([maker_order], jobs=[job])
+    # a key is enqueued once
+    await repository_with_schema.enqueue_jobs([transfer_job('binance', '0', 0, 'BTC', 'addr', '0.0001')])
+    # another output of the same tx is another transfer
+    assert transfer_job('binance', '0', 1, 'BTC', 'addr', '0.0001')['key'] != job['key']
+
+    assert (await repository_with_schema.get_order_by_id('maker', maker_order.id)).status == Status.SETTLED
+    [due] = await repository_with_schema.get_due_jobs(datetime.utcnow(), 10)
+    assert (due.kind, due.key, due.attempts) == (JobKind.TRANSFER, job['key'], 0)
+    assert due.payload == {'exchange': 'binance', 'asset_id': 'BTC', 'to_addr': 'addr', 'amount': '0.0001'}
+
+
+@pytest.mark.asyncio
+async def test_outbox_jobs(repository_with_schema):
+    await repository_with_schema.enqueue_jobs([unlock_job('borderless', str(i), 0) for i in range(3)])
+    first, second, third = await repository_with_schema.get_due_jobs(datetime.utcnow(), 10)
+
+    now = datetime.utcnow()
+    await repository_with_schema.start_job(first, now)
+    await repository_with_schema.finish_job(first, now)
+    await repository_with_schema.start_job(second, now)
+    await repository_with_schema.retry_job(second, now + timedelta(minutes=1), 'error')
+    await repository_with_schema.start_job(third, now)
+    assert await repository_with_schema.get_due_jobs(now, 10) == []
+    assert [job.id for job in await repository_with_schema.get_due_jobs(now + timedelta(minutes=1), 10)] == [second.id]
+
+    assert await repository_with_schema.recover_jobs((JobKind.UNLOCK,)) == (1, 0)
+    await repository_with_schema.start_job(third, now)
+    await repository_with_schema.fail_job(third, now, 'error')
+
+    # a failed key is enqueued again, a done one is not
+    await repository_with_schema.enqueue_jobs([unlock_job('borderless', str(i), 0) for i in range(3)])
+    rows = await repository_with_schema._db.fetch_all(
+        select([OutboxTable.c.key, OutboxTable.c.status, OutboxTable.c.attempts]).order_by(OutboxTable.c.id)
+    )
+    assert [(row[0], row[1], row[2]) for row in rows] == [
+        (first.key, JobStatus.DONE, 1),
+        (second.key, JobStatus.PENDING, 1),
+        (third.key, JobStatus.PENDING, 0),
+    ]
+
+
+def test_archive_imported_lazily():
+    main_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..'))
+    code = 'import sys, mm_bot.model.repository; assert "mm_bot.model.archive" not in sys.modules'
+    subprocess.run([sys.executable, '-c', code], cwd=main_dir, check=True)
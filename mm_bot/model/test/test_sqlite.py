@@ -0,0 +1,103 @@
+import sqlite3
+from datetime import datetime
+
+import pytest
+import sqlalchemy
+
+from mm_bot.model.order import metadata, TakerOrdersTable
+from mm_bot.model import sqlite
+from mm_bot.model.sqlite import SQLiteDatabase, is_sqlite
+
+
+@pytest.fixture
+def url(tmp_path):
+    url = f'sqlite:///{tmp_path}/test.db'
+    metadata.create_all(sqlalchemy.create_engine(url))
+    return url
+
+
+def test_is_sqlite():
+    assert is_sqlite('sqlite+pysqlite:///db/database.sqlite')
+    assert not is_sqlite('postgresql://localhost/mmm_bot')
+
+
+@pytest.mark.asyncio
+async def test_pragmas_applied(url):
+    db = SQLiteDatabase(url, readers=2)
+    await db.connect()
+    try:
+        journal_mode, = await db.fetch_one('PRAGMA journal_mode')
+        assert journal_mode == 'wal'
+        synchronous, = await db.fetch_one('PRAGMA synchronous')
+        assert synchronous == 1 # NORMAL
+        busy_timeout, = await db.fetch_one('PRAGMA busy_timeout')
+        assert busy_timeout == 5000
+    finally:
+        await db.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_readers_do_not_wait_for_writer(url):
+    db = SQLiteDatabase(url, readers=2)
+    await db.connect()
+    insert = TakerOrdersTable.insert().values(exchange='binance', currency='LSK/BTC', order_id='1')
+    await db.execute(insert)
+
+    # another process in the middle of a write transaction
+    other = sqlite3.connect(url[len('sqlite:///'):], isolation_level=None)
+    other.execute('BEGIN IMMEDIATE')
+    other.execute("DELETE FROM taker_orders")
+    try:
+        rows = await db.fetch_all(TakerOrdersTable.select())
+        assert [row['order_id'] for row in rows] == ['1']
+
+        with pytest.raises(sqlite3.OperationalError):
+            # the reader connections are read only
+            connection = await db._reader_pool.acquire()
+            await connection.execute('DELETE FROM taker_orders')
+    finally:
+        other.execute('ROLLBACK')
+        other.close()
+        await db.disconnect()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('returning', [True, False])
+async def test_insert_many_ids(url, monkeypatch, returning):
+    if returning and not sqlite.SUPPORTS_RETURNING:
+        pytest.skip('sqlite before 3.35')
+    monkeypatch.setattr(sqlite, 'SUPPORTS_RETURNING', returning)
+    db = SQLiteDatabase(url, readers=0)
+    await db.connect()
+    try:
+        # the ids are not max(id) + 1 after an explicit one
+        await db.execute(TakerOrdersTable.insert().values(id=10, exchange='binance', currency='LSK/BTC', order_id='0'))
+        await db.execute(TakerOrdersTable.delete())
+        values = [dict(exchange='binance', currency='LSK/BTC', order_id=str(i)) for i in range(1, 4)]
+        ids = await db.insert_many(TakerOrdersTable, values, ('exchange', 'order_id'))
+
+        rows = await db.fetch_all(sqlalchemy.select([TakerOrdersTable.c.id, TakerOrdersTable.c.order_id]))
+        assert ids == [11, 12, 13]
+        assert {row_id: order_id for row_id, order_id in rows} == {11: '1', 12: '2', 13: '3'}
+    finally:
+        await db.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_rows_processed(url):
+    db = SQLiteDatabase(url, readers=0)
+    await db.connect()
+    try:
+        created_at = datetime(2020, 2, 25, 12, 30)
+        await db.execute(TakerOrdersTable.insert(), values=dict(
+            exchange='binance', currency='LSK/BTC', order_id='1', order_body={'price': '0.0001'}, created_at=created_at,
+        ))
+        row = await db.fetch_one(sqlalchemy.select([TakerOrdersTable.c.order_body, TakerOrdersTable.c.created_at]))
+        assert row['order_body'] == {'price': '0.0001'}
+        assert row[1] == created_at
+        assert row.keys() == ['order_body', 'created_at']
+
+        order_id, = await db.fetch_one('SELECT order_id FROM taker_orders WHERE id = :id', values={'id': 1})
+        assert order_id == '1'
+    finally:
+        await db.disconnect()
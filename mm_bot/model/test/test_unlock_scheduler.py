@@ -0,0 +1,46 @@
+from mm_bot.model.constants import Status
+from mm_bot.model.order import MakerOrder
+from mm_bot.model.unlock_scheduler import UnlockScheduler, unlock_height
+
+
+def make_maker_order(tx_hash, block_height, deposit=100):
+    return MakerOrder(
+        exchange='borderless', status=Status.OPEN, order_type='buy', currency='LSK/BTC',
+        order_body={'deposit': deposit}, tx_hash=tx_hash, tx_output_index=0, block_height=block_height,
+        taker_order_body={}, created_at=None, updated_at=None,
+    )
+
+
+def test_unlock_height():
+    assert unlock_height(make_maker_order('a', '51', deposit=600), 100) == 651
+    assert unlock_height(make_maker_order('a', '51', deposit=None), 100) == 151
+    assert unlock_height(make_maker_order('a', None), 100) is None
+
+
+def test_pop_due():
+    scheduler = UnlockScheduler(100)
+    late, early, matched = make_maker_order('late', '20'), make_maker_order('early', '10'), make_maker_order('matched', '10')
+    scheduler.schedule([late, early, matched, make_maker_order('not mined', None)])
+    scheduler.cancel(matched)
+
+    assert scheduler.next_height == 110
+    assert scheduler.pop_due(109) == []
+    assert scheduler.pop_due(115) == [('early', 0)]
+    # an unlock is enqueued once
+    scheduler.schedule([early])
+    assert scheduler.pop_due(120) == [('late', 0)]
+    assert scheduler.next_height is None
+    assert len(scheduler) == 0
+
+
+def test_fired_forgotten_once_closed():
+    scheduler = UnlockScheduler(100)
+    order = make_maker_order('a', '10')
+    scheduler.schedule([order])
+    assert scheduler.pop_due(110) == [('a', 0)]
+
+    scheduler.schedule([order])
+    assert scheduler._fired == {('a', 0)}
+    # unlocked, not open anymore
+    scheduler.schedule([])
+    assert scheduler._fired == set()
@@ -0,0 +1,83 @@
+"""
+Block scheduled unlocks of the collateral of the unmatched maker orders
+
+The collateralized NRG of a maker order nobody took can be unlocked once
+its deposit window is over, at the tradeHeight of the order plus its
+deposit length. The scheduler keeps the open maker orders of the watcher in
+a heap by that height, so the unlocks are enqueued in the outbox as soon as
+the chain gets there instead of on a periodic scan of the unmatched orders.
+"""
+import heapq
+from typing import List, Optional, Set, Tuple
+
+from mm_bot.model.order import MakerOrder
+
+
+def unlock_height(order: MakerOrder, deposit_length: int) -> Optional[int]:
+    """
+    The first block the collateral of the order can be unlocked at, None
+    until the order is mined. deposit_length is the one of an order without
+    its own deposit.
+    """
+    if order.block_height is None:
+        return None
+
+    deposit = order.order_body.get('deposit')
+    if deposit is None:
+        deposit = deposit_length
+    return int(order.block_height) + int(deposit)
+
+
+class UnlockScheduler:
+
+    def __init__(self, deposit_length: int):
+        # replaced on a reload of the config, see OrderFillWatcher.settings
+        self.deposit_length = deposit_length
+        self._heap: List[Tuple[int, str, int]] = []
+        # the orders in the heap, a canceled one is dropped when popped
+        self._scheduled: Set[Tuple[str, int]] = set()
+        # the orders popped, the outbox runs their unlocks
+        self._fired: Set[Tuple[str, int]] = set()
+
+    def __len__(self) -> int:
+        return len(self._scheduled)
+
+    def schedule(self, orders: List[MakerOrder]) -> None:
+        """
+        orders are all the open maker orders, a fired one not in them anymore is forgotten
+        """
+        keys = set((order.tx_hash, order.tx_output_index) for order in orders)
+        self._fired &= keys
+        for order in orders:
+            key = (order.tx_hash, order.tx_output_index)
+            if key in self._scheduled or key in self._fired:
+                continue
+
+            height = unlock_height(order, self.deposit_length)
+            if height is not None:
+                self._scheduled.add(key)
+                heapq.heappush(self._heap, (height, order.tx_hash, order.tx_output_index))
+
+    def cancel(self, order: MakerOrder) -> None:
+        """
+        The order was matched, its collateral is not unlocked
+        """
+        self._scheduled.discard((order.tx_hash, order.tx_output_index))
+
+    @property
+    def next_height(self) -> Optional[int]:
+        while self._heap and (self._heap[0][1], self._heap[0][2]) not in self._scheduled:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, latest_height: int) -> List[Tuple[str, int]]:
+        """
+        The (tx_hash, tx_output_index) of the orders which can be unlocked at latest_height
+        """
+        due = []
+        while self.next_height is not None and self.next_height <= latest_height:
+            _, tx_hash, tx_output_index = heapq.heappop(self._heap)
+            self._scheduled.discard((tx_hash, tx_output_index))
+            self._fired.add((tx_hash, tx_output_index))
+            due.append((tx_hash, tx_output_index))
+        return due
@@ -0,0 +1,187 @@
+"""
+On-demand profiling of the running bot
+
+The webserver can not reach the bot process directly (they run in different
+containers), so it drops a request file next to the strategy config, the same
+way config reloads are signalled. The bot polls for it and dumps the results
+into the logs directory, where the webserver can serve them.
+"""
+import asyncio
+import collections
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Counter, Dict, Optional
+
+from mm_bot.helpers import PROFILES_FILE_PATTERN
+
+LOGGER = logging.getLogger('market_maker_bot.profiling')
+
+PROFILE_MODE_CPU = 'cpu'
+PROFILE_MODE_SAMPLE = 'sample'
+PROFILE_MODE_MEMORY = 'memory'
+PROFILE_MODES = (PROFILE_MODE_CPU, PROFILE_MODE_SAMPLE, PROFILE_MODE_MEMORY)
+
+MAX_PROFILE_DURATION = 300 # in seconds
+DEFAULT_SAMPLE_INTERVAL = 0.005 # in seconds
+TRACEMALLOC_FRAMES = 10
+
+
+class SamplingProfiler:
+    """
+    Periodically samples the stack of a single thread from a background thread
+    and aggregates them as collapsed stacks, ex `main;run;tick 42`, which is
+    the input format of flamegraph.pl and speedscope
+    """
+
+    def __init__(self, thread_id: Optional[int] = None, interval: float = DEFAULT_SAMPLE_INTERVAL):
+        self._thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self._interval = interval
+        self._stacks: Counter[str] = collections.Counter()
+        self._stopped = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._stopped.clear()
+        self._sampler = threading.Thread(target=self._sample_forever, name='sampling-profiler', daemon=True)
+        self._sampler.start()
+
+    def stop(self) -> Counter[str]:
+        self._stopped.set()
+        if self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+        return self._stacks
+
+    def _sample_forever(self) -> None:
+        while not self._stopped.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            self._stacks[';'.join(reversed(stack))] += 1
+
+
+def _profile_path(mode: str, extension: str) -> str:
+    return f'{PROFILES_FILE_PATTERN}{int(time.time())}-{mode}.{extension}'
+
+
+def _clamp_duration(duration: int) -> int:
+    return max(1, min(int(duration), MAX_PROFILE_DURATION))
+
+
+async def run_cpu_profile(duration: int) -> str:
+    """
+    Run cProfile on the event loop thread for `duration` seconds
+
+    Dumps the raw pstats (loadable with snakeviz, gprof2dot, ...) and a text
+    report sorted by cumulative time, returns the path of the text report
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        await asyncio.sleep(_clamp_duration(duration))
+    finally:
+        profiler.disable()
+
+    raw_path = _profile_path(PROFILE_MODE_CPU, 'pstats')
+    profiler.dump_stats(raw_path)
+
+    report = io.StringIO()
+    pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(100)
+    report_path = _profile_path(PROFILE_MODE_CPU, 'txt')
+    with open(report_path, 'w') as f:
+        f.write(report.getvalue())
+
+    return report_path
+
+
+async def run_sampling_profile(duration: int, interval: float = DEFAULT_SAMPLE_INTERVAL) -> str:
+    """
+    Sample the event loop thread for `duration` seconds, returns the path of the collapsed stacks
+    """
+    profiler = SamplingProfiler(threading.get_ident(), interval)
+    profiler.start()
+    try:
+        await asyncio.sleep(_clamp_duration(duration))
+    finally:
+        stacks = profiler.stop()
+
+    path = _profile_path(PROFILE_MODE_SAMPLE, 'collapsed')
+    with open(path, 'w') as f:
+        for stack, count in stacks.most_common():
+            f.write(f'{stack} {count}\n')
+
+    return path
+
+
+def take_memory_snapshot(limit: int = 50) -> str:
+    """
+    Dump the top allocation sites of a tracemalloc snapshot
+
+    tracemalloc is started on the first call, so the first snapshot only
+    contains allocations made after the request came in
+    """
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        LOGGER.info('tracemalloc started, next snapshots will include the allocation history')
+
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ))
+    current, peak = tracemalloc.get_traced_memory()
+
+    path = _profile_path(PROFILE_MODE_MEMORY, 'txt')
+    with open(path, 'w') as f:
+        f.write(f'traced memory: current {current} B, peak {peak} B\n\n')
+        for stat in snapshot.statistics('lineno')[:limit]:
+            f.write(f'{stat}\n')
+
+    return path
+
+
+_profile_in_progress = False
+
+async def handle_profile_request(request: Dict[str, str]) -> Optional[str]:
+    """
+    request: {'mode': 'cpu|sample|memory', 'duration': seconds}
+
+    Only one profile runs at a time, overlapping requests are dropped
+    """
+    mode = request.get('mode')
+    duration = int(request.get('duration', 30))
+    if mode not in PROFILE_MODES:
+        LOGGER.warning('Unknown profile mode: %s', mode)
+        return None
+
+    global _profile_in_progress
+    if _profile_in_progress:
+        LOGGER.warning('Profile already in progress, ignoring request: %s', request)
+        return None
+
+    _profile_in_progress = True
+    try:
+        LOGGER.info('Start profiling, mode: %s, duration: %ss', mode, duration)
+        if mode == PROFILE_MODE_CPU:
+            path = await run_cpu_profile(duration)
+        elif mode == PROFILE_MODE_SAMPLE:
+            path = await run_sampling_profile(duration)
+        else:
+            path = take_memory_snapshot()
+        LOGGER.info('Profile done, written to %s', path)
+    finally:
+        _profile_in_progress = False
+
+    return path
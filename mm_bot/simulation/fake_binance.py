@@ -0,0 +1,207 @@
+import asyncio
+import json
+import logging
+import random
+import threading
+from typing import Dict, Optional
+
+from aiohttp import web
+
+from mm_bot.simulation.market import Faults, SimulatedError, SimulatedMarket
+
+# prices of the assets in USDT, used to value the collateralized nrg of the maker orders
+USDT_PRICES = {
+    'BTC': '10000',
+    'ETH': '200',
+    'LSK': '1',
+    'NEO': '10',
+    'WAVES': '1',
+    'DAI': '1',
+}
+WEBSOCKET_PUSH_INTERVAL = 0.01 # in seconds
+
+
+class FakeBinance:
+    """
+    Local binance REST and websocket server backed by the simulated market
+
+    Implements the endpoints the bot uses: depth, ticker price, order
+    create / query and open orders, plus a `<symbol>@depth` stream pushing the
+    book on every change. Signatures and api keys are not checked and every
+    api version (v1, v3) is served the same.
+    """
+
+    def __init__(self, market: SimulatedMarket, faults: Optional[Faults] = None,
+                 host: str = '127.0.0.1', port: int = 0, seed: int = 0):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._market = market
+        self._faults = faults or Faults()
+        self._rnd = random.Random(seed)
+        self._host = host
+        self._port = port
+        self._runner: Optional[web.AppRunner] = None
+        self._thread: Optional[threading.Thread] = None
+        self._thread_loop: Optional[asyncio.AbstractEventLoop] = None
+        self.calls: Dict[str, int] = {}
+
+        self.app = web.Application(middlewares=[self._inject_faults])
+        self.app.router.add_get('/api/{version}/ping', self.ping)
+        self.app.router.add_get('/api/{version}/time', self.server_time)
+        self.app.router.add_get('/api/{version}/depth', self.depth)
+        self.app.router.add_get('/api/{version}/ticker/price', self.ticker_price)
+        self.app.router.add_post('/api/{version}/order', self.create_order)
+        self.app.router.add_get('/api/{version}/order', self.get_order)
+        self.app.router.add_get('/api/{version}/openOrders', self.open_orders)
+        self.app.router.add_get('/ws/{stream}', self.stream)
+
+    @property
+    def url(self) -> str:
+        return f'http://{self._host}:{self._port}'
+
+    async def start(self) -> None:
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self._host, self._port)
+        await site.start()
+        # resolve the port when it was picked by the os
+        self._port = site._server.sockets[0].getsockname()[1]
+        self._logger.info('Fake binance listening on %s', self.url)
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def start_in_thread(self, updates_per_sec: Optional[float] = None) -> None:
+        """
+        Serve (and optionally update the market) from a thread with its own event loop
+
+        Needed when the bot makes blocking http calls (ex the `requests` call of
+        `Borderless.get_price`), and keeps the update rate of the market
+        independent of how busy the loop of the bot is
+        """
+        started = threading.Event()
+
+        def serve() -> None:
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            self._thread_loop = loop
+            loop.run_until_complete(self.start())
+            if updates_per_sec:
+                loop.create_task(self._market.run(updates_per_sec))
+            started.set()
+            loop.run_forever()
+
+            loop.run_until_complete(self.stop())
+            pending_tasks = asyncio.all_tasks(loop)
+            for task in pending_tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*pending_tasks, return_exceptions=True))
+            loop.close()
+
+        self._thread = threading.Thread(target=serve, name='fake-binance', daemon=True)
+        self._thread.start()
+        started.wait()
+
+    def stop_thread(self) -> None:
+        if self._thread is None:
+            return
+
+        self._thread_loop.call_soon_threadsafe(self._thread_loop.stop)
+        self._thread.join()
+        self._thread = None
+
+    @web.middleware
+    async def _inject_faults(self, request: web.Request, handler):
+        self.calls[request.path] = self.calls.get(request.path, 0) + 1
+        if request.path.startswith('/ws/'):
+            return await handler(request)
+
+        try:
+            await self._faults.inject(self._rnd, request.path)
+        except SimulatedError as e:
+            return web.json_response({'code': -1001, 'msg': str(e)}, status=500)
+
+        return await handler(request)
+
+    async def _params(self, request: web.Request) -> Dict[str, str]:
+        params = dict(request.query)
+        if request.method == 'POST' and request.can_read_body:
+            params.update(await request.post())
+        return params
+
+    async def ping(self, request: web.Request) -> web.Response:
+        return web.json_response({})
+
+    async def server_time(self, request: web.Request) -> web.Response:
+        return web.json_response({'serverTime': int(self._market.updated_at['binance'] * 1000)})
+
+    def _depth(self, limit: int = 100) -> Dict:
+        return {
+            'lastUpdateId': self._market.updates,
+            'bids': self._market.binance_bids[:limit],
+            'asks': self._market.binance_asks[:limit],
+        }
+
+    async def depth(self, request: web.Request) -> web.Response:
+        limit = int(request.query.get('limit', 100))
+        return web.json_response(self._depth(limit))
+
+    async def ticker_price(self, request: web.Request) -> web.Response:
+        symbol = request.query['symbol'].upper()
+        if symbol == self._market.currency.to_currency('binance').upper():
+            price = str(self._market.mid_price)
+        elif symbol.endswith('USDT') and symbol[:-len('USDT')] in USDT_PRICES:
+            price = USDT_PRICES[symbol[:-len('USDT')]]
+        else:
+            return web.json_response({'code': -1121, 'msg': 'Invalid symbol.'}, status=400)
+
+        return web.json_response({'symbol': symbol, 'price': price})
+
+    async def create_order(self, request: web.Request) -> web.Response:
+        params = await self._params(request)
+        order = self._market.add_taker_order(
+            params['symbol'], params['side'], params['price'], params['quantity']
+        )
+        return web.json_response(order)
+
+    async def get_order(self, request: web.Request) -> web.Response:
+        order = self._market.get_taker_order(int(request.query['orderId']))
+        if order is None:
+            return web.json_response({'code': -2013, 'msg': 'Order does not exist.'}, status=400)
+        return web.json_response(order)
+
+    async def open_orders(self, request: web.Request) -> web.Response:
+        symbol = request.query.get('symbol')
+        with self._market.lock:
+            orders = [
+                order for order in self._market.taker_orders.values()
+                if order['status'] == 'NEW' and (symbol is None or order['symbol'] == symbol)
+            ]
+        return web.json_response(orders)
+
+    async def stream(self, request: web.Request) -> web.WebSocketResponse:
+        """
+        Pushes the whole book (not diffs) on every change of the binance book
+        """
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+
+        pusher = asyncio.ensure_future(self._push_depth(ws))
+        try:
+            # reading handles the pings and the close of the client
+            async for _ in ws:
+                pass
+        finally:
+            pusher.cancel()
+
+        return ws
+
+    async def _push_depth(self, ws: web.WebSocketResponse) -> None:
+        last_pushed = None
+        while not ws.closed:
+            updated_at = self._market.updated_at['binance']
+            if updated_at != last_pushed:
+                last_pushed = updated_at
+                await ws.send_str(json.dumps(dict(self._depth(), E=int(updated_at * 1000))))
+            await asyncio.sleep(WEBSOCKET_PUSH_INTERVAL)
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import random
+from typing import Any, Dict, List, Optional
+
+from mm_bot.exchange.maker.borderless import JSCallFailedError
+from mm_bot.simulation.market import Faults, SimulatedError, SimulatedMarket
+
+USDT_NRG_PRICE = '25'
+BALANCE = {'confirmed': '100000', 'unconfirmed': '0', 'collateralized': '0'}
+
+
+class FakeJsCli:
+    """
+    Stand-in of `_call_js_cli`, answers the commands of bin/main.js from the simulated market
+
+    The node cli talks to the miner over the bc-sdk rpc client, so the
+    simulation replaces the boundary the bot actually depends on, the json the
+    cli prints. `spawn_delay` accounts for the node process start up, which
+    dominates the real calls.
+    """
+
+    def __init__(self, market: SimulatedMarket, faults: Optional[Faults] = None,
+                 spawn_delay: float = 0.0, seed: int = 0):
+        self._market = market
+        self._faults = faults or Faults()
+        self._spawn_delay = spawn_delay
+        self._rnd = random.Random(seed)
+        self.calls: Dict[str, int] = {}
+
+        self._handlers = {
+            ('get', 'balance'): self._get_balance,
+            ('get', 'order_book'): self._get_order_book,
+            ('get', 'open_orders'): self._get_open_orders,
+            ('get', 'matched_orders'): self._get_matched_orders,
+            ('get', 'unmatched_orders'): self._get_unmatched_orders,
+            ('get', 'latest_block'): self._get_latest_block,
+            ('get', 'latest_usdt_nrg_price'): self._get_latest_usdt_nrg_price,
+            ('create', 'maker'): self._create_maker,
+            ('create', 'unlock'): self._create_unlock,
+            ('cancel', 'maker'): self._cancel_maker,
+            ('transfer', 'asset'): self._transfer_asset,
+        }
+
+    async def __call__(self, args: List[str], logger: Optional[logging.Logger] = None) -> Any:
+        command = (args[0], args[1])
+        name = ' '.join(command)
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+        handler = self._handlers.get(command)
+        if handler is None:
+            raise JSCallFailedError(1, f'Unknown command: {name}')
+
+        options = dict(zip(args[2::2], args[3::2]))
+        try:
+            await self._faults.inject(self._rnd, name)
+        except SimulatedError as e:
+            raise JSCallFailedError(1, str(e))
+
+        if self._spawn_delay:
+            await asyncio.sleep(self._spawn_delay)
+
+        with self._market.lock:
+            return handler(options)
+
+    def _get_balance(self, options: Dict[str, str]) -> Dict[str, str]:
+        return dict(BALANCE)
+
+    def _get_order_book(self, options: Dict[str, str]) -> List[Dict[str, Any]]:
+        return list(self._market.borderless_orders) + list(self._market.maker_orders.values())
+
+    def _get_open_orders(self, options: Dict[str, str]) -> List[Dict[str, Any]]:
+        self._market.listed_maker_orders.update(self._market.maker_orders)
+        return list(self._market.maker_orders.values())
+
+    def _get_matched_orders(self, options: Dict[str, str]) -> List[Dict[str, Any]]:
+        if '--fromHeight' in options:
+            from_height = int(options['--fromHeight'])
+            return [o for o in self._market.matched_orders if o['taker']['tradeHeight'] >= from_height]
+        return list(self._market.matched_orders)
+
+    def _get_unmatched_orders(self, options: Dict[str, str]) -> List[Dict[str, Any]]:
+        return []
+
+    def _get_latest_block(self, options: Dict[str, str]) -> Dict[str, Any]:
+        return {'height': self._market.block_height}
+
+    def _get_latest_usdt_nrg_price(self, options: Dict[str, str]) -> Dict[str, str]:
+        return {'price': USDT_NRG_PRICE}
+
+    def _create_maker(self, options: Dict[str, str]) -> Dict[str, Any]:
+        order = self._market.add_maker_order({
+            'collateralizedNrg': options['--collateralizedNrg'],
+            'nrgUnit': options['--nrgUnit'],
+            'sendsFromChain': options['--sendsFromChain'],
+            'receivesToChain': options['--receivesToChain'],
+            'sendsFromAddress': options['--sendsFromAddress'],
+            'receivesToAddress': options['--receivesToAddress'],
+            'sendsUnit': options['--sendsUnit'],
+            'receivesUnit': options['--receivesUnit'],
+        })
+        return {'status': 0, 'txHash': order['txHash']}
+
+    def _create_unlock(self, options: Dict[str, str]) -> Dict[str, Any]:
+        return {'status': 0, 'txHash': options['--txHash']}
+
+    def _cancel_maker(self, options: Dict[str, str]) -> Dict[str, Any]:
+        self._market.maker_orders.pop(options['--makerOrderHash'], None)
+        self._market.listed_maker_orders.discard(options['--makerOrderHash'])
+        return {'status': 0, 'txHash': options['--makerOrderHash']}
+
+    def _transfer_asset(self, options: Dict[str, str]) -> Dict[str, Any]:
+        return {'status': 0}
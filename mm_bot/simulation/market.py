@@ -0,0 +1,219 @@
+import asyncio
+import random
+import threading
+import time
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Set
+
+from mm_bot.model.currency import CurrencyPair
+
+PRICE_PRECISION = Decimal('0.00000001')
+
+
+class SimulatedError(Exception):
+    """
+    Raised by the stand-ins when an error is injected
+    """
+
+
+@dataclass
+class Faults:
+    """
+    latency is added to every call, plus a random jitter in [0, jitter]
+    error_rate is the probability of a call failing
+    """
+    latency: float = 0.0 # in seconds
+    jitter: float = 0.0 # in seconds
+    error_rate: float = 0.0
+
+    async def inject(self, rnd: random.Random, name: str) -> None:
+        delay = self.latency + (rnd.random() * self.jitter if self.jitter else 0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if self.error_rate and rnd.random() < self.error_rate:
+            raise SimulatedError(f'injected error in {name}')
+
+
+class SimulatedMarket:
+    """
+    Shared state of the simulated borderless miner and binance
+
+    Both venues quote around the same random walking mid price, each
+    `update()` moves the mid price and replaces `churn` of the levels of one
+    of the books, alternating between the venues. Our own maker orders get
+    matched with `fill_rate` probability per update, once the bot listed them
+    in the open orders of the wallet and so knows their tradeHeight, and the
+    taker orders in binance are filled on the next update.
+
+    The stand-ins may run in another thread than the bot, `lock` guards the
+    orders and the books.
+    """
+
+    def __init__(self, currency: CurrencyPair, mid_price: Decimal = Decimal('0.0001'), depth: int = 20,
+                 churn: float = 0.2, fill_rate: float = 0.01, updates_per_block: int = 100, seed: int = 0):
+        self.currency = currency
+        self.mid_price = mid_price
+        self.depth = depth
+        self.churn = churn
+        self.fill_rate = fill_rate
+        self.updates_per_block = updates_per_block
+
+        self._rnd = random.Random(seed)
+        self.lock = threading.RLock()
+        self.updates = 0
+        self.block_height = 1
+        # time of the last change of each book
+        self.updated_at = {'borderless': time.time(), 'binance': time.time()}
+
+        self.borderless_orders: List[Dict[str, Any]] = [self._make_borderless_order() for _ in range(depth * 2)]
+        self.binance_bids: List[List[str]] = []
+        self.binance_asks: List[List[str]] = []
+        self._refresh_binance_book()
+
+        # own orders, keyed by tx hash / order id
+        self.maker_orders: Dict[str, Dict[str, Any]] = {}
+        self.matched_orders: List[Dict[str, Any]] = []
+        # the tx hashes of the maker orders returned by the open orders
+        self.listed_maker_orders: Set[str] = set()
+        self.taker_orders: Dict[int, Dict[str, Any]] = {}
+        self._next_id = 1
+
+    def _price_around_mid(self, is_buy: bool) -> Decimal:
+        spread = Decimal(self._rnd.randint(1, 100)) / 10000
+        factor = 1 - spread if is_buy else 1 + spread
+        return (self.mid_price * factor).quantize(PRICE_PRECISION)
+
+    def _quantity(self) -> Decimal:
+        return Decimal(self._rnd.randint(1, 10000)) / 100
+
+    def _make_borderless_order(self) -> Dict[str, Any]:
+        """
+        An open order as returned by `get order_book` of the js cli
+        """
+        is_buy = self._rnd.random() < 0.5
+        price = self._price_around_mid(is_buy)
+        quantity = self._quantity()
+        base = self.currency.base.lower()
+        counter = self.currency.counter.lower()
+        if is_buy:
+            # sends counter, receives base
+            sends_from_chain, sends_unit = counter, price * quantity
+            receives_to_chain, receives_unit = base, quantity
+        else:
+            sends_from_chain, sends_unit = base, quantity
+            receives_to_chain, receives_unit = counter, price * quantity
+
+        return {
+            'base': 2,
+            'collateralizedNrg': str(self._rnd.randint(1, 100)),
+            'deposit': 600,
+            'doubleHashedBcAddress': '0x74a9ab94273274e627bb17ec9b18af81f48646a2b62ab58afde3bab11bda9676',
+            'fixedUnitFee': '0',
+            'isSettled': False,
+            'nrgUnit': '1',
+            'receivesToAddress': '2570416870016743267L',
+            'receivesToChain': receives_to_chain,
+            'receivesUnit': str(receives_unit),
+            'sendsFromAddress': '1AJP6ck7XkhhTT7QTrn7U81UczmxgX3Azn',
+            'sendsFromChain': sends_from_chain,
+            'sendsUnit': str(sends_unit),
+            'settlement': 150,
+            'shiftMaker': 1,
+            'shiftTaker': 1,
+            'tradeHeight': self.block_height,
+            'txHash': f'{self._rnd.getrandbits(256):064x}',
+            'txOutputIndex': 0,
+        }
+
+    def _refresh_binance_book(self) -> None:
+        bids = sorted((self._price_around_mid(True) for _ in range(self.depth)), reverse=True)
+        asks = sorted(self._price_around_mid(False) for _ in range(self.depth))
+        self.binance_bids = [[str(price), str(self._quantity())] for price in bids]
+        self.binance_asks = [[str(price), str(self._quantity())] for price in asks]
+
+    def update(self) -> None:
+        with self.lock:
+            self.updates += 1
+            step = Decimal(self._rnd.randint(-10, 10)) / 10000
+            self.mid_price = (self.mid_price * (1 + step)).quantize(PRICE_PRECISION)
+
+            if self.updates % 2:
+                replaced = max(1, int(len(self.borderless_orders) * self.churn))
+                for index in self._rnd.sample(range(len(self.borderless_orders)), replaced):
+                    self.borderless_orders[index] = self._make_borderless_order()
+                self.updated_at['borderless'] = time.time()
+            else:
+                self._refresh_binance_book()
+                self.updated_at['binance'] = time.time()
+
+            if self.updates % self.updates_per_block == 0:
+                self.block_height += 1
+
+            self._fill_orders()
+
+    def _fill_orders(self) -> None:
+        for order in self.taker_orders.values():
+            if order['status'] == 'NEW':
+                order['status'] = 'FILLED'
+
+        for tx_hash, order in list(self.maker_orders.items()):
+            if tx_hash in self.listed_maker_orders and self._rnd.random() < self.fill_rate:
+                del self.maker_orders[tx_hash]
+                self.listed_maker_orders.discard(tx_hash)
+                self.matched_orders.append({'maker': order, 'taker': self._make_borderless_order()})
+
+    async def run(self, updates_per_sec: float) -> None:
+        """
+        Update the books at a fixed rate until cancelled, a slow event loop
+        catches up instead of drifting
+        """
+        interval = 1 / updates_per_sec
+        next_update = time.monotonic()
+        while True:
+            self.update()
+            next_update += interval
+            await asyncio.sleep(max(0, next_update - time.monotonic()))
+
+    def next_id(self) -> int:
+        self._next_id += 1
+        return self._next_id
+
+    def add_maker_order(self, order: Dict[str, Any]) -> Dict[str, Any]:
+        order = dict(order)
+        order.update({
+            'txHash': f'{self._rnd.getrandbits(256):064x}',
+            'txOutputIndex': 0,
+            'tradeHeight': self.block_height,
+            'settlement': 150,
+            'deposit': 100,
+            'base': 2,
+            'fixedUnitFee': '0',
+            'doubleHashedBcAddress': '0x74a9ab94273274e627bb17ec9b18af81f48646a2b62ab58afde3bab11bda9676',
+            'isSettled': False,
+        })
+        with self.lock:
+            self.maker_orders[order['txHash']] = order
+        return order
+
+    def add_taker_order(self, symbol: str, side: str, price: str, quantity: str) -> Dict[str, Any]:
+        with self.lock:
+            order_id = self.next_id()
+            order = {
+                'symbol': symbol,
+                'orderId': order_id,
+                'price': price,
+                'origQty': quantity,
+                'executedQty': '0',
+                'status': 'NEW',
+                'type': 'LIMIT',
+                'side': side,
+                'timeInForce': 'GTC',
+                'transactTime': int(time.time() * 1000),
+            }
+            self.taker_orders[order_id] = order
+        return order
+
+    def get_taker_order(self, order_id: int) -> Optional[Dict[str, Any]]:
+        return self.taker_orders.get(order_id)
@@ -0,0 +1,53 @@
+"""
+Timings of the start of the bot
+
+The start is timed phase by phase, from the import of this module (the
+first one mmm_bot.py imports) to the end of the first tick of the strategy,
+the one quoting on the first books of both exchanges. The timings are logged
+after the first tick, as a warning over STARTUP_BUDGET seconds.
+
+The import times module by module are printed on stderr by python with
+PYTHONPROFILEIMPORTTIME=1 (python -X importtime).
+"""
+import logging
+import time
+from typing import List, Tuple
+
+LOGGER = logging.getLogger('market_maker_bot.startup')
+
+STARTED = time.monotonic()
+STARTUP_BUDGET = 10 # in seconds, to the end of the first tick
+
+
+class StartupTimer:
+
+    def __init__(self, started: float = STARTED):
+        self._started = started
+        self._last = started
+        # the phases in order with their durations in seconds
+        self.phases: List[Tuple[str, float]] = []
+
+    def mark(self, phase: str) -> None:
+        """
+        The phase ended now, it started at the end of the previous one
+        """
+        now = time.monotonic()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    @property
+    def total(self) -> float:
+        return self._last - self._started
+
+    def report(self) -> str:
+        lines = [f'  {phase}: {duration:.3f}s' for phase, duration in self.phases]
+        return '\n'.join(lines + [f'  total: {self.total:.3f}s'])
+
+    def log(self, budget: float) -> None:
+        if self.total > budget:
+            LOGGER.warning('Started in %.3fs, over the budget of %ss:\n%s', self.total, budget, self.report())
+        else:
+            LOGGER.info('Started in %.3fs:\n%s', self.total, self.report())
+
+
+timer = StartupTimer()
@@ -1,9 +1,10 @@
+import asyncio
 import os
 import time
 import signal
 import logging
 import math
-from typing import List
+from typing import List, Optional, Set
 from decimal import Decimal, ROUND_CEILING, ROUND_DOWN
 import traceback
 
@@ -13,7 +14,11 @@ import aiopubsub
 from datetime import datetime
 
 from mm_bot.model.order_fill_watcher import OrderFillWatcher
-from mm_bot.model.constants import Status
+from mm_bot.model.order_store import OrderStore
+from mm_bot.model.journal import Journal, encode_book
+from mm_bot.model.outbox import OutboxWorker, exchange_handlers
+from mm_bot.model.poller import ORDERS_PLACED
+from mm_bot.model.constants import JournalEvent, Status
 
 from mm_bot.model.order import MakerOrder, TakerOrder
 from mm_bot.model.constants import OrderType
@@ -21,6 +26,7 @@ from mm_bot.model.currency import CurrencyPair
 from mm_bot.model.book import OrderBook
 from mm_bot.model.repository import OrderRepository
 from mm_bot.config import config
+from mm_bot.config.settings import Settings
 
 
 class CrossMarketStrategy:
@@ -28,7 +34,8 @@ class CrossMarketStrategy:
 
     def __init__(self, hub: aiopubsub.Hub, repository: OrderRepository, taker_exchange, maker_exchange, currency: CurrencyPair,
                  max_open_orders: int, min_profitability_rate: Decimal, max_qty_per_order: Decimal,
-                 cancel_order_threshold: Decimal, should_cancel_order: bool):
+                 cancel_order_threshold: Decimal, should_cancel_order: bool, journal: Optional[Journal] = None,
+                 settings: Optional[Settings] = None):
         self._logger = logging.getLogger(f'{self.__class__.__name__}({taker_exchange}, {maker_exchange}, {currency})')
         self._hub = hub
         self._repository = repository
@@ -40,40 +47,147 @@ class CrossMarketStrategy:
         self._cancel_order_threshold = cancel_order_threshold
         self._should_cancel_order = should_cancel_order
         self._min_profitability_rate = min_profitability_rate
+        # handed to the order fill watchers, see update_settings
+        self._settings = settings if settings is not None else Settings.from_config()
         self._loop = aiopubsub.loop.Loop(self._run, delay=CrossMarketStrategy.HEARTBEAT_DELAY)
         self._subscriber = aiopubsub.Subscriber(self._hub, 'cross_market_strategy')
+        self._publisher = aiopubsub.Publisher(self._hub, 'cross_market_strategy')
+        # the events of the strategy for a fast restart, see mm_bot.model.journal
+        self._journal = journal
+        # the live orders, shared with the order fill watchers
+        self._store = OrderStore(
+            repository,
+            config('order_store_flush_interval', parser=float),
+            config('order_store_batch_size', parser=int),
+            journal,
+        )
         self._order_fill_watchers: List[OrderFillWatcher] = []
+        self._outbox_worker = OutboxWorker(
+            repository,
+            exchange_handlers({exchange.name: exchange for exchange in (taker_exchange, maker_exchange)}),
+            config('outbox_concurrency', parser=int),
+            config('outbox_max_attempts', parser=int),
+            config('outbox_backoff', parser=float),
+            config('outbox_delay', parser=float),
+        )
         self._taker_order_book = None
         self._maker_order_book = None
+        # the first tick runs on the books of the journal instead of waiting for the exchanges
+        self._restored_tick = False
+        # the first tick waits for the books of both exchanges, at most first_books_timeout seconds
+        self._first_books_timeout = config('first_books_timeout', parser=float)
+        # set once the first tick ran, see mm_bot.startup
+        self.first_tick = asyncio.Event()
+        # the filled maker orders whose hedges were sent but not acknowledged before a restart
+        self._unacked_hedges: Set[int] = set()
+        self._reconcile_task: Optional[asyncio.Future] = None
 
     def start(self) -> None:
         self._logger.info('strategy start called')
         self._subscriber.subscribe(('*', 'exchange', 'new_best'))
+        if self._journal is not None:
+            self._restore()
+            self._journal.start()
 
         self.maker_exchange.start()
         self.taker_exchange.start()
         # TODO move fill watchers to exchanges
 
-        taker_exchange_watcher = OrderFillWatcher(self._repository, self.taker_exchange, self.maker_exchange)
+        self._store.start()
+
+        taker_exchange_watcher = OrderFillWatcher(self._store, self.taker_exchange, self.maker_exchange, self._hub, self._settings)
         taker_exchange_watcher.start()
 
-        maker_exchange_watcher = OrderFillWatcher(self._repository, self.maker_exchange, self.maker_exchange)
+        maker_exchange_watcher = OrderFillWatcher(self._store, self.maker_exchange, self.maker_exchange, self._hub, self._settings)
         maker_exchange_watcher.start()
 
         self._order_fill_watchers.append(taker_exchange_watcher)
         self._order_fill_watchers.append(maker_exchange_watcher)
 
+        # the transfers and unlocks enqueued by the watchers
+        self._outbox_worker.start()
+
         self._loop.start()
 
+    def update_settings(self, settings: Settings) -> None:
+        """
+        The reloaded settings for the strategy, the exchanges and the
+        watchers, swapped at once between two ticks
+        """
+        self._logger.info('settings reloaded')
+        self._settings = settings
+        self._max_open_orders = settings.max_open_orders
+        self._max_qty_per_order = settings.max_qty_per_order
+        self._cancel_order_threshold = settings.cancel_order_threshold
+        self._should_cancel_order = settings.should_cancel_order
+        self._min_profitability_rate = settings.min_profitability_rate
+        for holder in [self.taker_exchange, self.maker_exchange] + self._order_fill_watchers:
+            holder.settings = settings
+
     async def stop(self) -> None:
         self._logger.info('stopping')
         for watcher in self._order_fill_watchers:
             await watcher.stop()
+        await self._outbox_worker.stop()
 
         # maker doesn't need stopping
         self._logger.info('Stopping taker exchange')
         await self.taker_exchange.stop()
         await self._loop.stop_wait()
+        # the last changes of the watchers and the strategy are flushed
+        await self._store.stop()
+        if self._reconcile_task is not None and not self._reconcile_task.done():
+            self._reconcile_task.cancel()
+        if self._journal is not None:
+            await self._journal.stop()
+
+    def _restore(self) -> None:
+        """
+        The books, the exchange snapshots and the unacknowledged hedges of the
+        journal, the exchanges are reconciled in the background
+        """
+        state = self._journal.restore()
+        max_age = config('journal_max_book_age', parser=float)
+        self._taker_order_book = state.book(self.taker_exchange.name, max_age)
+        self._maker_order_book = state.book(self.maker_exchange.name, max_age)
+        self._restored_tick = self._taker_order_book is not None and self._maker_order_book is not None
+
+        for exchange in (self.taker_exchange, self.maker_exchange):
+            if hasattr(exchange, 'snapshot'):
+                self._journal.add_snapshot_source(exchange.name, exchange.snapshot)
+            if hasattr(exchange, 'restore') and exchange.name in state.exchanges:
+                exchange.restore(state.exchanges[exchange.name])
+
+        self._unacked_hedges = set(
+            value['request']['maker_order_id'] for value in state.unacked.values()
+            if value['exchange'] == self.taker_exchange.name
+        )
+        self._logger.info('Restored from the journal, books: %s, unacknowledged hedges: %s',
+                          self._restored_tick, self._unacked_hedges)
+        if self._unacked_hedges:
+            self._reconcile_task = asyncio.ensure_future(self._reconcile())
+
+    async def _reconcile(self) -> None:
+        """
+        A hedge written in the db was acknowledged, the others may be open on
+        the taker exchange and are not sent again, for a human to check
+        """
+        await self._store.ensure_loaded()
+        self._unacked_hedges = set(i for i in self._unacked_hedges if not self._store.taker_orders_of(i))
+        if not self._unacked_hedges:
+            return
+
+        unknown = [
+            o.order_id for o in await self.taker_exchange.get_open_orders()
+            if self._store.get_by_order_id(o.order_id) is None
+        ]
+        self._logger.error('Hedges of maker orders %s were sent before the restart and not acknowledged, '
+                           'open orders of %s not in the db: %s',
+                           self._unacked_hedges, self.taker_exchange.name, unknown)
+
+    def _journal_event(self, kind: str, data: dict) -> None:
+        if self._journal is not None:
+            self._journal.append(kind, data)
 
     async def _run(self) -> None:
         """
@@ -83,23 +197,44 @@ class CrossMarketStrategy:
         all conditions and adjust orders accordingly
         """
         error = ''
+        maker_exchange_balance = None
         try:
             self._logger.debug('loop tick')
-            key, value = await self._subscriber.consume()
-            self._logger.debug(f'Consuming {key}')
+            if self._restored_tick:
+                self._restored_tick = False
+                self._logger.info('First tick on the books of the journal')
+            elif not self.first_tick.is_set():
+                # one tick on the books of both exchanges instead of one per book, the balance fetched meanwhile
+                balance = asyncio.ensure_future(self.maker_exchange.get_account_balance())
+                try:
+                    await asyncio.wait_for(self._consume_first_books(), self._first_books_timeout)
+                except asyncio.TimeoutError:
+                    self._logger.warning('Books missing after %ss, first tick on the books received', self._first_books_timeout)
+                maker_exchange_balance = await balance
+            else:
+                key, value = await self._subscriber.consume()
+                self._logger.debug(f'Consuming {key}')
 
-            exchange, _, what = key
-            self._logger.debug(f'{exchange} published {what}')
+                exchange, _, what = key
+                self._logger.debug(f'{exchange} published {what}')
 
-            if what == 'new_best':
-                self._update_order_book(exchange, value)
+                if what == 'new_best':
+                    self._update_order_book(exchange, value)
 
-            await self._recalculate_and_recreate_orders()
+            await self._recalculate_and_recreate_orders(maker_exchange_balance)
         except:
             error = traceback.format_exc()
             self._logger.info('Transient error in the run loop, it will continue next run', exc_info=True)
         finally:
             self._heartbeat(error)
+            self.first_tick.set()
+
+    async def _consume_first_books(self) -> None:
+        while self._taker_order_book is None or self._maker_order_book is None:
+            key, value = await self._subscriber.consume()
+            exchange, _, what = key
+            if what == 'new_best':
+                self._update_order_book(exchange, value)
 
     def _heartbeat(self, error):
         utc_now = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
@@ -113,6 +248,7 @@ class CrossMarketStrategy:
             f.write(s)
 
     def _update_order_book(self, exchange: str, value: OrderBook) -> None:
+        self._journal_event(JournalEvent.BOOK, {'exchange': exchange, 'book': encode_book(value)})
         if exchange == self.taker_exchange.name:
             self._logger.debug('Updating exchange %s with new OB', exchange)
             self._taker_order_book = value
@@ -121,8 +257,9 @@ class CrossMarketStrategy:
             self._logger.debug('Updating exchange %s with new OB', exchange)
             self._maker_order_book = value
 
-    async def _recalculate_and_recreate_orders(self):
-        maker_exchange_balance = await self.maker_exchange.get_account_balance()
+    async def _recalculate_and_recreate_orders(self, maker_exchange_balance=None):
+        if maker_exchange_balance is None:
+            maker_exchange_balance = await self.maker_exchange.get_account_balance()
 
         if maker_exchange_balance['confirmed'] == Decimal('0'):
             self._logger.info('No NRG in borderless, will not create orders. balance data: %s', {key: str(val) for key, val in maker_exchange_balance.items()})
@@ -187,7 +324,12 @@ class CrossMarketStrategy:
             order['bid_nrg_rate'] = bid_nrg_rate
 
         orders_to_open = sorted(orders_to_open, key=lambda o: o['profit'], reverse=True)
+        self._journal_event(JournalEvent.DECISION, {'exchange': self.maker_exchange.name, 'orders': orders_to_open})
         self._logger.info('Create. attempt to create maker orders: %s', orders_to_open)
+        # the maker orders sent are found on the exchange by the order fill watcher, not tracked by key
+        self._journal_event(JournalEvent.SENT, {
+            'exchange': self.maker_exchange.name, 'keys': [None] * len(orders_to_open), 'requests': orders_to_open,
+        })
         results = await self.maker_exchange.create_orders(orders_to_open)
         self._logger.info('Create. result: %s', results)
 
@@ -215,7 +357,13 @@ class CrossMarketStrategy:
             created_maker_orders.append(o)
 
         self._logger.info('Persisted %s maker orders in the db', len(created_maker_orders))
-        await self._repository.create_orders(created_maker_orders)
+        await self._store.add(created_maker_orders)
+        self._journal_event(JournalEvent.ACK, {
+            'exchange': self.maker_exchange.name, 'keys': [], 'ids': [o.id for o in created_maker_orders],
+        })
+        if created_maker_orders:
+            # wakes up the order fill watcher of the maker exchange
+            self._publisher.publish(ORDERS_PLACED, self.maker_exchange.name)
 
     async def create_hedge_orders_in_taker(self):
         """
@@ -227,19 +375,26 @@ class CrossMarketStrategy:
 
         if not self._taker_order_book:
             self._logger.debug('not received taker OB yet - nothing to do in create_hedge_orders_in_taker')
-        filled_maker_orders = await self._repository.get_filled_orders('maker')
+        await self._store.ensure_loaded()
+        filled_maker_orders = self._store.orders('maker', Status.FILLED)
         if len(filled_maker_orders) == 0:
             self._logger.info('create_hedge_orders_in_taker() check ended - no filled maker orders')
             return
 
-        filled_maker_order_ids = set([o.id for o in filled_maker_orders])
-        for order in await self._repository.get_taker_orders_by_maker_id(filled_maker_order_ids):
-            filled_maker_order_ids.discard(order.maker_order_id)
+        filled_maker_order_ids = set([o.id for o in filled_maker_orders if not self._store.taker_orders_of(o.id)])
 
         if len(filled_maker_order_ids) == 0:
             self._logger.info('No filled maker orders reported, nothing to do in create_hedge_orders_in_taker')
             return
 
+        unacked = filled_maker_order_ids & self._unacked_hedges
+        if unacked:
+            self._logger.warning('Not hedging maker orders %s, their hedges were sent before the restart '
+                                 'and not acknowledged', unacked)
+            filled_maker_order_ids -= unacked
+            if len(filled_maker_order_ids) == 0:
+                return
+
         self._logger.info('Load filled maker orders: %s', filled_maker_order_ids)
         order_book_in_taker_exchange = self._taker_order_book
         orders_to_open = []
@@ -250,6 +405,14 @@ class CrossMarketStrategy:
                 )
 
         self._logger.info('Create. attempt to create taker orders: %s', orders_to_open)
+        # a hedge sent and not acknowledged is not sent again after a restart
+        hedge_keys = [f'hedge:{o["maker_order_id"]}' for o in orders_to_open]
+        self._journal_event(JournalEvent.SENT, {
+            'exchange': self.taker_exchange.name, 'keys': hedge_keys, 'requests': orders_to_open,
+        })
+        if self._journal is not None:
+            # on disk before the hedges are sent
+            await self._journal.flush()
         orders_to_open_res = await self.taker_exchange.create_orders(orders_to_open)
 
         created_taker_orders = []
@@ -268,7 +431,12 @@ class CrossMarketStrategy:
             )
             created_taker_orders.append(o)
 
-        await self._repository.create_orders(created_taker_orders)
+        await self._store.add(created_taker_orders)
+        self._journal_event(JournalEvent.ACK, {
+            'exchange': self.taker_exchange.name, 'keys': hedge_keys, 'ids': [o.id for o in created_taker_orders],
+        })
+        if created_taker_orders:
+            self._publisher.publish(ORDERS_PLACED, self.taker_exchange.name)
 
     def construct_taker_order_request(self, maker_order, taker_order_book):
         """
@@ -0,0 +1,56 @@
+import json
+
+import aiopubsub
+import pytest
+
+from mm_bot.memory_monitor import MemoryMonitor, count_objects, get_rss_bytes
+from mm_bot.model.book import OrderBook
+
+
+def test_count_objects():
+    books = [OrderBook([], [], 0, 0) for _ in range(3)]
+
+    counts = count_objects()
+    assert counts['OrderBook'] >= len(books)
+    assert counts['MakerOrder'] == 0
+
+
+@pytest.mark.asyncio
+async def test_sample_and_export(tmp_path):
+    stats_file = tmp_path / 'memory_stats.jsonl'
+    hub = aiopubsub.Hub()
+    monitor = MemoryMonitor(hub, 60, stats_file=str(stats_file))
+
+    stats = monitor.sample()
+    assert stats['rss_bytes'] > 0
+    assert stats['asyncio_tasks'] >= 1
+    assert not monitor.is_over_limit(stats)
+
+    await monitor._run()
+    exported = json.loads(stats_file.read_text().splitlines()[-1])
+    assert set(exported.keys()) == set(stats.keys())
+
+
+@pytest.mark.asyncio
+async def test_stats_file_capped(tmp_path):
+    stats_file = tmp_path / 'memory_stats.jsonl'
+    stats_file.write_text('{"timestamp": 0}\n' * 5)
+    monitor = MemoryMonitor(aiopubsub.Hub(), 60, stats_file=str(stats_file), max_samples=3)
+
+    await monitor._run()
+    lines = stats_file.read_text().splitlines()
+    assert len(lines) == 3
+    assert json.loads(lines[-1])['timestamp'] > 0
+
+    for _ in range(3):
+        await monitor._run()
+    assert len(stats_file.read_text().splitlines()) == 3
+
+
+@pytest.mark.asyncio
+async def test_exit_when_over_limit():
+    monitor = MemoryMonitor(aiopubsub.Hub(), 60, rss_limit_mb=1, stats_file=None)
+    assert get_rss_bytes() > 1024 * 1024
+
+    with pytest.raises(SystemExit):
+        await monitor._run()
@@ -0,0 +1,56 @@
+import os
+import time
+import tracemalloc
+
+import pytest
+
+from mm_bot import helpers, profiling
+
+
+def _busy_wait(seconds):
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        pass
+
+
+def test_sampling_profiler_collects_collapsed_stacks():
+    profiler = profiling.SamplingProfiler(interval=0.001)
+    profiler.start()
+    _busy_wait(0.1)
+    stacks = profiler.stop()
+
+    assert sum(stacks.values()) > 0
+    assert any('_busy_wait' in stack for stack in stacks)
+
+
+@pytest.mark.asyncio
+async def test_handle_profile_request(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILES_FILE_PATTERN', f'{tmp_path}/profile-')
+
+    path = await profiling.handle_profile_request({'mode': 'memory'})
+    tracemalloc.stop()
+    assert path.startswith(f'{tmp_path}/profile-')
+    assert path.endswith('-memory.txt')
+
+    path = await profiling.handle_profile_request({'mode': 'sample', 'duration': 1})
+    assert path.endswith('-sample.collapsed')
+
+    assert await profiling.handle_profile_request({'mode': 'unknown'}) is None
+
+
+def test_profile_request_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(helpers, 'CONFIG_DIR', str(tmp_path))
+    assert helpers.pop_profile_request('cross_market') is None
+
+    helpers.signal_profile_requested('cross_market', 'cpu', 10)
+    assert os.listdir(tmp_path) == ['cross_market.profile']
+    assert helpers.pop_profile_request('cross_market') == {'mode': 'cpu', 'duration': 10}
+    assert helpers.pop_profile_request('cross_market') is None
+
+    # not parsed, kept for the next poll
+    with open(helpers.profile_request_file('cross_market'), 'w') as f:
+        f.write('{"mode": "cp')
+    assert helpers.pop_profile_request('cross_market') is None
+    assert os.listdir(tmp_path) == ['cross_market.profile']
+    helpers.drop_profile_request('cross_market')
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,67 @@
+import aiohttp
+import pytest
+
+from mm_bot.model.currency import CurrencyPair
+from mm_bot.simulation.fake_binance import FakeBinance
+from mm_bot.simulation.market import Faults, SimulatedError, SimulatedMarket
+
+
+def test_market_update_churns_books():
+    market = SimulatedMarket(CurrencyPair('LSK', 'BTC'), depth=10, churn=0.5, updates_per_block=2, seed=1)
+    borderless_orders = list(market.borderless_orders)
+    binance_bids = market.binance_bids
+
+    market.update()
+    assert market.borderless_orders != borderless_orders
+    assert market.binance_bids == binance_bids
+
+    market.update()
+    assert market.binance_bids != binance_bids
+    assert market.block_height == 2
+    assert [float(bid[0]) for bid in market.binance_bids] == sorted((float(bid[0]) for bid in market.binance_bids), reverse=True)
+
+
+def test_market_fills_own_orders():
+    market = SimulatedMarket(CurrencyPair('LSK', 'BTC'), fill_rate=1, seed=1)
+    maker_order = market.add_maker_order({'sendsUnit': '1', 'receivesUnit': '0.0001'})
+    taker_order = market.add_taker_order('LSKBTC', 'SELL', '0.0001', '1')
+
+    # not matched before the bot listed it in the open orders
+    market.update()
+    assert list(market.maker_orders) == [maker_order['txHash']]
+
+    market.listed_maker_orders.add(maker_order['txHash'])
+    market.update()
+    assert market.maker_orders == {}
+    assert market.matched_orders[0]['maker']['txHash'] == maker_order['txHash']
+    assert market.get_taker_order(taker_order['orderId'])['status'] == 'FILLED'
+
+
+@pytest.mark.asyncio
+async def test_faults_error_rate():
+    with pytest.raises(SimulatedError):
+        await Faults(error_rate=1).inject(SimulatedMarket(CurrencyPair('LSK', 'BTC'))._rnd, 'test')
+
+
+@pytest.mark.asyncio
+async def test_fake_binance_serves_market():
+    market = SimulatedMarket(CurrencyPair('LSK', 'BTC'), depth=5)
+    fake_binance = FakeBinance(market)
+    await fake_binance.start()
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f'{fake_binance.url}/api/v1/depth', params={'symbol': 'LSKBTC'}) as response:
+                depth = await response.json()
+            assert depth['bids'] == market.binance_bids
+
+            async with session.post(f'{fake_binance.url}/api/v3/order',
+                                    data={'symbol': 'LSKBTC', 'side': 'BUY', 'price': '0.0001', 'quantity': '1'}) as response:
+                order = await response.json()
+
+            async with session.get(f'{fake_binance.url}/api/v3/order', params={'orderId': order['orderId']}) as response:
+                assert (await response.json())['status'] == 'NEW'
+
+            async with session.get(f'{fake_binance.url}/api/v3/ticker/price', params={'symbol': 'BTCUSDT'}) as response:
+                assert (await response.json())['price'] == '10000'
+    finally:
+        await fake_binance.stop()
@@ -1,3 +1,6 @@
+# first, the start is timed from here
+from mm_bot.startup import STARTUP_BUDGET, timer
+
 import asyncio
 import logging
 import logging.handlers
@@ -5,13 +8,15 @@ import os
 import subprocess
 import sys
 import time
-from decimal import Decimal
+from datetime import timedelta
 
 import aiopubsub
 import everett
 
 from mm_bot.config import config
 from mm_bot.config import validator
+from mm_bot.config.reloader import ConfigReloader
+from mm_bot.config.settings import Settings
 from mm_bot.model import constants
 from mm_bot.model.currency import CurrencyPair
 from mm_bot.model.repository import OrderRepository
@@ -19,23 +24,25 @@ from mm_bot.strategy.cross_market import CrossMarketStrategy
 from mm_bot.exchange.maker.borderless import Borderless
 from mm_bot.exchange.taker.binance import Binance
 from mm_bot import helpers
-
-LOGLEVEL = logging.getLevelName(os.environ.get('MMBC_LOGLEVEL', 'INFO').upper())
-root_logger = logging.getLogger()
-root_logger.setLevel(LOGLEVEL)
-# 20 MB
-fh = logging.handlers.RotatingFileHandler(f'{helpers.LOGS_FILE_PATTERN}{int(time.time())}', mode='a', maxBytes=20971520, backupCount=50)
-fh.setLevel(LOGLEVEL)
-ch = logging.StreamHandler()
-ch.setLevel(LOGLEVEL)
-# create formatter and add it to the handlers
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-fh.setFormatter(formatter)
-ch.setFormatter(formatter)
-root_logger.addHandler(fh)
-root_logger.addHandler(ch)
-
-logging.getLogger("everett").setLevel(logging.WARNING)
+from mm_bot.model.journal import Journal
+
+def setup_logging():
+    LOGLEVEL = logging.getLevelName(os.environ.get('MMBC_LOGLEVEL', 'INFO').upper())
+    root_logger = logging.getLogger()
+    root_logger.setLevel(LOGLEVEL)
+    # 20 MB
+    fh = logging.handlers.RotatingFileHandler(f'{helpers.LOGS_FILE_PATTERN}{int(time.time())}', mode='a', maxBytes=20971520, backupCount=50)
+    fh.setLevel(LOGLEVEL)
+    ch = logging.StreamHandler()
+    ch.setLevel(LOGLEVEL)
+    # create formatter and add it to the handlers
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    fh.setFormatter(formatter)
+    ch.setFormatter(formatter)
+    root_logger.addHandler(fh)
+    root_logger.addHandler(ch)
+
+    logging.getLogger("everett").setLevel(logging.WARNING)
 
 LOGGER = logging.getLogger('market_maker_bot.main')
 
@@ -48,6 +55,44 @@ async def timeout_to_reclaim_memory():
     LOGGER.info('Register timeout with value: %s', timeout_value)
     await asyncio.sleep(timeout_value)
 
+MEMORY_MONITOR_INTERVAL = 5 * 60 # in seconds
+def register_memory_monitor(hub):
+    """
+    ENGINE_RSS_LIMIT_MB replaces the blind timeout by exiting only once the RSS grows over the limit
+    """
+    from mm_bot.memory_monitor import MAX_SAMPLES, MemoryMonitor
+
+    rss_limit_mb = os.environ.get('ENGINE_RSS_LIMIT_MB')
+    monitor = MemoryMonitor(
+        hub,
+        int(os.environ.get('MEMORY_MONITOR_INTERVAL', MEMORY_MONITOR_INTERVAL)),
+        top_n=int(os.environ.get('MEMORY_MONITOR_TOP_N', 10)),
+        trace_allocations=os.environ.get('MEMORY_MONITOR_TRACEMALLOC', 'false').lower() == 'true',
+        rss_limit_mb=int(rss_limit_mb) if rss_limit_mb else None,
+        max_samples=int(os.environ.get('MEMORY_MONITOR_MAX_SAMPLES', MAX_SAMPLES)),
+    )
+    monitor.start()
+    return monitor
+
+def register_order_archiver(order_repository):
+    """
+    MMBC_ARCHIVE_RETENTION_DAYS 0 keeps every order in the working tables
+    """
+    retention_days = config('archive_retention_days', parser=int)
+    if retention_days <= 0:
+        return None
+
+    from mm_bot.model.archive import OrderArchiver
+
+    archiver = OrderArchiver(
+        order_repository,
+        timedelta(days=retention_days),
+        config('archive_batch_size', parser=int),
+        config('archive_interval', parser=int),
+    )
+    archiver.start()
+    return archiver
+
 def exit_after_callback(fur):
     raise SystemExit(0)
 
@@ -56,79 +101,134 @@ def register_timeout(loop):
     future.add_done_callback(exit_after_callback)
     return future
 
-async def check_if_config_reloaded(strategy_name):
+def register_config_reloader(strategy):
+    """
+    The config saved by the web ui is swapped in without a restart, see mm_bot.config.reloader
+    """
+    LOGGER.info('Register reloading the config of strategy: %s', config('strategy_name', parser=str))
+    reloader = ConfigReloader(strategy)
+    reloader.start()
+    return reloader
+
+async def check_if_profile_requested(strategy_name):
+    # only imported once profiling is registered
+    from mm_bot import profiling
+
     while True:
-        if helpers.is_config_reloaded(strategy_name):
-            LOGGER.warning(f'Config of {strategy_name} was updated. Reloading MMM bot')
-            helpers.refresh_reloaded_config_done(strategy_name)
-            raise SystemExit(0)
+        request = helpers.pop_profile_request(strategy_name)
+        if request is not None:
+            LOGGER.info(f'Profile of {strategy_name} was requested: {request}')
+            # do not block the polling, so a memory snapshot can be taken while cpu profiling
+            asyncio.ensure_future(profiling.handle_profile_request(request))
 
         await asyncio.sleep(1)
 
-def register_checking_config(loop, strategy_name):
-    LOGGER.info('Register checking reloaded config for strategy: %s', strategy_name)
-    task = loop.create_task(check_if_config_reloaded(strategy_name))
+def register_profiling_hooks(loop, strategy_name):
+    LOGGER.info('Register profiling hooks for strategy: %s', strategy_name)
+    task = loop.create_task(check_if_profile_requested(strategy_name))
     return task
 
+async def log_startup(strategy: CrossMarketStrategy) -> None:
+    """
+    STARTUP_BUDGET in seconds to the end of the first tick, see mm_bot.startup
+    """
+    await strategy.first_tick.wait()
+    timer.mark('first_tick')
+    timer.log(float(os.environ.get('STARTUP_BUDGET', STARTUP_BUDGET)))
+
+def create_strategy(hub: aiopubsub.Hub, order_repository: OrderRepository, settings: Settings) -> CrossMarketStrategy:
+    """
+    Wire the exchanges and the strategy from the config
+    """
+    base = config('wallet_base_currency_name', parser=lambda s: str(s).upper())
+    if not constants.SupportedCurrency[base] in constants.SupportedCurrency:
+        LOGGER.warning(f'Unsupported base: {base}')
+
+    counter = config('wallet_counter_currency_name', parser=lambda s: str(s).upper())
+    if not constants.SupportedCounterCurrency[counter] in constants.SupportedCounterCurrency:
+        LOGGER.warning(f'Unsupported counter: {counter}')
+
+    if base == counter:
+        raise ValueError(f'base and counter has to be different, base: {base}, counter: {counter}')
+    currency = CurrencyPair(base, counter)
+
+    base_address = config('wallet_base_currency_wallet', parser=str)
+    counter_address = config('wallet_counter_currency_wallet', parser=str)
+    scookie = config('exchange_destination_miner_scookie', parser=str)
+    borderless = Borderless(
+            hub, currency,
+            config('exchange_destination_miner_address', parser=str),
+            scookie,
+            config('exchange_destination_nrg_public_key', parser=str),
+            config('exchange_destination_nrg_private_key', parser=str),
+            base_address,
+            counter_address,
+            settings,
+            )
+
+    binance = Binance(
+        hub, currency, settings.exchange_binance_loop_delay,
+        config('exchange_source_api_key', parser=str),
+        config('exchange_source_api_secret', parser=str),
+        settings,
+    )
+
+    # an empty MMBC_JOURNAL_DIR starts without the journal, waiting for the exchanges
+    journal = None
+    journal_dir = config('journal_dir', parser=str)
+    if journal_dir:
+        journal = Journal(
+            journal_dir,
+            config('journal_fsync_interval', parser=float),
+            config('journal_snapshot_events', parser=int),
+        )
+
+    strategy = CrossMarketStrategy(
+            hub, order_repository, binance, borderless, currency,
+            settings.max_open_orders,
+            settings.min_profitability_rate,
+            settings.max_qty_per_order,
+            settings.cancel_order_threshold,
+            settings.should_cancel_order,
+            journal,
+            settings,
+            )
+    return strategy
+
 def main(loop: asyncio.AbstractEventLoop) -> None:
     strategy_name = config('strategy_name', parser=str)
     LOGGER.info(f'Start with strategy: {strategy_name}')
 
-    check_config_task = None
-    if os.environ.get('REGISTER_CHECK_CONFIG', 'false').lower() == 'true':
-        check_config_task = register_checking_config(loop, strategy_name)
-
     timeout_task = None
     if os.environ.get('REGISTER_TIMEOUT', 'false').lower() == 'true':
         timeout_task = register_timeout(loop)
 
+    profiling_task = None
+    if os.environ.get('REGISTER_PROFILING', 'false').lower() == 'true':
+        profiling_task = register_profiling_hooks(loop, strategy_name)
+
+    memory_monitor = None
+    order_archiver = None
+    config_reloader = None
     try:
         strategy = None
         hub = aiopubsub.Hub()
 
+        if os.environ.get('REGISTER_MEMORY_MONITOR', 'false').lower() == 'true':
+            memory_monitor = register_memory_monitor(hub)
+
         url = config('database_url', parser=str)
         order_repository = OrderRepository(url)
 
-        base = config('wallet_base_currency_name', parser=lambda s: str(s).upper())
-        if not constants.SupportedCurrency[base] in constants.SupportedCurrency:
-            LOGGER.warning(f'Unsupported base: {base}')
-
-        counter = config('wallet_counter_currency_name', parser=lambda s: str(s).upper())
-        if not constants.SupportedCounterCurrency[counter] in constants.SupportedCounterCurrency:
-            LOGGER.warning(f'Unsupported counter: {counter}')
-
-        if base == counter:
-            raise ValueError(f'base and counter has to be different, base: {base}, counter: {counter}')
-        currency = CurrencyPair(base, counter)
-
-        base_address = config('wallet_base_currency_wallet', parser=str)
-        counter_address = config('wallet_counter_currency_wallet', parser=str)
-        scookie = config('exchange_destination_miner_scookie', parser=str)
-        borderless = Borderless(
-                hub, currency,
-                config('exchange_destination_miner_address', parser=str),
-                scookie,
-                config('exchange_destination_nrg_public_key', parser=str),
-                config('exchange_destination_nrg_private_key', parser=str),
-                base_address,
-                counter_address
-                )
-
-        binance = Binance(
-            hub, currency, config('exchange_binance_loop_delay', parser=int),
-            config('exchange_source_api_key', parser=str),
-            config('exchange_source_api_secret', parser=str)
-        )
-
-        strategy = CrossMarketStrategy(
-                hub, order_repository, binance, borderless, currency,
-                config('max_open_orders', parser=int),
-                config('min_profitability_rate', parser=Decimal),
-                config('max_qty_per_order', parser=Decimal),
-                config('cancel_order_threshold', parser=Decimal),
-                config('should_cancel_order', parser=bool),
-                )
+        settings = Settings.from_config()
+        settings.log(LOGGER)
+        strategy = create_strategy(hub, order_repository, settings)
         strategy.start()
+        if os.environ.get('REGISTER_CHECK_CONFIG', 'false').lower() == 'true':
+            config_reloader = register_config_reloader(strategy)
+        order_archiver = register_order_archiver(order_repository)
+        timer.mark('wiring')
+        asyncio.ensure_future(log_startup(strategy))
         loop.run_forever()
     except KeyboardInterrupt:
         LOGGER.debug('Interrupt received, stopping')
@@ -138,13 +238,19 @@ def main(loop: asyncio.AbstractEventLoop) -> None:
     except:
         LOGGER.exception('Exception in main loop')
     finally:
+        if config_reloader is not None:
+            loop.run_until_complete(config_reloader.stop())
         if strategy is not None:
             loop.run_until_complete(strategy.stop())
+        if order_archiver is not None:
+            loop.run_until_complete(order_archiver.stop())
+        if memory_monitor is not None:
+            loop.run_until_complete(memory_monitor.stop())
         if timeout_task is not None and not timeout_task.done():
             timeout_task.cancel()
 
-        if check_config_task is not None and not check_config_task.done():
-            check_config_task.cancel()
+        if profiling_task is not None and not profiling_task.done():
+            profiling_task.cancel()
 
         # find all futures/tasks still running and wait for them to finish
         pending_tasks = [
@@ -156,14 +262,20 @@ def main(loop: asyncio.AbstractEventLoop) -> None:
         # loop.close()
 
 
-def _check_nodejs_presence_and_version():
-    # TODO test: result = subprocess.run(['/bin/bash', '-s', '-c',  'echo v8.12.8'], capture_output = True)
-    result = subprocess.run(['/usr/bin/env', 'node', '--version'], capture_output = True)
-    if result.returncode != 0:
+def _start_nodejs_version_check() -> subprocess.Popen:
+    """
+    node starts while the config is validated
+    """
+    # TODO test: subprocess.Popen(['/bin/bash', '-s', '-c',  'echo v8.12.8'], ...)
+    return subprocess.Popen(['/usr/bin/env', 'node', '--version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+def _check_nodejs_presence_and_version(node_check: subprocess.Popen):
+    stdout, _ = node_check.communicate()
+    if node_check.returncode != 0:
         LOGGER.error('Could not find nodejs binary (using /usr/bin/env node --version)')
         sys.exit(1)
 
-    raw_output = result.stdout.decode('ascii')
+    raw_output = stdout.decode('ascii')
     try:
         version = raw_output.strip().split('v')[1]
         [major, minor, _] = version.split('.')
@@ -178,13 +290,20 @@ def _check_nodejs_presence_and_version():
 
 
 if __name__ == '__main__':
+    timer.mark('imports')
+    node_check = _start_nodejs_version_check()
+    setup_logging()
     validator.validate()
 
-    _check_nodejs_presence_and_version()
-
     strategy_name = config('strategy_name', parser=str)
     if helpers.is_config_reloaded(strategy_name):
         helpers.refresh_reloaded_config_done(strategy_name)
+    # drop requests left over from the previous run
+    helpers.drop_profile_request(strategy_name)
+    timer.mark('config')
+
+    _check_nodejs_presence_and_version(node_check)
+    timer.mark('nodejs')
 
     loop = asyncio.get_event_loop()
     main(loop)
@@ -0,0 +1,535 @@
+"""
+Benchmarks of the hot paths
+
+In the root dir of the project:
+
+    poetry run python -m scripts.bench                     # run all, compare with the baseline if it exists
+    poetry run python -m scripts.bench --save-baseline     # store the results as the new baseline
+    poetry run python -m scripts.bench --only repository --full --tolerance 0.1
+
+Each benchmark is timed as the best of `--repeat` runs, the results are written
+as json. Exits with 1 when any benchmark is slower than the baseline by more
+than the tolerance.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, List, Tuple, Union
+
+# benchmarks have to hit the real parsing paths, not the dry run shortcuts
+os.environ.setdefault('MMBC_DRY_RUN', 'false')
+
+from mm_bot.model.book import OrderBook, PriceLevel
+from mm_bot.model.currency import CurrencyPair
+from mm_bot.model.constants import Status, OrderType
+from mm_bot.model.order import MakerOrder, TakerOrder
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+DEFAULT_TOLERANCE = 0.25
+
+CURRENCY = CurrencyPair('LSK', 'BTC')
+
+Runner = Callable[[], Union[None, Awaitable[None]]]
+# a setup receives the size and returns the function to time and the number of operations it performs
+Setup = Callable[[int], Awaitable[Tuple[Runner, int]]]
+
+BENCHMARKS: List[Tuple[str, Tuple[int, ...], Tuple[int, ...], Setup]] = []
+# closed once all benchmarks are done, otherwise the sqlite worker threads keep the process alive
+_REPOSITORIES = []
+
+def benchmark(name: str, sizes: Tuple[int, ...] = (1, ), full_sizes: Tuple[int, ...] = ()):
+    """
+    sizes are always run, full_sizes only with --full
+    """
+    def decorator(setup: Setup) -> Setup:
+        BENCHMARKS.append((name, sizes, full_sizes, setup))
+        return setup
+    return decorator
+
+
+def make_borderless_order(i: int, rnd: random.Random) -> Dict[str, Any]:
+    """
+    An open order as returned by `get order_book` of the js cli, 1/4 of them are not in our pair
+    """
+    is_buy = rnd.random() < 0.5
+    receives_unit = str(Decimal(rnd.randint(1, 10000)) / 100)
+    sends_unit = str(Decimal(rnd.randint(1, 10000)) / 100000000)
+    pair = ('lsk', 'btc') if i % 4 else ('eth', 'btc')
+    sends_from_chain, receives_to_chain = (pair[1], pair[0]) if is_buy else pair
+    if not is_buy:
+        sends_unit, receives_unit = receives_unit, sends_unit
+
+    return {
+        'base': 2,
+        'collateralizedNrg': str(rnd.randint(1, 100)),
+        'deposit': 600,
+        'doubleHashedBcAddress': '0x74a9ab94273274e627bb17ec9b18af81f48646a2b62ab58afde3bab11bda9676',
+        'fixedUnitFee': '0',
+        'isSettled': False,
+        'nrgUnit': '1',
+        'receivesToAddress': '2570416870016743267L',
+        'receivesToChain': receives_to_chain.upper() if i % 2 else receives_to_chain,
+        'receivesUnit': receives_unit,
+        'sendsFromAddress': '1AJP6ck7XkhhTT7QTrn7U81UczmxgX3Azn',
+        'sendsFromChain': sends_from_chain,
+        'sendsUnit': sends_unit,
+        'settlement': 300,
+        'shiftMaker': 5,
+        'shiftTaker': 20,
+        'tradeHeight': 51 + i,
+        'txHash': f'{i:064x}',
+        'txOutputIndex': 0,
+    }
+
+
+def make_maker_order(i: int, rnd: random.Random, status: str = Status.OPEN) -> MakerOrder:
+    order_body = make_borderless_order(i, rnd)
+    order_type = OrderType.BUY if order_body['sendsFromChain'].lower() == 'btc' else OrderType.SELL
+    utc_now = datetime.utcnow()
+    return MakerOrder(
+        exchange='borderless',
+        status=status,
+        order_type=order_type,
+        currency=CURRENCY.to_currency(),
+        order_body=order_body,
+        tx_hash=order_body['txHash'],
+        tx_output_index=order_body['txOutputIndex'],
+        block_height=str(order_body['tradeHeight']),
+        taker_order_body={},
+        created_at=utc_now,
+        updated_at=utc_now,
+    )
+
+
+def make_taker_order(i: int, rnd: random.Random, maker_order_id: int, status: str = Status.OPEN) -> TakerOrder:
+    utc_now = datetime.utcnow()
+    return TakerOrder(
+        exchange='binance',
+        status=status,
+        order_type=rnd.choice([OrderType.BUY, OrderType.SELL]),
+        currency=CURRENCY.to_currency(),
+        order_body={'price': str(Decimal(rnd.randint(1, 10000)) / 1000000), 'quantity': str(rnd.randint(1, 100))},
+        order_id=str(i),
+        maker_order_id=maker_order_id,
+        created_at=utc_now,
+        updated_at=utc_now,
+    )
+
+
+def make_order_book(levels: int, rnd: random.Random) -> OrderBook:
+    bid = sorted(
+        (PriceLevel(Decimal(rnd.randint(1000, 2000)) / 100000, Decimal(rnd.randint(1, 100))) for _ in range(levels)),
+        key=lambda p: p.price, reverse=True
+    )
+    ask = sorted(
+        (PriceLevel(Decimal(rnd.randint(2000, 3000)) / 100000, Decimal(rnd.randint(1, 100))) for _ in range(levels)),
+        key=lambda p: p.price
+    )
+    return OrderBook(bid, ask, Decimal('10.1'), Decimal('9.8'))
+
+
+class _TakerExchange:
+    name = 'binance'
+    side = 'taker'
+    min_total_order_value = {'BTC': Decimal('0.0001'), 'ETH': Decimal('0.01'), 'USDT': Decimal('10')}
+
+    def calc_fee(self, total_asset: Decimal) -> Decimal:
+        return Decimal('0.001') * total_asset
+
+
+class _MakerExchange:
+    name = 'borderless'
+    side = 'maker'
+
+
+@benchmark('borderless.get_order_book', sizes=(10, 1000), full_sizes=(50000, ))
+async def bench_borderless_order_book(size):
+    import mm_bot.exchange.maker.borderless as borderless_module
+    import aiopubsub
+
+    rnd = random.Random(size)
+    orders = [make_borderless_order(i, rnd) for i in range(size)]
+
+    async def fake_js_cli(args, logger=None):
+        return orders
+    borderless_module._call_js_cli = fake_js_cli
+
+    borderless = borderless_module.Borderless(aiopubsub.Hub(), CURRENCY, '', '', '', '', '', '')
+
+    async def run():
+        await borderless.get_order_book(CURRENCY)
+    return run, size
+
+
+@benchmark('borderless.get_order_book.churn', sizes=(1000, ), full_sizes=(50000, ))
+async def bench_borderless_order_book_churn(size):
+    """
+    1/5 of the open orders are replaced by new ones before each call
+    """
+    import mm_bot.exchange.maker.borderless as borderless_module
+    import aiopubsub
+
+    rnd = random.Random(size)
+    orders = [make_borderless_order(i, rnd) for i in range(size)]
+    created = [size]
+
+    async def fake_js_cli(args, logger=None):
+        return orders
+    borderless_module._call_js_cli = fake_js_cli
+
+    borderless = borderless_module.Borderless(aiopubsub.Hub(), CURRENCY, '', '', '', '', '', '')
+
+    async def run():
+        for index in rnd.sample(range(size), size // 5):
+            orders[index] = make_borderless_order(created[0], rnd)
+            created[0] += 1
+        await borderless.get_order_book(CURRENCY)
+    return run, size
+
+
+@benchmark('borderless.get_order_status', sizes=(1000, ), full_sizes=(50000, ))
+async def bench_borderless_order_status(size):
+    """
+    size matched orders in the history of the wallet, one new match per call
+    """
+    import bisect
+    import mm_bot.exchange.maker.borderless as borderless_module
+    import aiopubsub
+
+    rnd = random.Random(size)
+    matches = [{'maker': make_borderless_order(i, rnd), 'taker': make_borderless_order(size + i, rnd)} for i in range(size)]
+    heights = [m['taker']['tradeHeight'] for m in matches]
+    open_orders = [make_maker_order(size * 2 + i, rnd) for i in range(10)]
+
+    async def fake_js_cli(args, logger=None):
+        # the matches by height, as the miner would index them
+        start = bisect.bisect_left(heights, int(args[args.index('--fromHeight') + 1])) if '--fromHeight' in args else 0
+        return matches[start:]
+    borderless_module._call_js_cli = fake_js_cli
+
+    borderless = borderless_module.Borderless(aiopubsub.Hub(), CURRENCY, '', '', '', '', '', '')
+    await borderless.get_order_status(open_orders)
+
+    async def run():
+        i = len(matches)
+        matches.append({'maker': make_borderless_order(i, rnd), 'taker': make_borderless_order(size + i, rnd)})
+        heights.append(matches[-1]['taker']['tradeHeight'])
+        await borderless.get_order_status(open_orders)
+    return run, 1
+
+
+def _make_strategy():
+    import aiopubsub
+    from mm_bot.strategy.cross_market import CrossMarketStrategy
+
+    return CrossMarketStrategy(
+        aiopubsub.Hub(), None, _TakerExchange(), _MakerExchange(), CURRENCY,
+        3, Decimal('0.001'), Decimal('100'), Decimal('0.00000001'), False
+    )
+
+
+@benchmark('strategy.calc_to_open', sizes=(1000, ))
+async def bench_calc_to_open(size):
+    strategy = _make_strategy()
+    rnd = random.Random(size)
+    books = [(make_order_book(20, rnd), make_order_book(20, rnd)) for _ in range(size)]
+
+    def run():
+        for taker_book, maker_book in books:
+            strategy.calc_buy_to_open(taker_book, maker_book)
+            strategy.calc_sell_to_open(taker_book, maker_book)
+    return run, size
+
+
+@benchmark('strategy.calculate_profitability', sizes=(1000, ))
+async def bench_calculate_profitability(size):
+    strategy = _make_strategy()
+    rnd = random.Random(size)
+    taker_book = make_order_book(20, rnd)
+    orders = [make_maker_order(i, rnd) for i in range(1, size * 4) if i % 4][:size]
+
+    def run():
+        for order in orders:
+            strategy.calculate_profitability(order, taker_book)
+    return run, len(orders)
+
+
+@benchmark('order.maker_price_quantity', sizes=(10000, ))
+async def bench_maker_price_quantity(size):
+    rnd = random.Random(size)
+    orders = [make_maker_order(i, rnd) for i in range(1, size * 4) if i % 4][:size]
+
+    def run():
+        for order in orders:
+            order.price()
+            order.quantity()
+    return run, len(orders)
+
+
+async def _make_repository(rows: int):
+    """
+    Seeds the table with a synchronous engine, so the seeding does not depend on the repository being benchmarked
+    """
+    import dataclasses
+    import sqlalchemy
+    from mm_bot.model.order import metadata, MakerOrdersTable, TakerOrdersTable
+    from mm_bot.model.repository import OrderRepository
+
+    db_dir = tempfile.mkdtemp(prefix='mmm_bot_bench_')
+    url = f'sqlite:///{db_dir}/bench.db'
+    engine = sqlalchemy.create_engine(url)
+    metadata.create_all(engine)
+
+    rnd = random.Random(rows)
+    statuses = [Status.OPEN] + [Status.SETTLED] * 8 + [Status.FILLED]
+    batch = 10000
+    with engine.begin() as connection:
+        for start in range(0, rows, batch):
+            makers = []
+            for i in range(start, min(rows, start + batch)):
+                maker = make_maker_order(i, rnd, rnd.choice(statuses))
+                maker.id = i + 1
+                makers.append(maker)
+            connection.execute(MakerOrdersTable.insert(), [dict(dataclasses.asdict(o), **o.scaled_values()) for o in makers])
+            takers = [make_taker_order(o.id, rnd, o.id, Status.FILLED) for o in makers if o.status != Status.OPEN]
+            connection.execute(TakerOrdersTable.insert(), [dict(dataclasses.asdict(o), **o.scaled_values()) for o in takers])
+
+    repository = OrderRepository(url)
+    _REPOSITORIES.append(repository)
+    return repository, rnd
+
+
+@benchmark('repository.create_orders', sizes=(10000, ), full_sizes=(100000, 1000000))
+async def bench_repository_create(size):
+    repository, rnd = await _make_repository(size)
+    count = 10
+    counter = [size]
+
+    async def run():
+        # new tx hashes on every run, they are unique
+        orders = [make_maker_order(counter[0] + i, rnd) for i in range(count)]
+        counter[0] += count
+        await repository.create_orders(orders)
+    return run, count
+
+
+@benchmark('repository.get_open_orders', sizes=(10000, ), full_sizes=(100000, 1000000))
+async def bench_repository_get_open(size):
+    repository, _ = await _make_repository(size)
+
+    async def run():
+        await repository.get_open_orders('maker')
+    return run, 1
+
+
+@benchmark('repository.get_filled_orders_in_range', sizes=(10000, ), full_sizes=(100000, ))
+async def bench_repository_filled_in_range(size):
+    repository, _ = await _make_repository(size)
+
+    async def run():
+        await repository.get_filled_orders_in_range(None, None)
+    return run, 1
+
+
+@benchmark('repository.get_order_pairs', sizes=(10000, ), full_sizes=(100000, 1000000))
+async def bench_repository_order_pairs(size):
+    repository, _ = await _make_repository(size)
+
+    async def run():
+        # the first page of the orders page of the webserver
+        await repository.get_order_pairs(limit=100)
+    return run, 1
+
+
+@benchmark('repository.update_orders', sizes=(10000, ), full_sizes=(100000, 1000000))
+async def bench_repository_update(size):
+    repository, _ = await _make_repository(size)
+    orders = (await repository.get_open_orders('maker'))[:100]
+
+    async def run():
+        for order in orders:
+            order.status = Status.OPEN if order.status == Status.FILLED else Status.FILLED
+        await repository.update_orders(orders)
+    return run, len(orders)
+
+
+@benchmark('repository.find_update_or_create_orders', sizes=(10000, ), full_sizes=(100000, 1000000))
+async def bench_repository_find_update_or_create(size):
+    repository, rnd = await _make_repository(size)
+    existing = (await repository.get_open_orders('maker'))[:50]
+    counter = [size]
+
+    async def run():
+        fresh = [make_maker_order(counter[0] + i, rnd) for i in range(50)]
+        counter[0] += 50
+        orders = [make_maker_order(0, rnd) for _ in existing] + fresh
+        for order, existing_order in zip(orders, existing):
+            order.tx_hash = existing_order.tx_hash
+            order.tx_output_index = existing_order.tx_output_index
+        await repository.find_update_or_create_orders(orders)
+    return run, 100
+
+
+@benchmark('repository.read_write_contention', sizes=(10000, ), full_sizes=(100000, ))
+async def bench_repository_contention(size):
+    """
+    The bot updating orders while the webserver, another repository on the same file, lists them
+    """
+    from mm_bot.model.repository import OrderRepository
+
+    repository, _ = await _make_repository(size)
+    webserver_repository = OrderRepository(str(repository._db.url))
+    _REPOSITORIES.append(webserver_repository)
+    orders = (await repository.get_open_orders('maker'))[:10]
+    writes, reads = 20, 20
+
+    async def write():
+        for _ in range(writes):
+            for order in orders:
+                order.status = Status.OPEN if order.status == Status.FILLED else Status.FILLED
+            await repository.update_orders(orders)
+
+    async def read():
+        for _ in range(reads):
+            await webserver_repository.get_open_orders('maker')
+
+    async def run():
+        await asyncio.gather(write(), read(), repository.get_open_orders('taker'))
+    return run, writes * len(orders) + reads + 1
+
+
+@benchmark('hub.publish_consume', sizes=(10000, ))
+async def bench_hub(size):
+    import aiopubsub
+
+    hub = aiopubsub.Hub()
+    publisher = aiopubsub.Publisher(hub, 'binance')
+    subscriber = aiopubsub.Subscriber(hub, 'bench')
+    subscriber.subscribe(('*', 'exchange', 'new_best'))
+    book = make_order_book(20, random.Random(size))
+
+    async def run():
+        for _ in range(size):
+            publisher.publish(('exchange', 'new_best'), book)
+        for _ in range(size):
+            await subscriber.consume()
+    return run, size
+
+
+async def _time(run: Runner, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        res = run()
+        if asyncio.iscoroutine(res):
+            await res
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+async def run_benchmarks(only: str, full: bool, repeat: int) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for name, sizes, full_sizes, setup in BENCHMARKS:
+        if only and only not in name:
+            continue
+
+        for size in sizes + (full_sizes if full else ()):
+            key = f'{name}[{size}]'
+            try:
+                run, operations = await setup(size)
+                seconds = await _time(run, repeat)
+            except ImportError as e:
+                print(f'{key:<55} skipped, {e}')
+                continue
+            except Exception as e:
+                print(f'{key:<55} failed, {e!r}')
+                results[key] = {'error': repr(e)}
+                continue
+
+            results[key] = {
+                'seconds': seconds,
+                'seconds_per_op': seconds / operations,
+                'ops_per_sec': operations / seconds if seconds else float('inf'),
+            }
+            print(f'{key:<55} {seconds * 1000:>12.3f} ms {results[key]["ops_per_sec"]:>14.1f} ops/s')
+
+    for repository in _REPOSITORIES:
+        await repository.close()
+
+    return results
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], tolerance: float) -> List[str]:
+    regressions = []
+    for key, result in results.items():
+        if 'error' in result:
+            regressions.append(f'{key}: {result["error"]}')
+            continue
+
+        if key not in baseline or 'error' in baseline[key]:
+            continue
+
+        before = baseline[key]['seconds_per_op']
+        after = result['seconds_per_op']
+        if after > before * (1 + tolerance):
+            regressions.append(f'{key}: {before:.9f} -> {after:.9f} s/op (+{(after / before - 1) * 100:.1f}%)')
+
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', default='', help='run only the benchmarks containing this string')
+    parser.add_argument('--full', action='store_true', help='run the large sizes as well (up to 1M rows)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default=None, help='write the results as json to this file')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='allowed slowdown against the baseline, 0.25 is 25%%')
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+
+    results = asyncio.get_event_loop().run_until_complete(run_benchmarks(args.only, args.full, args.repeat))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.isfile(args.baseline):
+            with open(args.baseline, 'r') as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f'Saved baseline to {args.baseline}')
+        return 0
+
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    else:
+        print(f'No baseline at {args.baseline}, run with --save-baseline to create one')
+
+    regressions = compare(results, baseline, args.tolerance)
+
+    if regressions:
+        print(f'\nFailures or regressions over {args.tolerance * 100:.0f}%:')
+        print('\n'.join(regressions))
+        return 1
+
+    print(f'\nNo regressions over {args.tolerance * 100:.0f}%')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
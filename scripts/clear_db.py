@@ -16,8 +16,10 @@ url = config('database_url', parser=str)
 order_repository = OrderRepository(url)
 
 async def main():
-    await order_repository._db.execute('delete from taker_orders')
-    await order_repository._db.execute('delete from maker_orders')
+    # the taker orders before the maker orders they refer to, on sqlite and postgresql
+    for table in reversed(metadata.sorted_tables):
+        await order_repository._db.execute(table.delete())
+    await order_repository.close()
 
 if __name__ == '__main__':
     asyncio.run(main())
@@ -0,0 +1,256 @@
+"""
+End to end load test of the bot against the simulated exchanges
+
+In the root dir of the project:
+
+    poetry run python -m scripts.loadtest --duration 60 --updates-per-sec 100
+    poetry run python -m scripts.loadtest --miner-latency 0.3 --miner-error-rate 0.05 --binance-error-rate 0.01
+
+Wires the strategy exactly like mmm_bot.py, but the js cli calls are answered
+by mm_bot.simulation.js_cli and binance is served by mm_bot.simulation.fake_binance.
+Reports the strategy tick throughput, the latency from a book change in the
+market to the end of the tick that consumed it, and the resource usage.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+TMP_DIR = tempfile.mkdtemp(prefix='mmm_bot_loadtest_')
+
+# the config is read on import (ex CrossMarketStrategy.HEARTBEAT_DELAY), the loops run without delays
+for key, value in {
+    'MMBC_STRATEGY_NAME': 'loadtest',
+    'MMBC_DRY_RUN': 'false',
+    'MMBC_SLEEP': '0',
+    'MMBC_EXCHANGE_BINANCE_LOOP_DELAY': '0',
+    'MMBC_EXCHANGE_BORDERLESS_LOOP_DELAY': '0',
+    'MMBC_DATABASE_URL': f'sqlite:///{TMP_DIR}/loadtest.sqlite',
+    'MMBC_WALLET_BASE_CURRENCY_NAME': 'LSK',
+    'MMBC_WALLET_COUNTER_CURRENCY_NAME': 'BTC',
+    'MMBC_WALLET_BASE_CURRENCY_WALLET': '2570416870016743267L',
+    'MMBC_WALLET_COUNTER_CURRENCY_WALLET': '1AJP6ck7XkhhTT7QTrn7U81UczmxgX3Azn',
+    'MMBC_EXCHANGE_DESTINATION_MINER_ADDRESS': 'http://localhost:3000',
+    'MMBC_EXCHANGE_DESTINATION_NRG_PUBLIC_KEY': '0x0000000000000000000000000000000000000000',
+    'MMBC_EXCHANGE_DESTINATION_NRG_PRIVATE_KEY': '00' * 32,
+    'MMBC_EXCHANGE_SOURCE_API_KEY': 'loadtest',
+    'MMBC_EXCHANGE_SOURCE_API_SECRET': 'loadtest',
+}.items():
+    os.environ.setdefault(key, value)
+
+import aiopubsub
+import sqlalchemy
+
+import mmm_bot
+from mm_bot.config import config
+from mm_bot.config.settings import Settings
+from mm_bot.exchange.maker import borderless as borderless_module
+from mm_bot.memory_monitor import get_hub_queue_sizes, get_rss_bytes
+from mm_bot.model.currency import CurrencyPair
+from mm_bot.model.order import metadata
+from mm_bot.model.repository import OrderRepository
+from mm_bot.simulation.fake_binance import FakeBinance
+from mm_bot.simulation.js_cli import FakeJsCli
+from mm_bot.simulation.market import Faults, SimulatedMarket
+
+LOGGER = logging.getLogger('market_maker_bot.loadtest')
+
+RESOURCE_SAMPLE_INTERVAL = 1 # in seconds
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+
+    values = sorted(values)
+    def at(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 3)
+
+    return {
+        'count': len(values),
+        'mean_ms': round(statistics.mean(values) * 1000, 3),
+        'p50_ms': at(0.5),
+        'p90_ms': at(0.9),
+        'p99_ms': at(0.99),
+        'max_ms': round(values[-1] * 1000, 3),
+    }
+
+
+class Probe:
+    """
+    Instruments the strategy and the exchanges it is wired with
+
+    The fetched order books are stamped with the time the market last changed
+    them, the stamp of the book consumed by a tick is compared with the time
+    the tick finishes (in `_heartbeat`).
+    """
+
+    def __init__(self, strategy, market: SimulatedMarket):
+        self.ticks = 0
+        self.tick_errors = 0
+        self.fetches = {}
+        self.latencies: List[float] = []
+        self._consumed_at = None
+
+        for exchange in (strategy.maker_exchange, strategy.taker_exchange):
+            self.fetches[exchange.name] = 0
+            exchange.get_order_book = self._stamp(exchange, market)
+
+        update_order_book = strategy._update_order_book
+        def _update_order_book(exchange, value):
+            self._consumed_at = getattr(value, '_simulated_at', None)
+            update_order_book(exchange, value)
+        strategy._update_order_book = _update_order_book
+
+        heartbeat = strategy._heartbeat
+        def _heartbeat(error):
+            self.ticks += 1
+            if error:
+                self.tick_errors += 1
+            if self._consumed_at is not None:
+                self.latencies.append(time.time() - self._consumed_at)
+                self._consumed_at = None
+            heartbeat(error)
+        strategy._heartbeat = _heartbeat
+
+    def _stamp(self, exchange, market: SimulatedMarket):
+        get_order_book = exchange.get_order_book
+
+        async def stamped_get_order_book(currency):
+            updated_at = market.updated_at[exchange.name]
+            order_book = await get_order_book(currency)
+            order_book._simulated_at = updated_at
+            self.fetches[exchange.name] += 1
+            return order_book
+
+        return stamped_get_order_book
+
+
+async def sample_resources(samples: List[Dict[str, Any]], hub: aiopubsub.Hub) -> None:
+    while True:
+        samples.append({
+            'rss_bytes': get_rss_bytes(),
+            'asyncio_tasks': len(asyncio.all_tasks()),
+            'hub_queue_size': sum(get_hub_queue_sizes(hub).values()),
+        })
+        await asyncio.sleep(RESOURCE_SAMPLE_INTERVAL)
+
+
+async def run_loadtest(args) -> Dict[str, Any]:
+    currency = CurrencyPair(
+        config('wallet_base_currency_name', parser=lambda s: str(s).upper()),
+        config('wallet_counter_currency_name', parser=lambda s: str(s).upper()),
+    )
+    market = SimulatedMarket(currency, depth=args.depth, churn=args.churn, fill_rate=args.fill_rate, seed=args.seed)
+
+    fake_binance = FakeBinance(
+        market, Faults(args.binance_latency, args.binance_jitter, args.binance_error_rate), seed=args.seed
+    )
+    # the market is updated from the thread of the fake binance, so a busy bot shows up as latency
+    fake_binance.start_in_thread(args.updates_per_sec)
+    fake_js_cli = FakeJsCli(
+        market, Faults(args.miner_latency, args.miner_jitter, args.miner_error_rate),
+        spawn_delay=args.spawn_delay, seed=args.seed
+    )
+    borderless_module._call_js_cli = fake_js_cli
+    borderless_module.PRICE_API_URL = f'{fake_binance.url}/api/v3/ticker/price'
+
+    metadata.create_all(sqlalchemy.create_engine(config('database_url', parser=str)))
+
+    hub = aiopubsub.Hub()
+    order_repository = OrderRepository(config('database_url', parser=str))
+    strategy = mmm_bot.create_strategy(hub, order_repository, Settings.from_config())
+    strategy.taker_exchange._client.API_URL = f'{fake_binance.url}/api'
+    probe = Probe(strategy, market)
+
+    resource_samples: List[Dict[str, Any]] = []
+    sampler = asyncio.ensure_future(sample_resources(resource_samples, hub))
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    updates_before = market.updates
+    started_at = time.monotonic()
+
+    LOGGER.info('Running for %ss at %s book updates/s, state in %s', args.duration, args.updates_per_sec, TMP_DIR)
+    strategy.start()
+    try:
+        await asyncio.sleep(args.duration)
+    finally:
+        elapsed = time.monotonic() - started_at
+        # every step runs even if one before failed, a live thread or db connection would hang the exit
+        try:
+            await strategy.stop()
+        finally:
+            try:
+                sampler.cancel()
+                await order_repository.close()
+            finally:
+                fake_binance.stop_thread()
+
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_seconds = (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime)
+    rss = [sample['rss_bytes'] for sample in resource_samples]
+
+    return {
+        'duration_s': round(elapsed, 3),
+        'book_updates': market.updates - updates_before,
+        'book_updates_per_s': round((market.updates - updates_before) / elapsed, 2),
+        'ticks': probe.ticks,
+        'ticks_per_s': round(probe.ticks / elapsed, 2),
+        'tick_errors': probe.tick_errors,
+        'order_book_fetches': probe.fetches,
+        'latency': _percentiles(probe.latencies),
+        'maker_orders_open': len(market.maker_orders),
+        'maker_orders_matched': len(market.matched_orders),
+        'taker_orders': len(market.taker_orders),
+        'js_cli_calls': fake_js_cli.calls,
+        'binance_calls': fake_binance.calls,
+        'cpu_s': round(cpu_seconds, 3),
+        'cpu_utilization': round(cpu_seconds / elapsed, 3),
+        'rss_start_bytes': rss[0] if rss else None,
+        'rss_peak_bytes': max(rss) if rss else None,
+        'rss_end_bytes': rss[-1] if rss else None,
+        'max_asyncio_tasks': max((sample['asyncio_tasks'] for sample in resource_samples), default=None),
+        'max_hub_queue_size': max((sample['hub_queue_size'] for sample in resource_samples), default=None),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=60, help='in seconds')
+    parser.add_argument('--updates-per-sec', type=float, default=100, help='book updates per second, both venues together')
+    parser.add_argument('--depth', type=int, default=20, help='levels per side in binance, orders per side in borderless')
+    parser.add_argument('--churn', type=float, default=0.2, help='share of the borderless orders replaced per update')
+    parser.add_argument('--fill-rate', type=float, default=0.01, help='probability of a maker order to be matched per update')
+    parser.add_argument('--miner-latency', type=float, default=0.0, help='in seconds, added to every js cli call')
+    parser.add_argument('--miner-jitter', type=float, default=0.0)
+    parser.add_argument('--miner-error-rate', type=float, default=0.0)
+    parser.add_argument('--spawn-delay', type=float, default=0.0, help='in seconds, node start up of every js cli call')
+    parser.add_argument('--binance-latency', type=float, default=0.0, help='in seconds, added to every request')
+    parser.add_argument('--binance-jitter', type=float, default=0.0)
+    parser.add_argument('--binance-error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='write the report as json to this file')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.getLevelName(os.environ.get('MMBC_LOGLEVEL', 'WARNING').upper()),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    )
+    report = asyncio.get_event_loop().run_until_complete(run_loadtest(args))
+
+    print(json.dumps(report, indent=2, sort_keys=True))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
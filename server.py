@@ -8,6 +8,7 @@ import yaml
 import time
 import logging
 import subprocess
+import threading
 import base64
 
 
@@ -15,10 +16,6 @@ from datetime import datetime, timezone
 from functools import wraps
 from glob import glob
 
-import binance
-from binance.client import Client as BinanceClient
-from binance.exceptions import BinanceAPIException, BinanceWithdrawException
-
 from sanic import Blueprint, Sanic
 from sanic.response import json as json_response
 from sanic.response import html, redirect, file_stream
@@ -45,7 +42,9 @@ jinja_env = Environment(loader=PackageLoader('server', 'server/templates'))
 
 from mm_bot.config import config
 from mm_bot.config.validator import REQUIRED_PARAMS, STRATEGY_NAME_KEY
-from mm_bot.helpers import get_config_path, signal_config_reloaded, LOGS_FILE_PATTERN
+from mm_bot.helpers import get_config_path, signal_config_reloaded, signal_profile_requested, LOGS_FILE_PATTERN, PROFILES_FILE_PATTERN, MEMORY_STATS_FILE
+from mm_bot.profiling import PROFILE_MODES, MAX_PROFILE_DURATION
+from mm_bot.model.constants import Status
 from mm_bot.model.repository import OrderRepository
 
 url = config('database_url', parser=str)
@@ -71,6 +70,10 @@ def get_borderless_balance(endpoint, public_key, scookie):
         return False
 
 def validate_binance_key(api_key, api_secret):
+    # binance is imported on use, the server starts without it
+    import binance
+    from binance.exceptions import BinanceAPIException, BinanceWithdrawException
+
     try:
         client = binance.Client(api_key, api_secret)
 
@@ -182,7 +185,7 @@ async def load_config(request):
 @authorized()
 async def get_monitor_page(request):
     template = jinja_env.get_template('monitor.html')
-    html_content = template.render()
+    html_content = template.render(strategy_name=config(STRATEGY_NAME_KEY, default='cross_market', parser=str))
 
     return html(html_content)
 
@@ -240,6 +243,43 @@ async def get_bot_heartbeat(request):
     return json_response({'health': health, 'reason': reason, 'heartbeat_at_utc': utc, 'error': error})
 
 
+@app.route('/bot_memory', methods=["GET"])
+@authorized()
+async def get_bot_memory(request):
+    if not os.path.isfile(MEMORY_STATS_FILE):
+        return json_response({'stats': None})
+
+    # only the latest sample is needed, avoid reading the whole history
+    with open(MEMORY_STATS_FILE, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - 64 * 1024))
+        lines = f.read().splitlines()
+
+    stats = json.loads(lines[-1]) if lines else None
+    return json_response({'stats': stats})
+
+
+@app.route('/bot_profile', methods=["POST"])
+@authorized()
+async def request_profile(request):
+    mode = request.json.get('mode', '').strip().lower()
+    if mode not in PROFILE_MODES:
+        return json_response({'status': 'error', 'reason': f'mode has to be one of {PROFILE_MODES}'}, status=400)
+
+    try:
+        duration = int(request.json.get('duration', 30))
+    except (TypeError, ValueError):
+        return json_response({'status': 'error', 'reason': 'duration has to be an integer'}, status=400)
+    duration = max(1, min(duration, MAX_PROFILE_DURATION))
+
+    strategy = request.json.get(STRATEGY_NAME_KEY)
+    if not strategy:
+        return json_response({'status': 'error', 'reason': f'{STRATEGY_NAME_KEY} is required'}, status=400)
+    signal_profile_requested(strategy, mode, duration)
+
+    return json_response({'status': 'ok', 'mode': mode, 'duration': duration})
+
+
 @app.route('/logs', methods=["GET"])
 @authorized()
 async def get_logs(request):
@@ -255,8 +295,14 @@ async def get_logs(request):
 
         logs.append((datetime.fromtimestamp(int(timestamp), tz=timezone.utc).isoformat(), log, url_path))
 
+    profiles = []
+    for profile in sorted(list(glob(PROFILES_FILE_PATTERN + '*')), reverse=True):
+        url_path = profile[len(PROFILES_FILE_PATTERN):]
+        timestamp, mode = url_path.split('.')[0].split('-', 1)
+        profiles.append((datetime.fromtimestamp(int(timestamp), tz=timezone.utc).isoformat(), mode, profile, url_path))
+
     template = jinja_env.get_template('logs.html')
-    html_content = template.render(logs=logs)
+    html_content = template.render(logs=logs, profiles=profiles)
 
     return html(html_content)
 
@@ -267,35 +313,49 @@ async def download_log(request, filename):
 
     return await file_stream(logfile_path)
 
+@app.route('/logs/profiles/<filename>', methods=["GET"])
+@authorized()
+async def download_profile(request, filename):
+    profile_path = PROFILES_FILE_PATTERN + os.path.basename(filename)
+    if not os.path.isfile(profile_path):
+        raise NotFound(f'Profile {filename} not found')
+
+    return await file_stream(profile_path)
+
 @app.route('/orders', methods=["GET"])
 @authorized()
 async def get_orders(request):
-    maker_orders = await order_repository.get_all_orders('maker')
-    taker_orders = await order_repository.get_all_orders('taker')
-
-    maker_id_to_taker_order = {t.maker_order_id: t for t in taker_orders}
-
-    sorted_maker_orders = sorted(maker_orders, key=lambda o: o.id, reverse=True)
-
-    maker_taker_order_pairs_by_currency = {}
-    for maker_order in sorted_maker_orders:
-        taker = maker_id_to_taker_order.get(maker_order.id, None)
-        if taker:
-            taker = taker.as_object()
-        pair = {
-            "maker": maker_order.as_object(),
-            "taker": taker,
-        }
-        currency = maker_order.currency
-        if currency not in maker_taker_order_pairs_by_currency:
-            maker_taker_order_pairs_by_currency[currency] = []
-        maker_taker_order_pairs_by_currency[currency].append(pair)
+    # the orders are loaded page by page from /api/orders
+    currencies = await order_repository.get_order_currencies(include_archive=True)
 
     template = jinja_env.get_template('orders.html')
-    html_content = template.render(maker_taker_order_pairs_by_currency=maker_taker_order_pairs_by_currency)
+    html_content = template.render(currencies=currencies, statuses=[Status.OPEN, Status.FILLED, Status.SETTLED, Status.CANCELED, Status.EXPIRED])
 
     return html(html_content)
 
+@app.route('/api/orders', methods=["GET"])
+@authorized()
+async def get_orders_page(request):
+    page_size = config('server_orders_page_size', parser=int)
+    try:
+        before_id = request.args.get('before')
+        before_id = int(before_id) if before_id else None
+        limit = max(1, min(int(request.args.get('limit', page_size)), page_size))
+    except ValueError:
+        return json_response({'error': 'before and limit must be integers'}, status=400)
+
+    pairs = await order_repository.get_order_pairs(
+        currency=request.args.get('currency') or None,
+        status=request.args.get('status') or None,
+        before_id=before_id,
+        limit=limit,
+        include_archive=request.args.get('history', 'false').lower() == 'true',
+    )
+    # a full page may be followed by another one
+    next_before_id = pairs[-1]['maker']['id'] if len(pairs) == limit else None
+
+    return json_response({'orders': pairs, 'next': next_before_id})
+
 @app.route('/test_binance_keys', methods=["GET"])
 @authorized()
 async def test_bc_params(request):
@@ -322,6 +382,8 @@ async def exchange_wallet(request):
     api_secret = request.json.get('api_secret')
     assets = request.json.get('assets')
 
+    from binance.client import Client as BinanceClient
+
     binance_client = BinanceClient(api_key, api_secret)
 
     res = {}
@@ -356,8 +418,10 @@ async def save_config(request):
     config_path = get_config_path(strategy)
     print('Saving to ', config_path)
 
-    with open(config_path, 'w') as f:
+    # replaced at once, the bot reloads it as soon as it changes
+    with open(f'{config_path}.tmp', 'w') as f:
         f.write('\n'.join(config_lines))
+    os.replace(f'{config_path}.tmp', config_path)
 
     signal_config_reloaded(strategy)
     return redirect('/')
@@ -365,21 +429,27 @@ async def save_config(request):
 
 def get_my_public_ip():
     try:
-        res = requests.get("https://httpbin.org/ip")
+        res = requests.get("https://httpbin.org/ip", timeout=10)
         data = res.json()
         return data['origin']
     except:
         return None
 
+def print_public_url(port):
+    """
+    In a thread, the server does not wait for httpbin to start
+    """
+    ip = get_my_public_ip()
+    if ip is not None:
+        print(f'          OR \n')
+        print(f'          http://{ip}:{port}?token={app.token}\n\n', flush=True)
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 38080))
-    ip = get_my_public_ip()
 
     print(f'\n\n[MMM_BOT] Please copy and paste the URL to config your bot:')
-    print(f'          http://localhost:{port}?token={app.token}\n')
-    if ip is not None:
-        print(f'          OR \n')
-        print(f'          http://{ip}:{port}?token={app.token}\n\n')
+    print(f'          http://localhost:{port}?token={app.token}\n', flush=True)
+    threading.Thread(target=print_public_url, args=(port, ), daemon=True).start()
 
     if os.environ.get('APP_ENV', 'dev') != 'prod':
         debug = True